@@ -27,11 +27,11 @@ from apps.dc_algorithm.models import (Query as BaseQuery, Metadata as BaseMetada
                                       BaseResultType, UserHistory as BaseUserHistory, AnimationType as
                                       BaseAnimationType, ToolInfo as BaseToolInfo)
 
-from utils.data_cube_utilities.dc_mosaic import create_mosaic
+from apps.dc_algorithm.compositors import create_mosaic_with_clear_counts
+from apps.dc_algorithm.masking import count_clear
 
 import datetime
 import numpy as np
-import xarray as xr
 
 
 class UserHistory(BaseUserHistory):
@@ -95,39 +95,14 @@ class Query(BaseQuery):
 
         See the base query class docstring for more information.
         """
+        return create_mosaic_with_clear_counts
 
-        def clear_percentage(dataset_in, clean_mask, intermediate_product=None, no_data=-9999):
-            """Calculate the total number of clear pixels and the total number of pixels
-
-            Args:
-                dataset_in: input dataset - must have time dimension.
-                clean_mask: numpy boolean mask of the same shape as data
-                intermediate_product: optional intermediate - can do one timeslice at a time.
-
-            Returns:
-                xarray dataset with total_pixels, total_clear, clear_percentage
-            """
-            num_acq = len(dataset_in.time)
-            num_clear = np.sum(clean_mask.astype(np.int8), axis=0)
-            if intermediate_product is None:
-                intermediate_product = xr.Dataset(
-                    {
-                        'total_pixels': (('latitude', 'longitude'), np.full(num_clear.shape, num_acq)),
-                        'total_clear': (('latitude', 'longitude'), num_clear)
-                    },
-                    coords={'latitude': dataset_in.latitude,
-                            'longitude': dataset_in.longitude})
-                intermediate_product[
-                    'clear_percentage'] = intermediate_product.total_clear / intermediate_product.total_pixels
-                return intermediate_product
-
-            intermediate_product['total_pixels'] += num_acq
-            intermediate_product['total_clear'] += num_clear
-            intermediate_product[
-                'clear_percentage'] = intermediate_product.total_clear / intermediate_product.total_pixels
-            return intermediate_product
-
-        return create_mosaic, clear_percentage
+    def get_required_measurements(self):
+        """implements get_required_measurements as required by the base class
+
+        See the base query class docstring for more information.
+        """
+        return self.get_png_measurements()
 
     @classmethod
     def get_or_create_query_from_post(cls, form_data, pixel_drill=False):
@@ -151,13 +126,7 @@ class Query(BaseQuery):
         valid_query_fields = [field.name for field in cls._meta.get_fields()]
         query_data = {key: query_data[key] for key in valid_query_fields if key in query_data}
 
-        try:
-            query = cls.objects.get(pixel_drill_task=pixel_drill, **query_data)
-            return query, False
-        except cls.DoesNotExist:
-            query = cls(pixel_drill_task=pixel_drill, **query_data)
-            query.save()
-            return query, True
+        return cls.get_or_create_query(query_data, pixel_drill=pixel_drill)
 
 
 class Metadata(BaseMetadata):
@@ -181,7 +150,7 @@ class Metadata(BaseMetadata):
         See the base metadata class docstring for more information.
         """
         for metadata_index, time in enumerate(dataset.time.values.astype('M8[ms]').tolist()):
-            clean_pixels = np.sum(clear_mask[metadata_index, :, :] == True)
+            clean_pixels = count_clear(clear_mask, metadata_index)
             if time not in metadata:
                 metadata[time] = {}
                 metadata[time]['clean_pixels'] = 0
@@ -10,15 +10,19 @@ import imageio
 
 from utils.data_cube_utilities.data_access_api import DataAccessApi
 from utils.data_cube_utilities.dc_utilities import (create_cfmask_clean_mask, create_bit_mask, write_geotiff_from_xr,
-                                                    write_png_from_xr, write_single_band_png_from_xr,
-                                                    add_timestamp_data_to_xr, clear_attrs)
+                                                    write_png_from_xr, add_timestamp_data_to_xr, clear_attrs)
 from utils.data_cube_utilities.dc_chunker import (create_geographic_chunks, create_time_chunks,
                                                   combine_geographic_chunks)
 from apps.dc_algorithm.utils import create_2d_plot
+from apps.dc_algorithm.colorize import write_single_band_png
+from apps.dc_algorithm.data_access import (search_datasets, select_datasets, group_datasets_by_geographic_chunk,
+                                           get_acquisition_dates, load_datasets, create_storage_aligned_chunks)
 from utils.data_cube_utilities.import_export import export_xarray_to_netcdf
+from apps.dc_algorithm.chunk_transport import store_chunk, open_chunk
 
 from .models import CloudCoverageTask
 from apps.dc_algorithm.tasks import DCAlgorithmBase, check_cancel_task, task_clean_up
+from apps.dc_algorithm.pipelines import record_pipeline
 
 logger = get_task_logger(__name__)
 
@@ -60,7 +64,7 @@ def parse_parameters_from_task(self, task_id=None):
         'time': (task.time_start, task.time_end),
         'longitude': (task.longitude_min, task.longitude_max),
         'latitude': (task.latitude_min, task.latitude_max),
-        'measurements': task.satellite.get_measurements()
+        'measurements': task.get_measurements()
     }
 
     task.execution_start = datetime.now()
@@ -88,8 +92,11 @@ def validate_parameters(self, parameters, task_id=None):
 
     dc = DataAccessApi(config=task.config_path)
 
+    # the only index search for this task - the datasets are passed down to the chunk processing tasks.
+    datasets = search_datasets(dc, **parameters)
+
     #validate for any number of criteria here - num acquisitions, etc.
-    acquisitions = dc.list_acquisition_dates(**parameters)
+    acquisitions = get_acquisition_dates(datasets)
 
     if len(acquisitions) < 1:
         task.complete = True
@@ -108,7 +115,7 @@ def validate_parameters(self, parameters, task_id=None):
         return None
 
     dc.close()
-    return parameters
+    return {**parameters, 'datasets': datasets}
 
 
 @task(name="cloud_coverage.perform_task_chunking", base=BaseTask, bind=True)
@@ -122,7 +129,7 @@ def perform_task_chunking(self, parameters, task_id=None):
         parameters: parameter stream containing all kwargs to load data
 
     Returns:
-        parameters with a list of geographic and time ranges
+        parameters with a list of geographic and time ranges and the datasets in each geographic chunk
     """
     if parameters is None:
         return None
@@ -130,11 +137,12 @@ def perform_task_chunking(self, parameters, task_id=None):
     task = CloudCoverageTask.objects.get(pk=task_id)
     if check_cancel_task(self, task): return
 
-    dc = DataAccessApi(config=task.config_path)
-    dates = dc.list_acquisition_dates(**parameters)
+    datasets = parameters.pop('datasets')
+    dates = get_acquisition_dates(datasets)
     task_chunk_sizing = task.get_chunk_size()
 
-    geographic_chunks = create_geographic_chunks(
+    geographic_chunks = create_storage_aligned_chunks(
+        datasets,
         longitude=parameters['longitude'],
         latitude=parameters['latitude'],
         geographic_chunk_size=task_chunk_sizing['geographic'])
@@ -142,10 +150,14 @@ def perform_task_chunking(self, parameters, task_id=None):
     time_chunks = create_time_chunks(
         dates, _reversed=task.get_reverse_time(), time_chunk_size=task_chunk_sizing['time'])
 
-    dc.close()
     if check_cancel_task(self, task): return
     task.update_status("WAIT", "Chunked parameter set.")
-    return {'parameters': parameters, 'geographic_chunks': geographic_chunks, 'time_chunks': time_chunks}
+    return {
+        'parameters': parameters,
+        'geographic_chunks': geographic_chunks,
+        'time_chunks': time_chunks,
+        'geographic_chunk_datasets': group_datasets_by_geographic_chunk(datasets, geographic_chunks)
+    }
 
 
 @task(name="cloud_coverage.start_chunk_processing", base=BaseTask, bind=True)
@@ -165,6 +177,7 @@ def start_chunk_processing(self, chunk_details, task_id=None):
     parameters = chunk_details.get('parameters')
     geographic_chunks = chunk_details.get('geographic_chunks')
     time_chunks = chunk_details.get('time_chunks')
+    geographic_chunk_datasets = chunk_details.get('geographic_chunk_datasets')
 
     task = CloudCoverageTask.objects.get(pk=task_id)
 
@@ -187,10 +200,12 @@ def start_chunk_processing(self, chunk_details, task_id=None):
                 time_chunk_id=time_index,
                 geographic_chunk=geographic_chunk,
                 time_chunk=time_chunk,
+                datasets=select_datasets(geographic_chunk_datasets[geo_index], time=time_chunk),
                 **parameters) for time_index, time_chunk in enumerate(time_chunks)
         ]) for geo_index, geographic_chunk in enumerate(geographic_chunks)
     ]) | recombine_geographic_chunks.s(task_id=task_id) | create_output_products.s(task_id=task_id)\
        | task_clean_up.si(task_id=task_id, task_model='CloudCoverageTask')).apply_async()
+    record_pipeline(task_id, processing_pipeline)
 
     return True
 
@@ -202,6 +217,7 @@ def processing_task(self,
                     time_chunk_id=None,
                     geographic_chunk=None,
                     time_chunk=None,
+                    datasets=None,
                     **parameters):
     """Process a parameter set and save the results to disk.
 
@@ -214,6 +230,7 @@ def processing_task(self,
         task_id, geo_chunk_id, time_chunk_id: identification for the main task and what chunk this is processing
         geographic_chunk: range of latitude and longitude to load - dict with keys latitude, longitude
         time_chunk: list of acquisition dates
+        datasets: list of datasets resolved by the planner that intersect this chunk
         parameters: all required kwargs to load data.
 
     Returns:
@@ -229,7 +246,6 @@ def processing_task(self,
         return None
 
     iteration_data = None
-    cloud_cover = None
     metadata = {}
 
     def _get_datetime_range_containing(*time_ranges):
@@ -244,7 +260,7 @@ def processing_task(self,
     base_index = (task.get_chunk_size()['time'] if task.get_chunk_size()['time'] is not None else 1) * time_chunk_id
     for time_index, time in enumerate(times):
         updated_params.update({'time': time})
-        data = dc.get_dataset_by_extent(**updated_params)
+        data = load_datasets(dc, select_datasets(datasets, time=time), **updated_params)
 
         if check_cancel_task(self, task): return
 
@@ -252,20 +268,17 @@ def processing_task(self,
             logger.info("Invalid chunk.")
             continue
 
-        clear_mask = task.satellite.get_clean_mask_func()(data)
+        clear_mask = task.satellite.get_clean_mask_func(packed=True)(data)
         metadata = task.metadata_from_dataset(metadata, data, clear_mask, updated_params)
 
         if check_cancel_task(self, task): return
 
-        mosaic, cloud_coverage = task.get_processing_method()
-        iteration_data = mosaic(
+        iteration_data = task.get_processing_method()(
             data,
             clean_mask=clear_mask,
             intermediate_product=iteration_data,
             no_data=task.satellite.no_data_value,
             reverse_time=task.get_reverse_time())
-        cloud_cover = cloud_coverage(
-            data, clean_mask=clear_mask, intermediate_product=cloud_cover, no_data=task.satellite.no_data_value)
 
         if check_cancel_task(self, task): return
 
@@ -275,10 +288,8 @@ def processing_task(self,
     if iteration_data is None:
         return None
 
-    full_product = xr.merge([iteration_data, cloud_cover])
-
     path = os.path.join(task.get_temp_path(), chunk_id + ".nc")
-    export_xarray_to_netcdf(full_product, path)
+    store_chunk(task.apply_dtype_policy(iteration_data), path)
     dc.close()
     logger.info("Done with chunk: " + chunk_id)
     return path, metadata, {'geo_chunk_id': geo_chunk_id, 'time_chunk_id': time_chunk_id}
@@ -313,11 +324,11 @@ def recombine_geographic_chunks(self, chunks, task_id=None):
     chunk_data = []
     for index, chunk in enumerate(total_chunks):
         metadata = task.combine_metadata(metadata, chunk[1])
-        chunk_data.append(xr.open_dataset(chunk[0]))
+        chunk_data.append(open_chunk(chunk[0]))
     combined_data = combine_geographic_chunks(chunk_data)
 
     path = os.path.join(task.get_temp_path(), "recombined_geo_{}.nc".format(time_chunk_id))
-    export_xarray_to_netcdf(combined_data, path)
+    store_chunk(combined_data, path)
     logger.info("Done combining geographic chunks for time: " + str(time_chunk_id))
     return path, metadata, {'geo_chunk_id': geo_chunk_id, 'time_chunk_id': time_chunk_id}
 
@@ -340,7 +351,7 @@ def create_output_products(self, data, task_id=None):
     if check_cancel_task(self, task): return
 
     full_metadata = data[1]
-    dataset = xr.open_dataset(data[0])
+    dataset = open_chunk(data[0])
 
     task.result_path = os.path.join(task.get_result_path(), "cloud_coverage.png")
     task.mosaic_path = os.path.join(task.get_result_path(), "mosaic.png")
@@ -349,19 +360,20 @@ def create_output_products(self, data, task_id=None):
     task.final_metadata_from_dataset(dataset)
     task.metadata_from_dict(full_metadata)
 
-    bands = task.satellite.get_measurements() + ['total_pixels', 'total_clear', 'clear_percentage']
+    bands = task.get_measurements() + ['total_pixels', 'total_clear', 'clear_percentage']
 
     png_bands = ['red', 'green', 'blue']
 
     export_xarray_to_netcdf(dataset, task.data_netcdf_path)
-    write_geotiff_from_xr(task.data_path, dataset.astype('float64'), bands=bands, no_data=task.satellite.no_data_value)
+    write_geotiff_from_xr(
+        task.data_path, dataset.astype(task.processing_dtype), bands=bands, no_data=task.satellite.no_data_value)
     write_png_from_xr(
         task.mosaic_path,
         dataset,
         bands=png_bands,
         scale=task.satellite.get_scale(),
         no_data=task.satellite.no_data_value)
-    write_single_band_png_from_xr(
+    write_single_band_png(
         task.result_path,
         dataset,
         band='clear_percentage',
@@ -26,6 +26,7 @@ from apps.dc_algorithm.models import Area, Compositor, Satellite
 from apps.dc_algorithm.models import (Query as BaseQuery, Metadata as BaseMetadata, Result as BaseResult, ResultType as
                                       BaseResultType, UserHistory as BaseUserHistory, AnimationType as
                                       BaseAnimationType, ToolInfo as BaseToolInfo)
+from apps.dc_algorithm.masking import count_clear
 from utils.data_cube_utilities.dc_mosaic import create_median_mosaic
 
 import datetime
@@ -70,6 +71,8 @@ class Query(BaseQuery):
     animated_product = models.ForeignKey(AnimationType)
 
     base_result_dir = '/datacube/ui_results/coastal_change'
+    # time_start and time_end are years that define the annual composites rather than a date range.
+    fingerprint_acquisitions = False
 
     class Meta(BaseQuery.Meta):
         unique_together = (('satellite', 'area_id', 'time_start', 'time_end', 'latitude_max', 'latitude_min',
@@ -108,6 +111,14 @@ class Query(BaseQuery):
         """
         return create_median_mosaic
 
+    def get_required_measurements(self):
+        """implements get_required_measurements as required by the base class
+
+        See the base query class docstring for more information.
+        """
+        # all required by the water classifier.
+        return ['blue', 'green', 'red', 'nir', 'swir1', 'swir2']
+
     @classmethod
     def get_or_create_query_from_post(cls, form_data, pixel_drill=False):
         """Implements the get_or_create_query_from_post func required by base class
@@ -130,13 +141,7 @@ class Query(BaseQuery):
         valid_query_fields = [field.name for field in cls._meta.get_fields()]
         query_data = {key: query_data[key] for key in valid_query_fields if key in query_data}
 
-        try:
-            query = cls.objects.get(pixel_drill_task=pixel_drill, **query_data)
-            return query, False
-        except cls.DoesNotExist:
-            query = cls(pixel_drill_task=pixel_drill, **query_data)
-            query.save()
-            return query, True
+        return cls.get_or_create_query(query_data, pixel_drill=pixel_drill)
 
 
 class Metadata(BaseMetadata):
@@ -163,7 +168,7 @@ class Metadata(BaseMetadata):
         See the base metadata class docstring for more information.
         """
         for metadata_index, time in enumerate(dataset.time.values.astype('M8[ms]').tolist()):
-            clean_pixels = np.sum(clear_mask[metadata_index, :, :] == True)
+            clean_pixels = count_clear(clear_mask, metadata_index)
             if time not in metadata:
                 metadata[time] = {}
                 metadata[time]['clean_pixels'] = 0
@@ -15,10 +15,15 @@ from utils.data_cube_utilities.dc_utilities import (create_cfmask_clean_mask, cr
 from utils.data_cube_utilities.dc_chunker import (create_geographic_chunks, group_datetimes_by_year,
                                                   combine_geographic_chunks)
 from utils.data_cube_utilities.import_export import export_xarray_to_netcdf
+from apps.dc_algorithm.chunk_transport import store_chunk, open_chunk
+from apps.dc_algorithm.data_access import (search_datasets, select_datasets, group_datasets_by_geographic_chunk,
+                                           get_acquisition_dates, load_datasets, create_storage_aligned_chunks)
+from apps.dc_algorithm.product_cache import load_cached_product, store_cached_product, get_dataset_ids
 
 from .models import CoastalChangeTask
 from apps.dc_algorithm.models import Satellite
 from apps.dc_algorithm.tasks import DCAlgorithmBase, check_cancel_task, task_clean_up
+from apps.dc_algorithm.pipelines import record_pipeline
 
 logger = get_task_logger(__name__)
 
@@ -60,7 +65,7 @@ def parse_parameters_from_task(self, task_id=None):
         'time': (datetime(task.time_start, 1, 1), datetime(task.time_end, 12, 31)),
         'longitude': (task.longitude_min, task.longitude_max),
         'latitude': (task.latitude_min, task.latitude_max),
-        'measurements': task.satellite.get_measurements()
+        'measurements': task.get_measurements()
     }
 
     task.execution_start = datetime.now()
@@ -87,11 +92,11 @@ def validate_parameters(self, parameters, task_id=None):
 
     dc = DataAccessApi(config=task.config_path)
 
-    validation_params = dict(parameters)
+    # the only index search for this task - the datasets are passed down to the chunk processing tasks.
+    datasets = search_datasets(dc, **parameters)
     # verify that both the start and end year have acquisitions
     for year in parameters['time']:
-        validation_params.update({'time': (year, year.replace(year=year.year + 1))})
-        acquisitions = dc.list_acquisition_dates(**validation_params)
+        acquisitions = get_acquisition_dates(datasets, time=(year, year.replace(year=year.year + 1)))
         if len(acquisitions) < 1:
             task.complete = True
             task.update_status("ERROR", "There must be at least one acquisition in both the start and ending year.")
@@ -109,7 +114,7 @@ def validate_parameters(self, parameters, task_id=None):
         return None
 
     dc.close()
-    return parameters
+    return {**parameters, 'datasets': datasets}
 
 
 @task(name="coastal_change.perform_task_chunking", base=BaseTask, bind=True)
@@ -123,7 +128,7 @@ def perform_task_chunking(self, parameters, task_id=None):
         parameters: parameter stream containing all kwargs to load data
 
     Returns:
-        parameters with a list of geographic and time ranges
+        parameters with a list of geographic and time ranges and the datasets in each geographic chunk
     """
     if parameters is None:
         return None
@@ -131,11 +136,12 @@ def perform_task_chunking(self, parameters, task_id=None):
     task = CoastalChangeTask.objects.get(pk=task_id)
     if check_cancel_task(self, task): return
 
-    dc = DataAccessApi(config=task.config_path)
-    dates = dc.list_acquisition_dates(**parameters)
+    datasets = parameters.pop('datasets')
+    dates = get_acquisition_dates(datasets)
     task_chunk_sizing = task.get_chunk_size()
 
-    geographic_chunks = create_geographic_chunks(
+    geographic_chunks = create_storage_aligned_chunks(
+        datasets,
         longitude=parameters['longitude'],
         latitude=parameters['latitude'],
         geographic_chunk_size=task_chunk_sizing['geographic'])
@@ -150,10 +156,14 @@ def perform_task_chunking(self, parameters, task_id=None):
         initial_year = grouped_dates.pop(task.time_start)
         time_chunks = [[initial_year, grouped_dates[year]] for year in grouped_dates]
 
-    dc.close()
     if check_cancel_task(self, task): return
     task.update_status("WAIT", "Chunked parameter set.")
-    return {'parameters': parameters, 'geographic_chunks': geographic_chunks, 'time_chunks': time_chunks}
+    return {
+        'parameters': parameters,
+        'geographic_chunks': geographic_chunks,
+        'time_chunks': time_chunks,
+        'geographic_chunk_datasets': group_datasets_by_geographic_chunk(datasets, geographic_chunks)
+    }
 
 
 @task(name="coastal_change.start_chunk_processing", base=BaseTask, bind=True)
@@ -173,6 +183,7 @@ def start_chunk_processing(self, chunk_details, task_id=None):
     parameters = chunk_details.get('parameters')
     geographic_chunks = chunk_details.get('geographic_chunks')
     time_chunks = chunk_details.get('time_chunks')
+    geographic_chunk_datasets = chunk_details.get('geographic_chunk_datasets')
 
     task = CoastalChangeTask.objects.get(pk=task_id)
 
@@ -196,10 +207,12 @@ def start_chunk_processing(self, chunk_details, task_id=None):
                 time_chunk_id=time_index,
                 geographic_chunk=geographic_chunk,
                 time_chunk=time_chunk,
+                datasets=geographic_chunk_datasets[geo_index],
                 **parameters) for geo_index, geographic_chunk in enumerate(geographic_chunks)
         ]) | recombine_geographic_chunks.s(task_id=task_id) for time_index, time_chunk in enumerate(time_chunks)
     ]) | recombine_time_chunks.s(task_id=task_id) | create_output_products.s(task_id=task_id)\
        | task_clean_up.si(task_id=task_id, task_model='CoastalChangeTask')).apply_async()
+    record_pipeline(task_id, processing_pipeline)
 
     return True
 
@@ -211,6 +224,7 @@ def processing_task(self,
                     time_chunk_id=None,
                     geographic_chunk=None,
                     time_chunk=None,
+                    datasets=None,
                     **parameters):
     """Process a parameter set and save the results to disk.
 
@@ -223,6 +237,7 @@ def processing_task(self,
         task_id, geo_chunk_id, time_chunk_id: identification for the main task and what chunk this is processing
         geographic_chunk: range of latitude and longitude to load - dict with keys latitude, longitude
         time_chunk: list of acquisition dates
+        datasets: list of datasets resolved by the planner that intersect this chunk
         parameters: all required kwargs to load data.
 
     Returns:
@@ -251,17 +266,35 @@ def processing_task(self,
         Loads data for some time range for the current geographic chunk,
         returning 3 objects - the mosaic, the task metadata, and the number of
         acquisitions that were in the retrieved data.
+
+        Annual mosaics are stored in the annual composite store and reused by any task
+        that needs the same year over the same chunk - e.g. other comparison years or animation frames.
         """
+        year_datasets = select_datasets(datasets, time=time)
+        cache_path = task.get_cache_path(
+            'annual_composite',
+            area_id=task.area_id,
+            product=parameters['product'],
+            measurements=parameters['measurements'],
+            compositor=task.get_processing_method().__name__,
+            geographic_chunk=geographic_chunk,
+            datasets=get_dataset_ids(year_datasets))
+        cached_mosaic = load_cached_product(cache_path)
+        if cached_mosaic is not None:
+            mosaic, (metadata, num_scenes) = cached_mosaic
+            return mosaic, metadata, num_scenes
+
         updated_params.update({'time': time})
-        data = dc.get_dataset_by_extent(**updated_params)
+        data = load_datasets(dc, year_datasets, **updated_params)
         if data is None or 'time' not in data:
             logger.info("Invalid chunk.")
             return None, None, None
 
         clear_mask = task.satellite.get_clean_mask_func()(data)
         metadata = task.metadata_from_dataset({}, data, clear_mask, updated_params)
-        return task.get_processing_method()(data, clean_mask=clear_mask, no_data=task.satellite.no_data_value), \
-               metadata, len(data['time'])
+        mosaic = task.get_processing_method()(data, clean_mask=clear_mask, no_data=task.satellite.no_data_value)
+        store_cached_product(cache_path, mosaic, (metadata, len(data['time'])))
+        return mosaic, metadata, len(data['time'])
 
     if check_cancel_task(self, task): return
     old_mosaic, old_metadata, num_scenes_old = _compute_mosaic(starting_year)
@@ -285,7 +318,7 @@ def processing_task(self,
     if check_cancel_task(self, task): return
 
     path = os.path.join(task.get_temp_path(), chunk_id + ".nc")
-    export_xarray_to_netcdf(output_product, path)
+    store_chunk(task.apply_dtype_policy(output_product), path)
     dc.close()
     logger.info("Done with chunk: " + chunk_id)
     return path, metadata, {'geo_chunk_id': geo_chunk_id, 'time_chunk_id': time_chunk_id}
@@ -318,7 +351,7 @@ def recombine_geographic_chunks(self, chunks, task_id=None):
     chunk_data = []
     for index, chunk in enumerate(total_chunks):
         metadata = task.combine_metadata(metadata, chunk[1])
-        chunk_data.append(xr.open_dataset(chunk[0]))
+        chunk_data.append(open_chunk(chunk[0]))
     combined_data = combine_geographic_chunks(chunk_data)
 
     if task.animated_product.animation_id != "none":
@@ -335,7 +368,7 @@ def recombine_geographic_chunks(self, chunks, task_id=None):
             no_data=task.satellite.no_data_value)
 
     path = os.path.join(task.get_temp_path(), "recombined_geo_{}.nc".format(time_chunk_id))
-    export_xarray_to_netcdf(combined_data, path)
+    store_chunk(combined_data, path)
     logger.info("Done combining geographic chunks for time: " + str(time_chunk_id))
     return path, metadata, {'geo_chunk_id': geo_chunk_id, 'time_chunk_id': time_chunk_id}
 
@@ -392,7 +425,7 @@ def create_output_products(self, data, task_id=None):
     if check_cancel_task(self, task): return
 
     full_metadata = data[1]
-    dataset = xr.open_dataset(data[0])
+    dataset = open_chunk(data[0])
 
     task.result_path = os.path.join(task.get_result_path(), "coastline_change.png")
     task.result_coastal_change_path = os.path.join(task.get_result_path(), "coastal_change.png")
@@ -404,7 +437,7 @@ def create_output_products(self, data, task_id=None):
     task.final_metadata_from_dataset(dataset)
     task.metadata_from_dict(full_metadata)
 
-    bands = task.satellite.get_measurements() + ['coastal_change', 'coastline_old', 'coastline_new']
+    bands = task.get_measurements() + ['coastal_change', 'coastline_old', 'coastline_new']
     png_bands = ['red', 'green', 'blue']
 
     export_xarray_to_netcdf(dataset, task.data_netcdf_path)
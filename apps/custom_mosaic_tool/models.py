@@ -25,9 +25,12 @@ from apps.dc_algorithm.models import Area, Compositor, Satellite
 from apps.dc_algorithm.models import (Query as BaseQuery, Metadata as BaseMetadata, Result as BaseResult, ResultType as
                                       BaseResultType, UserHistory as BaseUserHistory, AnimationType as
                                       BaseAnimationType, ToolInfo as BaseToolInfo)
-from utils.data_cube_utilities.dc_mosaic import (create_mosaic, create_median_mosaic, create_max_ndvi_mosaic,
-                                                 create_min_ndvi_mosaic, create_hdmedians_multiple_band_mosaic)
+from apps.dc_algorithm.compositors import (create_mosaic_from_stack, create_max_ndvi_mosaic_from_stack,
+                                          create_min_ndvi_mosaic_from_stack, create_streaming_median_mosaic,
+                                          create_geomedian_mosaic)
+from apps.dc_algorithm.masking import count_clear
 
+from functools import partial
 import numpy as np
 
 
@@ -94,8 +97,12 @@ class Query(BaseQuery):
 
         See the base query class docstring for more information.
         """
-        if not self.compositor.is_iterative():
+        if self.compositor.id == "geo_median":
+            return {'time': None, 'geographic': 0.1}
+        if not self.compositor.supports_time_chunking():
             return {'time': None, 'geographic': 0.05}
+        if not self.compositor.is_iterative():
+            return {'time': 25, 'geographic': 0.05}
         return {'time': 50, 'geographic': 0.1}
 
     def get_iterative(self):
@@ -118,15 +125,25 @@ class Query(BaseQuery):
         See the base query class docstring for more information.
         """
         processing_methods = {
-            'most_recent': create_mosaic,
-            'least_recent': create_mosaic,
-            'max_ndvi': create_max_ndvi_mosaic,
-            'min_ndvi': create_min_ndvi_mosaic,
-            'geo_median': create_hdmedians_multiple_band_mosaic,
-            'median_pixel': create_median_mosaic
+            'most_recent': create_mosaic_from_stack,
+            'least_recent': create_mosaic_from_stack,
+            'max_ndvi': create_max_ndvi_mosaic_from_stack,
+            'min_ndvi': create_min_ndvi_mosaic_from_stack,
+            'geo_median': partial(create_geomedian_mosaic, mask_bands=self.satellite.get_mask_measurements()),
+            'median_pixel': partial(create_streaming_median_mosaic,
+                                    data_range=(self.satellite.data_min, self.satellite.data_max),
+                                    mask_bands=self.satellite.get_mask_measurements())
         }
 
-        return processing_methods.get(self.compositor.id, create_mosaic)
+        return processing_methods.get(self.compositor.id, create_mosaic_from_stack)
+
+    def get_required_measurements(self):
+        """implements get_required_measurements as required by the base class
+
+        See the base query class docstring for more information.
+        """
+        # the mosaic is output with all of the satellite's measurements.
+        return None
 
     @classmethod
     def get_or_create_query_from_post(cls, form_data, pixel_drill=False):
@@ -150,13 +167,7 @@ class Query(BaseQuery):
         valid_query_fields = [field.name for field in cls._meta.get_fields()]
         query_data = {key: query_data[key] for key in valid_query_fields if key in query_data}
 
-        try:
-            query = cls.objects.get(pixel_drill_task=pixel_drill, **query_data)
-            return query, False
-        except cls.DoesNotExist:
-            query = cls(pixel_drill_task=pixel_drill, **query_data)
-            query.save()
-            return query, True
+        return cls.get_or_create_query(query_data, pixel_drill=pixel_drill)
 
 
 class Metadata(BaseMetadata):
@@ -181,7 +192,7 @@ class Metadata(BaseMetadata):
         See the base metadata class docstring for more information.
         """
         for metadata_index, time in enumerate(dataset.time.values.astype('M8[ms]').tolist()):
-            clean_pixels = np.sum(clear_mask[metadata_index, :, :] == True)
+            clean_pixels = count_clear(clear_mask, metadata_index)
             if time not in metadata:
                 metadata[time] = {}
                 metadata[time]['clean_pixels'] = 0
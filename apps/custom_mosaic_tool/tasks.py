@@ -18,10 +18,16 @@ from utils.data_cube_utilities.dc_utilities import (create_cfmask_clean_mask, cr
 from utils.data_cube_utilities.dc_chunker import (create_geographic_chunks, create_time_chunks,
                                                   combine_geographic_chunks)
 from apps.dc_algorithm.utils import create_2d_plot
+from apps.dc_algorithm.data_access import (search_datasets, select_datasets, group_datasets_by_geographic_chunk,
+                                           get_acquisition_dates, load_datasets, stack_fits_in_memory,
+                                           create_storage_aligned_chunks)
+from apps.dc_algorithm.compositors import finalize_median_sketch
 from utils.data_cube_utilities.import_export import export_xarray_to_netcdf
+from apps.dc_algorithm.chunk_transport import store_chunk, open_chunk
 
 from .models import CustomMosaicToolTask
 from apps.dc_algorithm.tasks import DCAlgorithmBase, check_cancel_task, task_clean_up
+from apps.dc_algorithm.pipelines import record_pipeline
 
 logger = get_task_logger(__name__)
 
@@ -97,7 +103,7 @@ def parse_parameters_from_task(self, task_id=None):
         'time': (task.time_start, task.time_end),
         'longitude': (task.longitude_min, task.longitude_max),
         'latitude': (task.latitude_min, task.latitude_max),
-        'measurements': task.satellite.get_measurements()
+        'measurements': task.get_measurements()
     }
 
     task.execution_start = datetime.now()
@@ -125,8 +131,11 @@ def validate_parameters(self, parameters, task_id=None):
 
     dc = DataAccessApi(config=task.config_path)
 
+    # the only index search for this task - the datasets are passed down to the chunk processing tasks.
+    datasets = search_datasets(dc, **parameters)
+
     #validate for any number of criteria here - num acquisitions, etc.
-    acquisitions = dc.list_combined_acquisition_dates(**parameters)
+    acquisitions = get_acquisition_dates(datasets)
 
     if len(acquisitions) < 1:
         task.complete = True
@@ -138,9 +147,10 @@ def validate_parameters(self, parameters, task_id=None):
         task.update_status("ERROR", "Animations cannot be generated for median pixel operations.")
         return None
 
-    if not (task.compositor.is_iterative() or task.pixel_drill_task) and (task.time_end - task.time_start).days > 367:
+    if not (task.compositor.supports_time_chunking() or task.pixel_drill_task) and \
+            (task.time_end - task.time_start).days > 367:
         task.complete = True
-        task.update_status("ERROR", "Median pixel operations are only supported for single year time periods.")
+        task.update_status("ERROR", "Geomedian and medoid operations are only supported for single year time periods.")
         return None
 
     if check_cancel_task(self, task): return
@@ -155,7 +165,7 @@ def validate_parameters(self, parameters, task_id=None):
         return None
 
     dc.close()
-    return parameters
+    return {**parameters, 'datasets': datasets}
 
 
 @task(name="custom_mosaic_tool.perform_task_chunking", base=BaseTask, bind=True)
@@ -169,7 +179,7 @@ def perform_task_chunking(self, parameters, task_id=None):
         parameters: parameter stream containing all kwargs to load data
 
     Returns:
-        parameters with a list of geographic and time ranges
+        parameters with a list of geographic and time ranges and the datasets in each geographic chunk
     """
     if parameters is None:
         return None
@@ -177,11 +187,12 @@ def perform_task_chunking(self, parameters, task_id=None):
     task = CustomMosaicToolTask.objects.get(pk=task_id)
     if check_cancel_task(self, task): return
 
-    dc = DataAccessApi(config=task.config_path)
-    dates = dc.list_combined_acquisition_dates(**parameters)
+    datasets = parameters.pop('datasets')
+    dates = get_acquisition_dates(datasets)
     task_chunk_sizing = task.get_chunk_size()
 
-    geographic_chunks = create_geographic_chunks(
+    geographic_chunks = create_storage_aligned_chunks(
+        datasets,
         longitude=parameters['longitude'],
         latitude=parameters['latitude'],
         geographic_chunk_size=task_chunk_sizing['geographic'])
@@ -190,10 +201,14 @@ def perform_task_chunking(self, parameters, task_id=None):
         dates, _reversed=task.get_reverse_time(), time_chunk_size=task_chunk_sizing['time'])
     logger.info("Time chunks: {}, Geo chunks: {}".format(len(time_chunks), len(geographic_chunks)))
 
-    dc.close()
     if check_cancel_task(self, task): return
     task.update_status("WAIT", "Chunked parameter set.")
-    return {'parameters': parameters, 'geographic_chunks': geographic_chunks, 'time_chunks': time_chunks}
+    return {
+        'parameters': parameters,
+        'geographic_chunks': geographic_chunks,
+        'time_chunks': time_chunks,
+        'geographic_chunk_datasets': group_datasets_by_geographic_chunk(datasets, geographic_chunks)
+    }
 
 
 @task(name="custom_mosaic_tool.start_chunk_processing", base=BaseTask, bind=True)
@@ -213,6 +228,7 @@ def start_chunk_processing(self, chunk_details, task_id=None):
     parameters = chunk_details.get('parameters')
     geographic_chunks = chunk_details.get('geographic_chunks')
     time_chunks = chunk_details.get('time_chunks')
+    geographic_chunk_datasets = chunk_details.get('geographic_chunk_datasets')
 
     task = CustomMosaicToolTask.objects.get(pk=task_id)
 
@@ -228,6 +244,26 @@ def start_chunk_processing(self, chunk_details, task_id=None):
 
     logger.info("START_CHUNK_PROCESSING")
 
+    if task.compositor.is_iterative():
+        processing_pipeline = (group([
+            group([
+                processing_task.s(
+                    task_id=task_id,
+                    geo_chunk_id=geo_index,
+                    time_chunk_id=time_index,
+                    geographic_chunk=geographic_chunk,
+                    time_chunk=time_chunk,
+                    datasets=select_datasets(geographic_chunk_datasets[geo_index], time=time_chunk),
+                    **parameters) for geo_index, geographic_chunk in enumerate(geographic_chunks)
+            ]) | recombine_geographic_chunks.s(task_id=task_id)
+            for time_index, time_chunk in enumerate(time_chunks)
+        ]) | recombine_time_chunks.s(task_id=task_id) | create_output_products.s(task_id=task_id)\
+           | task_clean_up.si(task_id=task_id, task_model='CustomMosaicToolTask')).apply_async()
+        record_pipeline(task_id, processing_pipeline)
+        return True
+
+    # median sketches are much larger than mosaics, so each geographic chunk is finalized over time before
+    # the geographic chunks are combined. Animations aren't supported for these compositors.
     processing_pipeline = (group([
         group([
             processing_task.s(
@@ -236,11 +272,13 @@ def start_chunk_processing(self, chunk_details, task_id=None):
                 time_chunk_id=time_index,
                 geographic_chunk=geographic_chunk,
                 time_chunk=time_chunk,
-                **parameters) for geo_index, geographic_chunk in enumerate(geographic_chunks)
-        ]) | recombine_geographic_chunks.s(task_id=task_id)
-        for time_index, time_chunk in enumerate(time_chunks)
-    ]) | recombine_time_chunks.s(task_id=task_id) | create_output_products.s(task_id=task_id)\
+                datasets=select_datasets(geographic_chunk_datasets[geo_index], time=time_chunk),
+                **parameters) for time_index, time_chunk in enumerate(time_chunks)
+        ]) | recombine_time_chunks.s(task_id=task_id)
+        for geo_index, geographic_chunk in enumerate(geographic_chunks)
+    ]) | recombine_geographic_chunks.s(task_id=task_id) | create_output_products.s(task_id=task_id)\
        | task_clean_up.si(task_id=task_id, task_model='CustomMosaicToolTask')).apply_async()
+    record_pipeline(task_id, processing_pipeline)
 
     return True
 
@@ -252,6 +290,7 @@ def processing_task(self,
                     time_chunk_id=None,
                     geographic_chunk=None,
                     time_chunk=None,
+                    datasets=None,
                     **parameters):
     """Process a parameter set and save the results to disk.
 
@@ -264,6 +303,7 @@ def processing_task(self,
         task_id, geo_chunk_id, time_chunk_id: identification for the main task and what chunk this is processing
         geographic_chunk: range of latitude and longitude to load - dict with keys latitude, longitude
         time_chunk: list of acquisition dates
+        datasets: list of datasets resolved by the planner that intersect this chunk
         parameters: all required kwargs to load data.
 
     Returns:
@@ -283,9 +323,12 @@ def processing_task(self,
     def _get_datetime_range_containing(*time_ranges):
         return (min(time_ranges) - timedelta(microseconds=1), max(time_ranges) + timedelta(microseconds=1))
 
+    # iterative compositors are applied to the full time chunk at once if it fits in memory.
+    iterative = task.get_iterative() and (task.animated_product.animation_id != "none" or not stack_fits_in_memory(
+        datasets, measurements=parameters['measurements'], **geographic_chunk))
     times = list(
         map(_get_datetime_range_containing, time_chunk)
-        if task.get_iterative() else [_get_datetime_range_containing(time_chunk[0], time_chunk[-1])])
+        if iterative else [_get_datetime_range_containing(time_chunk[0], time_chunk[-1])])
     dc = DataAccessApi(config=task.config_path)
     updated_params = parameters
     updated_params.update(geographic_chunk)
@@ -294,7 +337,7 @@ def processing_task(self,
     base_index = (task.get_chunk_size()['time'] if task.get_chunk_size()['time'] is not None else 1) * time_chunk_id
     for time_index, time in enumerate(times):
         updated_params.update({'time': time})
-        data = dc.get_stacked_datasets_by_extent(**updated_params)
+        data = load_datasets(dc, select_datasets(datasets, time=time), **updated_params)
 
         if check_cancel_task(self, task): return
 
@@ -302,7 +345,7 @@ def processing_task(self,
             logger.info("Invalid chunk.")
             continue
 
-        clear_mask = task.satellite.get_clean_mask_func()(data)
+        clear_mask = task.satellite.get_clean_mask_func(packed=True)(data)
         add_timestamp_data_to_xr(data)
 
         metadata = task.metadata_from_dataset(metadata, data, clear_mask, updated_params)
@@ -322,18 +365,18 @@ def processing_task(self,
                 #need to clear out all the metadata..
                 clear_attrs(data)
                 #can't reindex on time - weird?
-                export_xarray_to_netcdf(data.isel(time=0).drop('time'), path)
+                export_xarray_to_netcdf(task.apply_dtype_policy(data.isel(time=0).drop('time')), path)
             elif task.animated_product.animation_id == "cumulative":
-                export_xarray_to_netcdf(iteration_data, path)
+                export_xarray_to_netcdf(task.apply_dtype_policy(iteration_data), path)
 
-        task.scenes_processed = F('scenes_processed') + 1
+        task.scenes_processed = F('scenes_processed') + (1 if iterative else len(time_chunk))
         # Avoid overwriting the task's status if it is cancelled.
         task.save(update_fields=['scenes_processed'])
 
     if iteration_data is None:
         return None
     path = os.path.join(task.get_temp_path(), chunk_id + ".nc")
-    export_xarray_to_netcdf(iteration_data, path)
+    store_chunk(task.apply_dtype_policy(iteration_data), path)
     dc.close()
     logger.info("Done with chunk: " + chunk_id)
     return path, metadata, {'geo_chunk_id': geo_chunk_id, 'time_chunk_id': time_chunk_id}
@@ -367,7 +410,7 @@ def recombine_geographic_chunks(self, chunks, task_id=None):
     chunk_data = []
     for index, chunk in enumerate(total_chunks):
         metadata = task.combine_metadata(metadata, chunk[1])
-        chunk_data.append(xr.open_dataset(chunk[0]))
+        chunk_data.append(open_chunk(chunk[0]))
     combined_data = combine_geographic_chunks(chunk_data)
 
     # if we're animating, combine it all and save to disk.
@@ -387,7 +430,7 @@ def recombine_geographic_chunks(self, chunks, task_id=None):
                 export_xarray_to_netcdf(combine_geographic_chunks(animated_data), path)
 
     path = os.path.join(task.get_temp_path(), "recombined_geo_{}.nc".format(time_chunk_id))
-    export_xarray_to_netcdf(combined_data, path)
+    store_chunk(combined_data, path)
     logger.info("Done combining geographic chunks for time: " + str(time_chunk_id))
     return path, metadata, {'geo_chunk_id': geo_chunk_id, 'time_chunk_id': time_chunk_id}
 
@@ -444,7 +487,7 @@ def recombine_time_chunks(self, chunks, task_id=None):
     combined_data = None
     for index, chunk in enumerate(total_chunks):
         metadata.update(chunk[1])
-        data = xr.open_dataset(chunk[0])
+        data = open_chunk(chunk[0])
         if combined_data is None:
             if task.animated_product.animation_id != "none":
                 generate_animation(index, combined_data)
@@ -463,8 +506,10 @@ def recombine_time_chunks(self, chunks, task_id=None):
         if task.animated_product.animation_id != "none":
             generate_animation(index, combined_data)
 
+    # median sketches are only finalized once all of the time chunks have been merged.
+    combined_data = finalize_median_sketch(combined_data, no_data=task.satellite.no_data_value)
     path = os.path.join(task.get_temp_path(), "recombined_time_{}.nc".format(geo_chunk_id))
-    export_xarray_to_netcdf(combined_data, path)
+    store_chunk(combined_data, path)
     logger.info("Done combining time chunks for geo: " + str(geo_chunk_id))
     return path, metadata, {'geo_chunk_id': geo_chunk_id, 'time_chunk_id': time_chunk_id}
 
@@ -484,7 +529,7 @@ def create_output_products(self, data, task_id=None):
     if check_cancel_task(self, task): return
 
     full_metadata = data[1]
-    dataset = xr.open_dataset(data[0])
+    dataset = open_chunk(data[0])
 
     task.result_path = os.path.join(task.get_result_path(), "png_mosaic.png")
     task.result_filled_path = os.path.join(task.get_result_path(), "filled_png_mosaic.png")
@@ -495,7 +540,7 @@ def create_output_products(self, data, task_id=None):
     task.final_metadata_from_dataset(dataset)
     task.metadata_from_dict(full_metadata)
 
-    bands = task.satellite.get_measurements()
+    bands = task.get_measurements()
     png_bands = [task.query_type.red, task.query_type.green, task.query_type.blue]
 
     export_xarray_to_netcdf(dataset, task.data_netcdf_path)
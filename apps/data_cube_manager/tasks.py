@@ -24,6 +24,7 @@ from apps.data_cube_manager.models import (Dataset, DatasetType, DatasetSource,
                                            IngestionDetails)
 from apps.data_cube_manager.templates.bulk_downloader import base_downloader_script, static_script
 from utils.data_cube_utilities.data_access_api import DataAccessApi
+from apps.dc_algorithm.acquisition_catalog import invalidate_catalog
 
 logger = get_task_logger(__name__)
 
@@ -73,6 +74,8 @@ def update_data_cube_details(ingested_only=True):
             platform=dataset_type.metadata['platform']['code'])
         ingestion_details.update_with_query_metadata(dc.get_datacube_metadata(dataset_type.name))
 
+    # datasets can be indexed outside of the ui, so the acquisition catalog is rebuilt on demand daily as well.
+    invalidate_catalog()
     dc.close()
 
 
@@ -116,6 +119,7 @@ def ingestion_work(output_type, source_type, ingestion_definition):
     # this actually ingests stuff
     successful, failed = ingest.process_tasks(index, ingestion_definition, source_type, output_type, tasks, 3200,
                                               get_executor(None, None))
+    invalidate_catalog(output_type.name)
 
     index.close()
     return 0
@@ -272,6 +276,7 @@ def ingest_subset(ingestion_request_id=None):
         executor = SerialExecutor()
         successful, failed = ingest.process_tasks(index, ingestion_request.ingestion_definition, source_type,
                                                   output_type, tasks, 3200, executor)
+        invalidate_catalog(output_type.name)
     except:
         index.close()
         raise
@@ -0,0 +1,175 @@
+# Copyright 2016 United States Government as represented by the Administrator
+# of the National Aeronautics and Space Administration. All Rights Reserved.
+#
+# Portion of this code is Copyright Geoscience Australia, Licensed under the
+# Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License
+# at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# The CEOS 2 platform is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from django.conf import settings
+
+import json
+import uuid
+from datetime import datetime
+import redis
+from redis.exceptions import WatchError
+
+from apps.dc_algorithm.data_access import normalize_acquisition_time, get_time_bounds, ranges_intersect
+
+# Each product's catalog is a Redis sorted set of dataset entries scored by acquisition time so that
+# time ranges can be answered with a single range query. Areas are already part of the product name.
+CATALOG_KEY_PREFIX = "dc_algorithm.acquisition_catalog"
+TIME_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+# Incremented on every invalidation - catalogs are built into a temporary key and only swapped in if no invalidation
+# happened while they were being built, so a build can never overwrite a newer invalidation.
+GENERATION_KEY = "dc_algorithm.acquisition_catalog_generation"
+MAX_BUILD_ATTEMPTS = 3
+
+
+def _get_connection():
+    return redis.StrictRedis.from_url(settings.BROKER_URL)
+
+
+def _get_catalog_key(product):
+    return "{}:{}".format(CATALOG_KEY_PREFIX, product)
+
+
+def _get_built_key(product):
+    return "{}:{}:built".format(CATALOG_KEY_PREFIX, product)
+
+
+def _get_score(time):
+    return (time - datetime(1970, 1, 1)).total_seconds()
+
+
+def build_catalog(api, product, connection=None):
+    """Build the acquisition catalog for a product from the Data Cube index
+
+    Only the id, time, and spatial bounds of each dataset are retrieved - no dataset documents are loaded.
+    Replaces any existing catalog for the product unless the catalogs were invalidated during the build.
+
+    Args:
+        api: DataAccessApi instance
+        product: name of the product to catalog, e.g. ls7_ledaps_vietnam
+
+    Returns:
+        True if the catalog was replaced, False if it was invalidated while being built.
+    """
+    connection = connection or _get_connection()
+    generation = connection.get(GENERATION_KEY)
+    records = api.dc.index.datasets.search_returning(('id', 'time', 'lat', 'lon'), product=product)
+
+    temporary_key = "{}:{}".format(_get_catalog_key(product), uuid.uuid4().hex)
+    pipeline = connection.pipeline(transaction=False)
+    for record in records:
+        time = normalize_acquisition_time(record.time.begin + (record.time.end - record.time.begin) / 2)
+        entry = {
+            'id': str(record.id),
+            'time': time.strftime(TIME_FORMAT),
+            'latitude': [record.lat.begin, record.lat.end],
+            'longitude': [record.lon.begin, record.lon.end]
+        }
+        pipeline.zadd(temporary_key, _get_score(time), json.dumps(entry, sort_keys=True))
+    pipeline.execute()
+
+    with connection.pipeline() as pipeline:
+        try:
+            pipeline.watch(GENERATION_KEY)
+            if pipeline.get(GENERATION_KEY) != generation:
+                raise WatchError()
+            # products without datasets leave no temporary key to rename.
+            has_entries = pipeline.exists(temporary_key)
+            pipeline.multi()
+            if has_entries:
+                pipeline.rename(temporary_key, _get_catalog_key(product))
+            else:
+                pipeline.delete(_get_catalog_key(product))
+            pipeline.set(_get_built_key(product), 1)
+            pipeline.execute()
+            return True
+        except WatchError:
+            connection.delete(temporary_key)
+            return False
+
+
+def invalidate_catalog(product=None, connection=None):
+    """Drop the acquisition catalog for a product, or for all products if none is provided
+
+    Should be called whenever datasets are added to or removed from the index - the catalog
+    is rebuilt the next time it is queried.
+    """
+    connection = connection or _get_connection()
+    connection.incr(GENERATION_KEY)
+    if product is not None:
+        connection.delete(_get_catalog_key(product), _get_built_key(product))
+        return
+    keys = list(connection.scan_iter(match="{}:*".format(CATALOG_KEY_PREFIX)))
+    if keys:
+        connection.delete(*keys)
+
+
+def get_catalog_entries(api, product, time=None, longitude=None, latitude=None, connection=None):
+    """Get the catalog entries for a product that match a time range and geographic extent
+
+    The catalog is built from the index if it doesn't exist yet. If it keeps being invalidated while it is built,
+    whatever is cataloged is used rather than waiting for the index to settle.
+
+    Args:
+        api: DataAccessApi instance
+        product: product name
+        time: optional (start, end) tuple of dates or datetimes - inclusive.
+        longitude, latitude: optional (min, max) tuples.
+
+    Returns:
+        list of dicts with keys id, time, latitude, and longitude.
+    """
+    connection = connection or _get_connection()
+    for _ in range(MAX_BUILD_ATTEMPTS):
+        if connection.exists(_get_built_key(product)) or build_catalog(api, product, connection=connection):
+            break
+
+    min_score, max_score = "-inf", "+inf"
+    if time is not None:
+        start, end = get_time_bounds(time)
+        min_score, max_score = _get_score(start), _get_score(end)
+
+    entries = [json.loads(member.decode('utf-8'))
+               for member in connection.zrangebyscore(_get_catalog_key(product), min_score, max_score)]
+    for entry in entries:
+        entry['time'] = datetime.strptime(entry['time'], TIME_FORMAT)
+    if longitude is not None and latitude is not None:
+        entries = [
+            entry for entry in entries
+            if ranges_intersect(entry['latitude'], latitude) and ranges_intersect(entry['longitude'], longitude)
+        ]
+    return entries
+
+
+def list_acquisition_dates(api, product=None, products=None, time=None, longitude=None, latitude=None, **kwargs):
+    """List the unique acquisition dates for a query in ascending order without loading data or searching the index
+
+    Accepts the same parameter dict used with the DataAccessApi - either 'product' or 'products'. For multiple products,
+    this is equivalent to DataAccessApi.list_combined_acquisition_dates.
+    """
+    products = products if products is not None else [product]
+    connection = _get_connection()
+    dates = set()
+    for product_name in products:
+        dates.update(entry['time'] for entry in get_catalog_entries(
+            api, product_name, time=time, longitude=longitude, latitude=latitude, connection=connection))
+    return sorted(dates)
+
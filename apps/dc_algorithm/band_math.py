@@ -0,0 +1,182 @@
+# Copyright 2016 United States Government as represented by the Administrator
+# of the National Aeronautics and Space Administration. All Rights Reserved.
+#
+# Portion of this code is Copyright Geoscience Australia, Licensed under the
+# Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License
+# at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# The CEOS 2 platform is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import ast
+from functools import lru_cache
+
+import numpy as np
+import xarray as xr
+
+# Expressions are evaluated this many pixels at a time, so temporaries are bounded by the block rather than the data.
+BAND_MATH_BLOCK_SIZE = 2**18
+
+_BINARY_OPERATORS = {
+    ast.Add: np.add,
+    ast.Sub: np.subtract,
+    ast.Mult: np.multiply,
+    ast.Div: np.true_divide,
+    ast.Pow: np.power
+}
+_UNARY_OPERATORS = {ast.UAdd: np.positive, ast.USub: np.negative}
+_FUNCTIONS = {'abs': np.absolute, 'sqrt': np.sqrt, 'log': np.log, 'exp': np.exp}
+
+
+@lru_cache(maxsize=128)
+def compile_expression(expression):
+    """Compile a band math expression, reusing the compiled program for expressions that have been seen before
+
+    Args:
+        expression: the expression string, e.g. '(nir - red) / (nir + red)'
+
+    Returns:
+        BandMathExpression for the expression.
+
+    Raises:
+        ValueError: if the expression is invalid.
+    """
+    return BandMathExpression(expression)
+
+
+class BandMathExpression:
+    """An arithmetic expression over band names, e.g. '2.5 * (nir - red) / (nir + 6 * red - 7.5 * blue + 1)'
+
+    Expressions may contain band names, numbers, + - * / **, parentheses, and the functions abs, sqrt, log, and exp.
+    They are validated and compiled to a list of operations when created, so invalid expressions fail before any
+    data is loaded and the measurements that an expression requires are known up front.
+
+    Attributes:
+        expression: the expression string.
+        measurements: sorted list of the band names used in the expression.
+    """
+
+    def __init__(self, expression):
+        self.expression = expression
+        try:
+            tree = ast.parse(expression.strip(), mode='eval')
+        except SyntaxError as error:
+            raise ValueError("Invalid band math expression '{}': {}".format(expression, error.msg))
+        self._program = []
+        self.measurements = sorted(self._compile(tree.body))
+        if len(self.measurements) == 0:
+            raise ValueError("Band math expression '{}' does not use any bands.".format(expression))
+
+    def __repr__(self):
+        return "BandMathExpression({!r})".format(self.expression)
+
+    def _compile(self, node):
+        """Validate a node and append its operations to the program in evaluation order, returning the bands it uses"""
+        if isinstance(node, ast.Name):
+            self._program.append(('band', node.id))
+            return {node.id}
+        if type(node).__name__ in ('Num', 'Constant') and isinstance(getattr(node, 'n', None), (int, float)) \
+                and not isinstance(node.n, bool):
+            self._program.append(('constant', np.float32(node.n)))
+            return set()
+        if isinstance(node, ast.UnaryOp) and type(node.op) in _UNARY_OPERATORS:
+            bands = self._compile(node.operand)
+            self._program.append(('function', _UNARY_OPERATORS[type(node.op)]))
+            return bands
+        if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPERATORS:
+            bands = self._compile(node.left) | self._compile(node.right)
+            self._program.append(('operator', _BINARY_OPERATORS[type(node.op)]))
+            return bands
+        if isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id in _FUNCTIONS \
+                and len(node.args) == 1 and len(node.keywords) == 0:
+            bands = self._compile(node.args[0])
+            self._program.append(('function', _FUNCTIONS[node.func.id]))
+            return bands
+        raise ValueError("Invalid band math expression '{}': unsupported syntax at '{}'.".format(
+            self.expression, type(node).__name__))
+
+    def evaluate(self, dataset, clean_mask=None, no_data=-9999, block_size=BAND_MATH_BLOCK_SIZE):
+        """Evaluate the expression over a dataset
+
+        Pixels are no_data wherever any band used by the expression is no_data, the clean mask is False, or the
+        result is not finite, e.g. a division by zero.
+
+        Args:
+            dataset: xarray dataset containing all of the expression's measurements.
+            clean_mask: optional boolean mask with the same shape as the bands.
+            no_data: no data value - used for both the input bands and the result. May be nan.
+            block_size: number of pixels to evaluate at a time.
+
+        Returns:
+            float32 xarray DataArray with the same dimensions and coordinates as the bands.
+        """
+        missing = [band for band in self.measurements if band not in dataset]
+        if len(missing) > 0:
+            raise ValueError("Band math expression '{}' requires missing bands: {}".format(
+                self.expression, ", ".join(missing)))
+
+        template = dataset[self.measurements[0]]
+        bands = {band: np.ravel(dataset[band].values) for band in self.measurements}
+        clean_mask = np.ravel(np.asarray(clean_mask, dtype=bool)) if clean_mask is not None else None
+        result = np.empty(template.size, dtype=np.float32)
+
+        # buffers are reused by every operation and block, so evaluation only allocates a few blocks of memory.
+        buffers = []
+        valid = np.empty(min(block_size, template.size), dtype=bool)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            for start in range(0, template.size, block_size):
+                stop = min(start + block_size, template.size)
+                block_valid = valid[:stop - start]
+                block_valid[...] = True if clean_mask is None else clean_mask[start:stop]
+                for band in self.measurements:
+                    block_valid &= bands[band][start:stop] != no_data
+                block_result = self._evaluate_block(bands, start, stop, buffers, block_size)
+                block_valid &= np.isfinite(block_result)
+                result[start:stop] = np.where(block_valid, block_result, no_data)
+                if isinstance(block_result, np.ndarray):
+                    buffers.append(block_result.base if block_result.base is not None else block_result)
+
+        return xr.DataArray(result.reshape(template.shape), coords=template.coords, dims=template.dims)
+
+    def _evaluate_block(self, bands, start, stop, buffers, block_size):
+        """Run the compiled program over one block of pixels, operating in place on pooled buffers"""
+
+        def _get_buffer():
+            return (buffers.pop() if len(buffers) > 0 else np.empty(block_size, dtype=np.float32))[:stop - start]
+
+        def _release(value):
+            if isinstance(value, np.ndarray):
+                buffers.append(value.base if value.base is not None else value)
+
+        stack = []
+        for instruction, argument in self._program:
+            if instruction == 'band':
+                buffer = _get_buffer()
+                buffer[...] = bands[argument][start:stop]
+                stack.append(buffer)
+            elif instruction == 'constant':
+                stack.append(argument)
+            elif instruction == 'function':
+                operand = stack.pop()
+                stack.append(argument(operand, out=operand) if isinstance(operand, np.ndarray) else argument(operand))
+            else:
+                right, left = stack.pop(), stack.pop()
+                if isinstance(left, np.ndarray):
+                    stack.append(argument(left, right, out=left))
+                    _release(right)
+                elif isinstance(right, np.ndarray):
+                    stack.append(argument(left, right, out=right))
+                else:
+                    stack.append(argument(left, right))
+        return stack.pop()
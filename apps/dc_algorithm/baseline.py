@@ -0,0 +1,81 @@
+# Copyright 2016 United States Government as represented by the Administrator
+# of the National Aeronautics and Space Administration. All Rights Reserved.
+#
+# Portion of this code is Copyright Geoscience Australia, Licensed under the
+# Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License
+# at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# The CEOS 2 platform is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import numpy as np
+import xarray as xr
+
+from apps.dc_algorithm.masking import get_mask_slice
+
+# Included in the keys of cached baselines - increment whenever baseline computations change so stale entries are unused.
+BASELINE_VERSION = 1
+
+def accumulate_baseline_ndvi(dataset_in, clean_mask=None, intermediate_product=None, no_data=-9999):
+    """Add the clear NDVI observations of a dataset to a running baseline sum and count
+
+    Baselines are accumulated scene by scene so the baseline stack is never held in memory. Follows the same
+    intermediate_product convention as the compositors - pass the result back in for each scene. NDVI and the clean
+    mask are only computed for one time slice at a time.
+
+    Args:
+        dataset_in: xarray dataset with a time dimension and red and nir bands.
+        clean_mask: boolean or packed mask with the same shape as the data variables in dataset_in.
+        intermediate_product: result of a previous call to add the observations to.
+        no_data: no data value.
+
+    Returns:
+        xarray dataset with ndvi_sum and ndvi_count variables over latitude and longitude.
+    """
+    ndvi_sum = np.zeros(dataset_in.red.shape[1:], dtype=np.float64)
+    ndvi_count = np.zeros(dataset_in.red.shape[1:], dtype=np.int32)
+    for time_index in range(len(dataset_in.time)):
+        red = dataset_in.red.values[time_index]
+        nir = dataset_in.nir.values[time_index]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ndvi = (nir.astype(np.float64) - red) / (nir.astype(np.float64) + red)
+        valid = (red != no_data) & (nir != no_data) & np.isfinite(ndvi)
+        if clean_mask is not None:
+            valid &= get_mask_slice(clean_mask, time_index)
+        ndvi_sum[valid] += ndvi[valid]
+        ndvi_count += valid
+
+    baseline = xr.Dataset(
+        {
+            'ndvi_sum': (('latitude', 'longitude'), ndvi_sum),
+            'ndvi_count': (('latitude', 'longitude'), ndvi_count)
+        },
+        coords={'latitude': dataset_in.latitude,
+                'longitude': dataset_in.longitude})
+    if intermediate_product is not None:
+        baseline['ndvi_sum'] += intermediate_product.ndvi_sum
+        baseline['ndvi_count'] += intermediate_product.ndvi_count
+    return baseline
+
+
+def get_mean_ndvi(baseline):
+    """Get the mean NDVI of an accumulated baseline - NaN for pixels without any clear observations
+
+    Args:
+        baseline: result of accumulate_baseline_ndvi.
+
+    Returns:
+        xarray DataArray over latitude and longitude.
+    """
+    return (baseline.ndvi_sum / baseline.ndvi_count).where(baseline.ndvi_count > 0)
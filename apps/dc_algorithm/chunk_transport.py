@@ -0,0 +1,135 @@
+# Copyright 2016 United States Government as represented by the Administrator
+# of the National Aeronautics and Space Administration. All Rights Reserved.
+#
+# Portion of this code is Copyright Geoscience Australia, Licensed under the
+# Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License
+# at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# The CEOS 2 platform is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from django.conf import settings
+
+import os
+import pickle
+import shutil
+import socket
+import time
+import uuid
+
+import numpy as np
+import xarray as xr
+
+from utils.data_cube_utilities.import_export import export_xarray_to_netcdf
+from apps.dc_algorithm.dtypes import decode_scaled
+
+# Intermediate chunk products can be handed from processing to recombination tasks through node-local POSIX shared
+# memory rather than NetCDF files. Segments mirror the temp paths of the files they replace, so the path returned
+# through Celery doesn't change - a consumer on the same node maps the segment, and the file is only written when the
+# consumer is known to be on another node or the segment can't be written. Enabled with CHUNK_SHARED_MEMORY in the
+# settings. Set CHUNK_SHARED_MEMORY_FALLBACK to False to raise rather than write the file when a segment fails.
+SHARED_MEMORY_DIR = '/dev/shm/data_cube_ui'
+# segments left behind by tasks that were cleaned up on another node are removed once they are this many seconds old.
+SHARED_MEMORY_MAX_AGE = 24 * 60 * 60
+
+
+def _get_segment_path(path):
+    return os.path.join(SHARED_MEMORY_DIR, os.path.abspath(path).lstrip(os.sep))
+
+
+def _shared_memory_enabled():
+    return getattr(settings, 'CHUNK_SHARED_MEMORY', False)
+
+
+def store_chunk(dataset, path, consumer_host=None):
+    """Store an intermediate chunk product so that it can be opened with open_chunk
+
+    Writes the dataset to a shared memory segment if enabled. The NetCDF file at path is written instead if the
+    consumer is known to be on another node, or if the segment can't be written, e.g. /dev/shm is full.
+    Otherwise, this is export_xarray_to_netcdf.
+
+    Args:
+        dataset: xarray dataset to store.
+        path: temp path of the NetCDF file - returned to the consumer through Celery.
+        consumer_host: optional hostname of the node that opens the chunk, e.g. for tasks routed to a node's queue.
+            Consumers are assumed to be on this node if it isn't given.
+
+    Returns:
+        path
+    """
+    if not _shared_memory_enabled() or (consumer_host is not None and consumer_host != socket.gethostname()):
+        export_xarray_to_netcdf(dataset, path)
+        return path
+
+    segment_path = _get_segment_path(path)
+    # segments are written to a temporary directory and moved into place so consumers never map partial segments.
+    temp_path = "{}.{}.tmp".format(segment_path, uuid.uuid4().hex)
+    try:
+        os.makedirs(temp_path)
+        variables = {}
+        for index, (name, variable) in enumerate(dataset.variables.items()):
+            np.save(os.path.join(temp_path, "{}.npy".format(index)), np.ascontiguousarray(variable.values))
+            # object arrays, e.g. strings, are pickled by numpy and can't be mapped.
+            variables[name] = (index, variable.dims, variable.attrs, name in dataset.coords, variable.dtype != object)
+        with open(os.path.join(temp_path, "dataset.pickle"), 'wb') as metadata_file:
+            pickle.dump({'variables': variables, 'attrs': dataset.attrs}, metadata_file)
+        if os.path.exists(segment_path):
+            shutil.rmtree(segment_path)
+        os.rename(temp_path, segment_path)
+    except OSError:
+        shutil.rmtree(temp_path, ignore_errors=True)
+        if not getattr(settings, 'CHUNK_SHARED_MEMORY_FALLBACK', True):
+            raise
+        export_xarray_to_netcdf(dataset, path)
+    return path
+
+
+def open_chunk(path):
+    """Open an intermediate chunk product stored with store_chunk
+
+    Shared memory segments on this node are mapped copy-on-write, so no data is copied or decoded until it's used
+    and modifying the dataset doesn't change the segment. Falls back to the NetCDF file at path. Variables that the
+    dtype policy stored as scaled int16 are decoded.
+    """
+    segment_path = _get_segment_path(path)
+    if not os.path.isdir(segment_path):
+        return decode_scaled(xr.open_dataset(path))
+
+    with open(os.path.join(segment_path, "dataset.pickle"), 'rb') as metadata_file:
+        metadata = pickle.load(metadata_file)
+    variables = {
+        name: xr.Variable(dims,
+                          np.load(os.path.join(segment_path, "{}.npy".format(index)), mmap_mode='c' if mappable else None),
+                          attrs)
+        for name, (index, dims, attrs, _, mappable) in metadata['variables'].items()
+    }
+    coords = [name for name, (_, _, _, is_coord, _) in metadata['variables'].items() if is_coord]
+    return decode_scaled(
+        xr.Dataset({name: variable for name, variable in variables.items() if name not in coords},
+                   coords={name: variables[name] for name in coords},
+                   attrs=metadata['attrs']))
+
+
+def remove_chunks(temp_path):
+    """Remove the shared memory segments for a task's temp directory and any stale segments on this node"""
+    shutil.rmtree(_get_segment_path(temp_path), ignore_errors=True)
+    if not os.path.isdir(SHARED_MEMORY_DIR):
+        return
+    time_threshold = time.time() - SHARED_MEMORY_MAX_AGE
+    for directory, directory_names, _ in os.walk(SHARED_MEMORY_DIR, topdown=False):
+        for directory_name in directory_names:
+            segment_path = os.path.join(directory, directory_name)
+            if os.path.exists(os.path.join(segment_path, "dataset.pickle")) and \
+                    os.path.getmtime(segment_path) < time_threshold:
+                shutil.rmtree(segment_path, ignore_errors=True)
@@ -0,0 +1,208 @@
+# Copyright 2016 United States Government as represented by the Administrator
+# of the National Aeronautics and Space Administration. All Rights Reserved.
+#
+# Portion of this code is Copyright Geoscience Australia, Licensed under the
+# Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License
+# at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# The CEOS 2 platform is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import struct
+import zlib
+
+import numpy as np
+import matplotlib.colors as mcolors
+
+# Values are quantized to this many bins - one lookup table entry each.
+LOOKUP_TABLE_SIZE = 256
+# PNGs are written this many rows at a time, so only a block of RGBA rows is in memory at once.
+PNG_BLOCK_ROWS = 512
+
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+
+
+def get_rgba(color):
+    """Convert a color name, hex string, or RGB(A) tuple with 0-255 components to an RGBA uint8 array"""
+    if isinstance(color, str):
+        if color.lower() in ('transparent', 'none'):
+            return np.zeros(4, dtype=np.uint8)
+        return np.round(np.array(mcolors.to_rgba(color)) * 255).astype(np.uint8)
+    color = list(color)
+    return np.array(color + [255] * (4 - len(color)), dtype=np.uint8)
+
+
+def read_color_scale(path):
+    """Read a gdaldem color-relief color scale file
+
+    Each line is a value followed by R G B and an optional A, separated by whitespace or commas. Values can be
+    percentages of the data range, e.g. 50%, and the 'nv' entry gives the color for no data.
+
+    Returns:
+        tuple of a list of (value, rgba) entries sorted by value - percentages are kept as strings - and the
+        no data color, or None if the file doesn't define one.
+    """
+    entries = []
+    no_data_color = None
+    with open(path) as color_scale_file:
+        for line in color_scale_file:
+            fields = line.replace(',', ' ').split()
+            if len(fields) < 4 or fields[0].startswith('#'):
+                continue
+            rgba = get_rgba([int(float(component)) for component in fields[1:5]])
+            if fields[0].lower() == 'nv':
+                no_data_color = rgba
+            else:
+                entries.append((fields[0] if fields[0].endswith('%') else float(fields[0]), rgba))
+    return entries, no_data_color
+
+
+class ColorLookupTable:
+    """Colors values by quantizing them to uint8 bins over a value range and looking the bins up in an RGBA table
+
+    Attributes:
+        colors: (LOOKUP_TABLE_SIZE, 4) uint8 array of RGBA colors.
+        value_range: (min, max) values of the first and last bins - values outside of it are clamped.
+    """
+
+    def __init__(self, colors, value_range):
+        self.colors = np.asarray(colors, dtype=np.uint8)
+        self.value_range = (float(min(value_range)), float(max(value_range)))
+
+    @classmethod
+    def from_color_scale(cls, path, interpolate=True, values=None):
+        """Create a lookup table from a gdaldem color-relief color scale file
+
+        Args:
+            path: path to the color scale file.
+            interpolate: interpolate between entries - otherwise the nearest entry is used, like -nearest_color_entry.
+            values: data to resolve percentage entries against - only required if the scale has percentages.
+                If it has no finite values there is nothing to color, so a transparent lookup table is returned.
+        """
+        entries, _ = read_color_scale(path)
+        if any(isinstance(value, str) for value, _ in entries):
+            values = np.asarray(values, dtype=np.float64)
+            values = values[np.isfinite(values)]
+            if values.size == 0:
+                return cls.from_color('transparent')
+            data_min, data_max = values.min(), values.max()
+            entries = [(data_min + float(value[:-1]) / 100 * (data_max - data_min) if isinstance(value, str) else
+                        value, rgba) for value, rgba in entries]
+        entries = sorted(entries, key=lambda entry: entry[0])
+        entry_values = np.array([value for value, _ in entries])
+        entry_colors = np.array([rgba for _, rgba in entries], dtype=np.float64)
+
+        value_range = (entry_values[0], entry_values[-1])
+        bin_values = np.linspace(value_range[0], value_range[1], LOOKUP_TABLE_SIZE)
+        if interpolate:
+            colors = np.stack(
+                [np.interp(bin_values, entry_values, entry_colors[:, component]) for component in range(4)], axis=-1)
+        else:
+            colors = entry_colors[np.argmin(np.abs(bin_values[:, np.newaxis] - entry_values[np.newaxis]), axis=1)]
+        return cls(np.round(colors), value_range)
+
+    @classmethod
+    def from_colormap(cls, colormap, value_range):
+        """Create a lookup table from a matplotlib colormap, e.g. plt.get_cmap('RdYlGn')"""
+        return cls(np.round(colormap(np.linspace(0, 1, LOOKUP_TABLE_SIZE)) * 255), value_range)
+
+    @classmethod
+    def from_color(cls, color, value_range=(0, 1)):
+        """Create a lookup table that maps every value to a single color"""
+        return cls(np.tile(get_rgba(color), (LOOKUP_TABLE_SIZE, 1)), value_range)
+
+    def quantize(self, values):
+        """Quantize values to uint8 lookup table indices - nan is mapped to the first bin"""
+        value_min, value_max = self.value_range
+        scale = (LOOKUP_TABLE_SIZE - 1) / (value_max - value_min) if value_max > value_min else 0
+        with np.errstate(invalid='ignore'):
+            bins = np.clip((np.asarray(values, dtype=np.float32) - value_min) * scale + 0.5, 0, LOOKUP_TABLE_SIZE - 1)
+        return np.nan_to_num(bins).astype(np.uint8)
+
+    def colorize(self, values, overrides=()):
+        """Color an array of values, returning an RGBA uint8 array with an extra trailing dimension
+
+        Args:
+            values: array of values.
+            overrides: list of (mask, color) - pixels where a mask is True are set to its color, in order.
+        """
+        rgba = self.colors[self.quantize(values)]
+        for mask, color in overrides:
+            rgba[np.asarray(mask, dtype=bool)] = get_rgba(color)
+        return rgba
+
+
+def _write_png_chunk(png_file, chunk_type, data):
+    png_file.write(struct.pack(">I", len(data)))
+    png_file.write(chunk_type + data)
+    png_file.write(struct.pack(">I", zlib.crc32(chunk_type + data) & 0xffffffff))
+
+
+def write_colorized_png(path, values, lookup_table, overrides=(), block_rows=PNG_BLOCK_ROWS):
+    """Color a 2D array with a lookup table and write it as an RGBA PNG, a block of rows at a time
+
+    The image is compressed as it is colored, so the full resolution RGBA image is never held in memory.
+
+    Args:
+        path: output PNG path.
+        values: 2D array of values - e.g. a band's .values.
+        lookup_table: ColorLookupTable
+        overrides: list of (mask, color) - pixels where a mask is True are set to its color, in order.
+        block_rows: number of rows to color and compress at a time.
+    """
+    height, width = values.shape
+    compressor = zlib.compressobj()
+    with open(path, 'wb') as png_file:
+        png_file.write(PNG_SIGNATURE)
+        # 8 bit RGBA, no interlacing.
+        _write_png_chunk(png_file, b'IHDR', struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0))
+        for start in range(0, height, block_rows):
+            stop = min(start + block_rows, height)
+            rgba = lookup_table.colorize(values[start:stop],
+                                         overrides=[(np.asarray(mask)[start:stop], color) for mask, color in overrides])
+            # each row is prefixed with filter type 0 - no filtering.
+            rows = np.zeros((stop - start, width * 4 + 1), dtype=np.uint8)
+            rows[:, 1:] = rgba.reshape(stop - start, width * 4)
+            data = compressor.compress(rows.tobytes())
+            if data:
+                _write_png_chunk(png_file, b'IDAT', data)
+        _write_png_chunk(png_file, b'IDAT', compressor.flush())
+        _write_png_chunk(png_file, b'IEND', b'')
+
+
+def write_single_band_png(path, dataset, band, color_scale=None, fill_color=None, interpolate=True, no_data=-9999):
+    """Write a single band of a dataset as a PNG colored with a gdaldem color-relief color scale
+
+    Replaces write_single_band_png_from_xr. No data pixels are colored with fill_color, then the color scale's nv
+    entry, and are otherwise transparent.
+
+    Args:
+        path: output PNG path.
+        dataset: xarray dataset with latitude and longitude dimensions.
+        band: name of the band to write.
+        color_scale: path to the color scale file.
+        fill_color: optional color for no data pixels - a color name, e.g. black, or an RGB(A) tuple.
+        interpolate: interpolate between color scale entries - otherwise the nearest entry is used.
+        no_data: no data value.
+    """
+    values = dataset[band].values
+    no_data_mask = (values == no_data) | ~np.isfinite(values)
+    entries, scale_no_data_color = read_color_scale(color_scale)
+    if fill_color is None:
+        fill_color = scale_no_data_color if scale_no_data_color is not None else 'transparent'
+    # the data range is only needed to resolve percentage entries.
+    has_percentages = any(isinstance(value, str) for value, _ in entries)
+    lookup_table = ColorLookupTable.from_color_scale(
+        color_scale, interpolate=interpolate, values=values[~no_data_mask] if has_percentages else None)
+    write_colorized_png(path, values, lookup_table, overrides=[(no_data_mask, fill_color)])
@@ -0,0 +1,533 @@
+# Copyright 2016 United States Government as represented by the Administrator
+# of the National Aeronautics and Space Administration. All Rights Reserved.
+#
+# Portion of this code is Copyright Geoscience Australia, Licensed under the
+# Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License
+# at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# The CEOS 2 platform is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import warnings
+
+import numpy as np
+import xarray as xr
+
+from apps.dc_algorithm.masking import get_mask_slice
+
+# Median sketches summarize each band with the exact values of the first observations of each pixel and a per pixel
+# histogram over the valid data range. Both are mergeable, so median mosaics can be time chunked and recombined like
+# create_mosaic. Pixels with at most MEDIAN_EXACT_OBSERVATIONS clear observations - a few years of Landsat 8 - get
+# their exact median. For pixels with more, the middle values are interpolated within the bins that contain them, so
+# the error is bounded by the bin width, (data_max - data_min) / bins, and is usually a small fraction of it.
+# Counts are uint32 so merged sketches can't wrap. A sketch costs bins * 4 bytes plus MEDIAN_EXACT_OBSERVATIONS values
+# per pixel per band whatever the number of scenes - 320 bytes for int16 bands.
+MEDIAN_HISTOGRAM_BINS = 64
+MEDIAN_EXACT_OBSERVATIONS = 32
+HISTOGRAM_DIMENSION = 'histogram_bin'
+HISTOGRAM_SUFFIX = '_histogram'
+OBSERVATION_DIMENSION = 'median_observation'
+OBSERVATION_SUFFIX = '_observations'
+
+# Geomedians are computed with batched Weiszfeld iterations. Pixels stop iterating once their estimate moves less than
+# the tolerance (in data units) - composited values are rounded to the band's dtype, so this doesn't affect the output.
+GEOMEDIAN_TOLERANCE = 0.1
+GEOMEDIAN_MAX_ITERATIONS = 200
+GEOMEDIAN_BATCH_SIZE = 2**16
+
+# bands that don't have a meaningful median - set to no_data in the output mosaic, consistent with create_median_mosaic
+NON_COMPOSITED_BANDS = ['timestamp', 'date', 'satellite']
+
+
+def create_mosaic_from_stack(dataset_in,
+                             clean_mask=None,
+                             intermediate_product=None,
+                             no_data=-9999,
+                             reverse_time=False,
+                             **kwargs):
+    """Create a least or most recent mosaic from a full time stack at once
+
+    Equivalent to create_mosaic, but rather than loading and compositing scene by scene, each band takes the value of
+    its first clear observation along the time axis - the last if reverse_time is set. The clean mask is only unpacked
+    one time slice at a time and slices stop being read once every pixel is filled.
+
+    Args:
+        dataset_in: xarray dataset with a time dimension.
+        clean_mask: boolean or packed mask with the same shape as the data variables in dataset_in.
+        intermediate_product: mosaic to fill - only pixels that are no_data in it are replaced.
+        no_data: no data value.
+        reverse_time: take the most recent clear observation rather than the least recent.
+
+    Returns:
+        xarray dataset with the same data variables as dataset_in, without a time dimension.
+    """
+    bands = list(dataset_in.data_vars)
+    selected = {}
+    for name in bands:
+        values = dataset_in[name].values
+        selected[name] = np.full(values.shape[1:], no_data, dtype=values.dtype) if intermediate_product is None else \
+            intermediate_product[name].values.astype(values.dtype)
+    unfilled = {name: selected[name] == no_data for name in bands}
+
+    time_indices = range(len(dataset_in.time))
+    for time_index in reversed(time_indices) if reverse_time else time_indices:
+        if not any(unfilled[name].any() for name in bands):
+            break
+        clear = None if clean_mask is None else get_mask_slice(clean_mask, time_index)
+        for name in bands:
+            values = dataset_in[name].values[time_index]
+            fill = unfilled[name] & (values != no_data)
+            if clear is not None:
+                fill &= clear
+            selected[name][fill] = values[fill]
+            unfilled[name] &= ~fill
+
+    mosaic = xr.Dataset(coords={'latitude': dataset_in.latitude, 'longitude': dataset_in.longitude})
+    for name in bands:
+        mosaic[name] = (('latitude', 'longitude'), selected[name])
+    return mosaic
+
+
+def create_max_ndvi_mosaic_from_stack(dataset_in, clean_mask=None, intermediate_product=None, no_data=-9999, **kwargs):
+    """Create a max NDVI mosaic from a full time stack at once - see create_ndvi_mosaic_from_stack"""
+    return create_ndvi_mosaic_from_stack(
+        dataset_in, clean_mask=clean_mask, intermediate_product=intermediate_product, no_data=no_data, maximum=True)
+
+
+def create_min_ndvi_mosaic_from_stack(dataset_in, clean_mask=None, intermediate_product=None, no_data=-9999, **kwargs):
+    """Create a min NDVI mosaic from a full time stack at once - see create_ndvi_mosaic_from_stack"""
+    return create_ndvi_mosaic_from_stack(
+        dataset_in, clean_mask=clean_mask, intermediate_product=intermediate_product, no_data=no_data, maximum=False)
+
+
+def create_ndvi_mosaic_from_stack(dataset_in, clean_mask=None, intermediate_product=None, no_data=-9999, maximum=True):
+    """Create a max or min NDVI mosaic from a full time stack at once
+
+    Equivalent to create_max_ndvi_mosaic and create_min_ndvi_mosaic - the index of the max/min NDVI is tracked in a
+    single pass along the time axis, then each band is gathered at that index. Ties go to the earliest observation
+    and undefined NDVI values are treated like unclear observations. The clean mask is unpacked one time slice at a
+    time and NDVI is only held for a single time slice.
+
+    Args:
+        dataset_in: xarray dataset with a time dimension and red and nir bands.
+        clean_mask: boolean or packed mask with the same shape as the data variables in dataset_in.
+        intermediate_product: mosaic with an ndvi band - pixels are only replaced by a higher/lower NDVI.
+        no_data: no data value.
+        maximum: select the maximum NDVI if True, otherwise the minimum.
+
+    Returns:
+        xarray dataset with the same data variables as dataset_in and an ndvi band, without a time dimension.
+    """
+    # unclear observations are never selected over a clear one, consistent with create_max/min_ndvi_mosaic.
+    unclear_ndvi = -1000000000 if maximum else 1000000000
+
+    selected_ndvi, selected_index, selected_clear = None, None, None
+    for time_index in range(len(dataset_in.time)):
+        red = dataset_in.red.values[time_index].astype(np.float32)
+        nir = dataset_in.nir.values[time_index].astype(np.float32)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ndvi = (nir - red) / (nir + red)
+        clear = np.ones(ndvi.shape, dtype=bool) if clean_mask is None else get_mask_slice(clean_mask, time_index)
+        ndvi[~clear | np.isnan(ndvi)] = unclear_ndvi
+        if selected_ndvi is None:
+            selected_ndvi, selected_index, selected_clear = ndvi, np.zeros(ndvi.shape, dtype=np.intp), clear
+            continue
+        # strict comparisons keep the earliest observation on ties, consistent with argmax/argmin.
+        better = ndvi > selected_ndvi if maximum else ndvi < selected_ndvi
+        selected_ndvi[better] = ndvi[better]
+        selected_index[better] = time_index
+        selected_clear = np.where(better, clear, selected_clear)
+
+    replace = None
+    if intermediate_product is not None:
+        intermediate_ndvi = intermediate_product.ndvi.values
+        replace = selected_ndvi > intermediate_ndvi if maximum else selected_ndvi < intermediate_ndvi
+
+    mosaic = xr.Dataset(coords={'latitude': dataset_in.latitude, 'longitude': dataset_in.longitude})
+    for name in [name for name in dataset_in.data_vars if name != 'ndvi'] + ['ndvi']:
+        if name == 'ndvi':
+            selected = selected_ndvi
+        else:
+            values = dataset_in[name].values
+            selected = np.take_along_axis(values, selected_index[np.newaxis], axis=0)[0]
+            selected = np.where(selected_clear, selected, no_data).astype(values.dtype)
+        if replace is not None:
+            selected = np.where(replace, selected, intermediate_product[name].values)
+        mosaic[name] = (('latitude', 'longitude'), selected)
+    return mosaic
+
+
+def create_mosaic_with_clear_counts(dataset_in,
+                                    clean_mask=None,
+                                    intermediate_product=None,
+                                    no_data=-9999,
+                                    reverse_time=False,
+                                    **kwargs):
+    """Create a mosaic and the clear observation counts used for cloud coverage in a single pass
+
+    Equivalent to create_mosaic_from_stack merged with total_pixels, total_clear, and clear_percentage bands. Both
+    products share one intermediate product, so scenes or time chunks can be added by passing the result back in.
+
+    Args:
+        dataset_in: xarray dataset with a time dimension.
+        clean_mask: boolean or packed mask with the same shape as the data variables in dataset_in.
+        intermediate_product: result of a previous call to add the observations to.
+        no_data: no data value.
+        reverse_time: take the most recent clear observation rather than the least recent.
+
+    Returns:
+        xarray dataset with the mosaic bands and total_pixels, total_clear, and clear_percentage.
+    """
+    product = create_mosaic_from_stack(
+        dataset_in,
+        clean_mask=clean_mask,
+        intermediate_product=intermediate_product,
+        no_data=no_data,
+        reverse_time=reverse_time)
+
+    total_pixels = np.full((len(dataset_in.latitude), len(dataset_in.longitude)), len(dataset_in.time), dtype=np.int32)
+    total_clear = np.zeros(total_pixels.shape, dtype=np.int32)
+    for time_index in range(len(dataset_in.time)):
+        total_clear += get_mask_slice(clean_mask, time_index)
+    if intermediate_product is not None:
+        total_pixels += intermediate_product.total_pixels.values.astype(np.int32)
+        total_clear += intermediate_product.total_clear.values.astype(np.int32)
+    product['total_pixels'] = (('latitude', 'longitude'), total_pixels)
+    product['total_clear'] = (('latitude', 'longitude'), total_clear)
+    product['clear_percentage'] = product.total_clear / product.total_pixels
+    return product
+
+
+def is_median_sketch(dataset):
+    """Check whether a dataset is a median sketch rather than loaded data or a mosaic"""
+    return HISTOGRAM_DIMENSION in dataset.dims
+
+
+def create_streaming_median_mosaic(dataset_in,
+                                   clean_mask=None,
+                                   intermediate_product=None,
+                                   no_data=-9999,
+                                   data_range=None,
+                                   mask_bands=None,
+                                   bins=MEDIAN_HISTOGRAM_BINS,
+                                   exact_observations=MEDIAN_EXACT_OBSERVATIONS,
+                                   **kwargs):
+    """Add the clear observations of a dataset to a mergeable median sketch
+
+    Follows the same interface as create_mosaic - the sketch is passed back in as intermediate_product for each
+    time slice or chunk. Sketches can also be passed in as dataset_in, e.g. when recombining time chunks, and are
+    merged with the intermediate product. Use finalize_median_sketch to compute the median mosaic.
+
+    Args:
+        dataset_in: xarray dataset with a time dimension, or a median sketch.
+        clean_mask: boolean or packed mask with the same shape as the data variables in dataset_in - ignored for
+            sketches.
+        intermediate_product: median sketch to add the observations to.
+        no_data: no data value.
+        data_range: (min, max) of valid data values, e.g. the satellite's data_min and data_max. This must be
+            the same for all sketches that are merged. Values outside of the range are counted in the edge bins.
+        mask_bands: bands that are carried through rather than composited, e.g. pixel_qa. A clear value is kept.
+        bins: number of histogram bins for each band.
+        exact_observations: number of observations kept exactly for each pixel.
+
+    Returns:
+        median sketch - an xarray dataset with <band>_histogram and <band>_observations variables for each composited
+        band. Observations are in the band's dtype.
+    """
+    if is_median_sketch(dataset_in):
+        sketch = dataset_in.isel(time=0, drop=True) if 'time' in dataset_in.dims else dataset_in
+    else:
+        sketch = _create_median_sketch(dataset_in, clean_mask, no_data, data_range, mask_bands or [], bins,
+                                       exact_observations)
+    if intermediate_product is None:
+        return sketch
+    return merge_median_sketches(intermediate_product, sketch, no_data=no_data)
+
+
+def _create_median_sketch(dataset_in, clean_mask, no_data, data_range, mask_bands, bins, exact_observations):
+    if data_range is None:
+        raise ValueError("A data range is required to create a median sketch.")
+    data_min, data_max = data_range
+    bin_width = (data_max - data_min) / bins
+
+    sketch = xr.Dataset(
+        coords={
+            HISTOGRAM_DIMENSION: data_min + bin_width * np.arange(bins),
+            OBSERVATION_DIMENSION: np.arange(exact_observations),
+            'latitude': dataset_in.latitude,
+            'longitude': dataset_in.longitude
+        })
+    bands = [name for name in dataset_in.data_vars if name not in NON_COMPOSITED_BANDS]
+    for name in dataset_in.data_vars:
+        if name in NON_COMPOSITED_BANDS:
+            sketch[name] = (('latitude', 'longitude'), np.full(dataset_in[name].shape[1:], no_data,
+                                                               dtype=dataset_in[name].dtype))
+    histograms = {
+        name: np.zeros((bins, ) + dataset_in[name].shape[1:], dtype=np.uint32)
+        for name in bands if name not in mask_bands
+    }
+    observations = {
+        name: np.full((exact_observations, ) + dataset_in[name].shape[1:], no_data, dtype=dataset_in[name].dtype)
+        for name in histograms
+    }
+    counts = {name: np.zeros(dataset_in[name].shape[1:], dtype=np.int64) for name in histograms}
+    first_valid = {
+        name: np.full(dataset_in[name].shape[1:], no_data, dtype=dataset_in[name].dtype)
+        for name in bands if name in mask_bands
+    }
+
+    for time_index in range(len(dataset_in.time)):
+        clear = None if clean_mask is None else get_mask_slice(clean_mask, time_index)
+        for name in bands:
+            values = dataset_in[name].values[time_index]
+            valid = values != no_data
+            if clear is not None:
+                valid &= clear
+            if name in histograms:
+                _add_to_histogram(histograms[name], values, valid, data_min, bin_width)
+                # the first observations of each pixel are kept exactly.
+                keep = valid & (counts[name] < exact_observations)
+                latitude_index, longitude_index = np.nonzero(keep)
+                observations[name][counts[name][keep], latitude_index, longitude_index] = values[keep]
+                counts[name] += valid
+            else:
+                fill = valid & (first_valid[name] == no_data)
+                first_valid[name][fill] = values[fill]
+
+    for name in bands:
+        if name in histograms:
+            sketch[name + HISTOGRAM_SUFFIX] = ((HISTOGRAM_DIMENSION, 'latitude', 'longitude'), histograms[name])
+            sketch[name + OBSERVATION_SUFFIX] = ((OBSERVATION_DIMENSION, 'latitude', 'longitude'),
+                                                 _clear_inexact(observations[name], counts[name], no_data))
+        else:
+            sketch[name] = (('latitude', 'longitude'), first_valid[name])
+    return sketch
+
+
+def _add_to_histogram(histogram, values, valid, data_min, bin_width):
+    """Add the valid observations of a (latitude, longitude) time slice to a (bin, latitude, longitude) histogram"""
+    bins = histogram.shape[0]
+    latitude_index, longitude_index = np.nonzero(valid)
+    bin_index = np.clip(np.floor((values[valid] - data_min) / bin_width), 0, bins - 1).astype(np.intp)
+    # each pixel is only counted once per time slice, so the indices are unique and can be incremented directly.
+    histogram[bin_index, latitude_index, longitude_index] += 1
+
+
+def _clear_inexact(observations, counts, no_data):
+    """Set the observations of pixels with more observations than are kept exactly to no_data"""
+    observations[:, counts > observations.shape[0]] = no_data
+    return observations
+
+
+def _get_first_valid(values, valid, no_data):
+    """Get the first valid value along the time axis, or no_data where there are none"""
+    first_valid = np.take_along_axis(values, np.argmax(valid, axis=0)[np.newaxis], axis=0)[0]
+    return np.where(valid.any(axis=0), first_valid, no_data).astype(values.dtype)
+
+
+def merge_median_sketches(sketch, other, no_data=-9999):
+    """Merge two median sketches over the same geographic extent and data range"""
+    merged = xr.Dataset(coords=sketch.coords)
+    for name in sketch.data_vars:
+        if HISTOGRAM_DIMENSION in sketch[name].dims:
+            merged[name] = sketch[name].astype(np.uint32) + other[name].astype(np.uint32)
+        elif OBSERVATION_DIMENSION in sketch[name].dims:
+            histogram_name = name[:-len(OBSERVATION_SUFFIX)] + HISTOGRAM_SUFFIX
+            merged[name] = (sketch[name].dims,
+                            _merge_observations(sketch[name].values, _get_counts(sketch[histogram_name]),
+                                                other[name].values, _get_counts(other[histogram_name]), no_data))
+        else:
+            merged[name] = sketch[name].where(sketch[name] != no_data, other[name])
+    return merged
+
+
+def _get_counts(histogram):
+    return histogram.values.sum(axis=0, dtype=np.int64)
+
+
+def _merge_observations(observations, counts, other_observations, other_counts, no_data):
+    """Append the exact observations of one sketch to another's for the pixels where they all fit"""
+    merged = observations.copy()
+    for index in range(observations.shape[0]):
+        fits = (index < other_counts) & (counts + index < observations.shape[0])
+        latitude_index, longitude_index = np.nonzero(fits)
+        merged[counts[fits] + index, latitude_index, longitude_index] = other_observations[index][fits]
+    return _clear_inexact(merged, counts + other_counts, no_data)
+
+
+def finalize_median_sketch(sketch, no_data=-9999):
+    """Compute the median mosaic from a median sketch
+
+    Datasets that aren't median sketches are returned as is, so this can be applied to the result of any compositor.
+    Composited bands are returned in the dtype of the bands the sketch was created from.
+
+    Args:
+        sketch: median sketch created by create_streaming_median_mosaic.
+        no_data: value used for pixels without any clear observations.
+
+    Returns:
+        xarray dataset with the median of each composited band and the mask bands.
+    """
+    if not is_median_sketch(sketch):
+        return sketch
+    bin_edges = sketch[HISTOGRAM_DIMENSION].values
+    bin_width = bin_edges[1] - bin_edges[0]
+
+    mosaic = xr.Dataset(coords={'latitude': sketch.latitude, 'longitude': sketch.longitude})
+    for name in sketch.data_vars:
+        if OBSERVATION_DIMENSION in sketch[name].dims:
+            continue
+        if HISTOGRAM_DIMENSION not in sketch[name].dims:
+            mosaic[name] = sketch[name]
+            continue
+        band = name[:-len(HISTOGRAM_SUFFIX)]
+        observations = sketch[band + OBSERVATION_SUFFIX].values
+        counts = sketch[name].values.sum(axis=0, dtype=np.int64)
+        median = np.where(counts <= observations.shape[0], _get_exact_median(observations, counts),
+                          _estimate_median(sketch[name].values, bin_edges[0], bin_width))
+        mosaic[band] = (('latitude', 'longitude'), np.where(np.isnan(median), no_data,
+                                                            np.round(median)).astype(observations.dtype))
+    return mosaic
+
+
+def _get_exact_median(observations, counts):
+    """Get the median of the exactly kept observations - NaN for pixels without observations or with too many"""
+    kept = np.arange(observations.shape[0])[:, np.newaxis, np.newaxis] < counts
+    with np.errstate(invalid='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)
+        return np.nanmedian(np.where(kept, observations, np.nan), axis=0)
+
+
+def _estimate_median(counts, data_min, bin_width):
+    """Estimate the median as the mean of the middle order statistics - NaN for pixels without observations"""
+    cumulative_counts = np.cumsum(counts, axis=0, dtype=np.int64)
+    total_counts = cumulative_counts[-1]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        median = (_estimate_order_statistic(counts, cumulative_counts, (total_counts + 1) // 2, data_min, bin_width) +
+                  _estimate_order_statistic(counts, cumulative_counts, total_counts // 2 + 1, data_min, bin_width)) / 2
+    return np.where(total_counts > 0, median, np.nan)
+
+
+def _estimate_order_statistic(counts, cumulative_counts, rank, data_min, bin_width):
+    """Estimate the value with a 1 based rank, assuming values are evenly spread within the bin that contains it"""
+    rank_bin = np.argmax(cumulative_counts >= rank, axis=0)[np.newaxis]
+    bin_counts = np.take_along_axis(counts, rank_bin, axis=0)[0]
+    counts_below = np.take_along_axis(cumulative_counts, rank_bin, axis=0)[0] - bin_counts
+    return data_min + (rank_bin[0] + (rank - counts_below - 0.5) / bin_counts) * bin_width
+
+
+def create_geomedian_mosaic(dataset_in,
+                            clean_mask=None,
+                            intermediate_product=None,
+                            no_data=-9999,
+                            mask_bands=None,
+                            tolerance=GEOMEDIAN_TOLERANCE,
+                            max_iterations=GEOMEDIAN_MAX_ITERATIONS,
+                            **kwargs):
+    """Create a geometric median mosaic using vectorized Weiszfeld iterations
+
+    Replaces create_hdmedians_multiple_band_mosaic with operation='median' - rather than computing the geomedian
+    pixel by pixel, all of the pixels in a batch are iterated at once in float32. Pixels drop out of the iteration
+    as they converge. Iteration starts from the band-wise median, or from intermediate_product if provided, e.g.
+    a previous geomedian of the same area.
+
+    Args:
+        dataset_in: xarray dataset with a time dimension.
+        clean_mask: boolean or packed mask with the same shape as the data variables in dataset_in.
+        intermediate_product: optional mosaic used as the initial estimate.
+        no_data: no data value. Observations with no_data in any composited band are ignored.
+        mask_bands: bands that are carried through rather than composited, e.g. pixel_qa. A clear value is kept.
+        tolerance: distance in data units under which a pixel is considered converged.
+        max_iterations: maximum number of Weiszfeld iterations.
+
+    Returns:
+        xarray dataset with the geomedian of each composited band, in the band's dtype.
+    """
+    mask_bands = mask_bands or []
+    bands = [name for name in dataset_in.data_vars if name not in mask_bands + NON_COMPOSITED_BANDS]
+    time_count, latitude_count, longitude_count = dataset_in[bands[0]].shape
+    pixel_count = latitude_count * longitude_count
+
+    # (band, time, pixel) float32 stack - observations that aren't clear in all bands are excluded.
+    observations = np.stack([dataset_in[band].values.reshape(time_count, pixel_count) for band in bands])
+    valid = np.all(observations != no_data, axis=0)
+    if clean_mask is not None:
+        for time_index in range(time_count):
+            valid[time_index] &= get_mask_slice(clean_mask, time_index).reshape(pixel_count)
+    observations = observations.astype(np.float32)
+
+    if intermediate_product is not None:
+        estimate = np.stack([intermediate_product[band].values.reshape(pixel_count) for band in bands])
+        estimate = np.where(estimate == no_data, np.nan, estimate).astype(np.float32)
+    else:
+        with np.errstate(invalid='ignore'), warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            estimate = np.nanmedian(np.where(valid, observations, np.nan), axis=1).astype(np.float32)
+
+    for start in range(0, pixel_count, GEOMEDIAN_BATCH_SIZE):
+        pixels = slice(start, start + GEOMEDIAN_BATCH_SIZE)
+        estimate[:, pixels] = _weiszfeld(observations[:, :, pixels], valid[:, pixels], estimate[:, pixels], tolerance,
+                                         max_iterations)
+
+    has_data = valid.any(axis=0)
+    mosaic = xr.Dataset(coords={'latitude': dataset_in.latitude, 'longitude': dataset_in.longitude})
+    for index, band in enumerate(bands):
+        values = np.where(has_data, np.round(estimate[index]), no_data).astype(dataset_in[band].dtype)
+        mosaic[band] = (('latitude', 'longitude'), values.reshape(latitude_count, longitude_count))
+    for name in dataset_in.data_vars:
+        values = dataset_in[name].values
+        if name in NON_COMPOSITED_BANDS:
+            mosaic[name] = (('latitude', 'longitude'), np.full(values.shape[1:], no_data, dtype=values.dtype))
+        elif name in mask_bands:
+            mosaic[name] = (('latitude', 'longitude'), _get_first_valid(values, valid.reshape(values.shape), no_data))
+    return mosaic
+
+
+def _weiszfeld(observations, valid, estimate, tolerance, max_iterations):
+    """Run Weiszfeld iterations on a (band, time, pixel) batch until all pixels have converged
+
+    Pixels without a valid initial estimate are started from the mean of their valid observations.
+    """
+    observation_count = valid.sum(axis=0)
+    observations = np.where(valid, observations, 0)
+    missing_estimate = np.isnan(estimate).any(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = observations.sum(axis=1) / observation_count
+    estimate = np.where(missing_estimate, mean, estimate).astype(np.float32)
+
+    # pixels without any observations are never iterated.
+    active = np.flatnonzero(observation_count > 0)
+    for _ in range(max_iterations):
+        if active.size == 0:
+            break
+        active_observations = observations[:, :, active]
+        active_estimate = estimate[:, active]
+        offsets = active_observations - active_estimate[:, np.newaxis]
+        distances = np.sqrt(np.sum(offsets**2, axis=0))
+        # observations that coincide with the estimate are handled with the Vardi-Zhang modification rather than
+        # given an infinite weight, otherwise estimates that start on an observation never move.
+        coincident = valid[:, active] & (distances < tolerance / 100)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weights = np.where(valid[:, active] & ~coincident, 1 / distances, 0).astype(np.float32)
+            weight_sum = np.sum(weights, axis=0)
+            weighted_mean = np.sum(active_observations * weights, axis=1) / weight_sum
+            pull = np.sqrt(np.sum(np.sum(offsets * weights, axis=1)**2, axis=0))
+            coincident_count = coincident.sum(axis=0)
+            coincident_fraction = np.where(coincident_count > 0, np.minimum(1, coincident_count / pull), 0)
+        updated_estimate = np.where(weight_sum > 0, (1 - coincident_fraction) * weighted_mean +
+                                    coincident_fraction * active_estimate, active_estimate).astype(np.float32)
+        shift = np.sqrt(np.sum((updated_estimate - active_estimate)**2, axis=0))
+        estimate[:, active] = updated_estimate
+        active = active[shift > tolerance]
+    return estimate
@@ -0,0 +1,301 @@
+# Copyright 2016 United States Government as represented by the Administrator
+# of the National Aeronautics and Space Administration. All Rights Reserved.
+#
+# Portion of this code is Copyright Geoscience Australia, Licensed under the
+# Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License
+# at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# The CEOS 2 platform is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import datetime
+import math
+
+import numpy as np
+import xarray as xr
+from datacube.utils.geometry import CRS
+
+from utils.data_cube_utilities.dc_chunker import create_geographic_chunks
+
+# Time chunks are loaded and composited as a single stack if their estimated size is under this many bytes.
+# Compositing allocates masks and float32 temporaries, so the loaded data is assumed to take up a fraction of it.
+MAX_STACK_SIZE = 2 * 1024**3
+STACK_OVERHEAD = 4
+
+
+def search_datasets(api, product=None, products=None, time=None, longitude=None, latitude=None, **kwargs):
+    """Run a single index search for all datasets that intersect a query
+
+    The search is done once per task by the planner and the resulting datasets are passed down
+    to the chunk processing tasks, which load them directly rather than searching the index again.
+    Accepts the same parameter dict used with the DataAccessApi - either 'product' or 'products'.
+
+    Args:
+        api: DataAccessApi instance
+        product/products: product name or list of product names to search.
+        time, longitude, latitude: ranges used to filter the search.
+
+    Returns:
+        list of datacube Dataset objects across all of the products.
+    """
+    products = products if products is not None else [product]
+    query = {}
+    if time is not None:
+        query['time'] = time
+    if longitude is not None and latitude is not None:
+        query['longitude'] = longitude
+        query['latitude'] = latitude
+
+    datasets = []
+    for product_name in products:
+        datasets.extend(api.dc.find_datasets(product=product_name, ensure_location=True, **query))
+    return datasets
+
+
+def get_dataset_time(dataset):
+    """Get the acquisition time of a dataset as a naive UTC datetime truncated to milliseconds
+
+    This matches the precision of the dates returned by DataAccessApi.list_acquisition_dates so
+    that dates listed from datasets can be used interchangeably with dates listed from loaded data.
+    """
+    return normalize_acquisition_time(dataset.center_time)
+
+
+def normalize_acquisition_time(time):
+    """Convert a datetime to a naive UTC datetime truncated to milliseconds"""
+    if time.tzinfo is not None:
+        time = time.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return time.replace(microsecond=(time.microsecond // 1000) * 1000)
+
+
+def get_dataset_bounds(dataset):
+    """Get the latitude and longitude ranges of a dataset's extent as a tuple of (latitude, longitude)"""
+    bounds = dataset.extent.to_crs(CRS('EPSG:4326')).boundingbox
+    return (bounds.bottom, bounds.top), (bounds.left, bounds.right)
+
+
+def get_time_bounds(time):
+    """Convert a time range containing dates or datetimes to a pair of datetimes
+
+    Dates are treated as whole days, consistent with the Data Cube query semantics.
+    Accepts either a (start, end) tuple or an ordered list of datetimes such as a time chunk.
+    """
+    start, end = time[0], time[-1]
+    if not isinstance(start, datetime.datetime):
+        start = datetime.datetime.combine(start, datetime.time.min)
+    if not isinstance(end, datetime.datetime):
+        end = datetime.datetime.combine(end, datetime.time.max)
+    # time chunks can be in reverse order, e.g. for most recent mosaics.
+    return min(start, end), max(start, end)
+
+
+def ranges_intersect(range_a, range_b):
+    """Check whether two (min, max) ranges overlap - bounds are inclusive"""
+    return min(range_a) <= max(range_b) and min(range_b) <= max(range_a)
+
+
+def select_datasets(datasets, time=None, longitude=None, latitude=None, **kwargs):
+    """Select the datasets that fall within a time range and/or intersect a geographic extent
+
+    Used to resolve the datasets for a single chunk window from the result of search_datasets
+    without querying the index.
+
+    Args:
+        datasets: list of datacube Dataset objects.
+        time: optional (start, end) tuple of dates or datetimes or an ordered list of datetimes - inclusive.
+        longitude, latitude: optional (min, max) tuples.
+
+    Returns:
+        list of the datasets that match all of the provided criteria.
+    """
+    if time is not None:
+        start, end = get_time_bounds(time)
+        datasets = [dataset for dataset in datasets if start <= get_dataset_time(dataset) <= end]
+    if longitude is not None and latitude is not None:
+        selected = []
+        for dataset in datasets:
+            dataset_latitude, dataset_longitude = get_dataset_bounds(dataset)
+            if ranges_intersect(dataset_latitude, latitude) and ranges_intersect(dataset_longitude, longitude):
+                selected.append(dataset)
+        datasets = selected
+    return datasets
+
+
+def group_datasets_by_geographic_chunk(datasets, geographic_chunks):
+    """Split a list of datasets into lists that intersect each of the geographic chunks
+
+    Dataset bounds are computed once rather than once per chunk.
+
+    Args:
+        datasets: list of datacube Dataset objects.
+        geographic_chunks: list of dicts with 'latitude' and 'longitude' ranges, e.g. from create_geographic_chunks
+
+    Returns:
+        list of lists of datasets, in the same order as geographic_chunks.
+    """
+    dataset_bounds = [(dataset, get_dataset_bounds(dataset)) for dataset in datasets]
+    return [[
+        dataset for dataset, (latitude, longitude) in dataset_bounds
+        if ranges_intersect(latitude, geographic_chunk['latitude'])
+        and ranges_intersect(longitude, geographic_chunk['longitude'])
+    ] for geographic_chunk in geographic_chunks]
+
+
+def get_acquisition_dates(datasets, time=None, **kwargs):
+    """List the unique acquisition dates of a list of datasets in ascending order
+
+    Equivalent to DataAccessApi.list_acquisition_dates and list_combined_acquisition_dates
+    when given the result of search_datasets, but without a query to the index.
+    """
+    if time is not None:
+        datasets = select_datasets(datasets, time=time)
+    return sorted(set(get_dataset_time(dataset) for dataset in datasets))
+
+
+def stack_fits_in_memory(datasets, measurements=None, longitude=None, latitude=None, max_size=MAX_STACK_SIZE,
+                         **kwargs):
+    """Estimate whether all of the data for a list of datasets can be loaded and composited at once
+
+    Used to load a time chunk as a single stack rather than acquisition by acquisition. The estimate uses the
+    storage resolution and measurement dtypes of the datasets' product - datasets without storage information,
+    e.g. unindexed products, are never considered to fit.
+
+    Args:
+        datasets: list of datacube Dataset objects that would be loaded.
+        measurements: list of measurements to load - all of the product's measurements if None.
+        longitude, latitude: ranges to load.
+        max_size: maximum size in bytes, including compositing temporaries.
+
+    Returns:
+        True if the stack fits in max_size.
+    """
+    if len(datasets) == 0:
+        return True
+    product = datasets[0].type
+    resolution = product.definition.get('storage', {}).get('resolution', {})
+    if 'latitude' not in resolution or 'longitude' not in resolution or longitude is None or latitude is None:
+        return False
+
+    pixel_count = ((abs(latitude[1] - latitude[0]) / abs(resolution['latitude']) + 1) *
+                   (abs(longitude[1] - longitude[0]) / abs(resolution['longitude']) + 1))
+    measurements = measurements or list(product.measurements)
+    pixel_size = sum(
+        np.dtype(product.measurements[name]['dtype']).itemsize for name in measurements if name in product.measurements)
+    acquisition_count = len(get_acquisition_dates(datasets))
+    return acquisition_count * pixel_count * pixel_size * STACK_OVERHEAD <= max_size
+
+
+def load_datasets(api, datasets, product=None, products=None, platforms=None, measurements=None, longitude=None,
+                  latitude=None, **kwargs):
+    """Load a list of previously resolved datasets without searching the index
+
+    Mirrors DataAccessApi.get_dataset_by_extent and get_stacked_datasets_by_extent - if 'products'
+    is provided, each product is loaded seperately and stacked over time with a 'satellite' band
+    containing the index of the product the observation came from.
+
+    Args:
+        api: DataAccessApi instance
+        datasets: list of datacube Dataset objects to load, e.g. from select_datasets.
+        product/products: product name or list of product names.
+        measurements: list of measurements to load.
+        longitude, latitude: ranges to load.
+
+    Returns:
+        xarray dataset containing the loaded data - for stacked products, None if there was no data.
+    """
+    load_params = {'measurements': measurements, 'longitude': longitude, 'latitude': latitude}
+
+    if products is None:
+        if len(datasets) == 0:
+            return xr.Dataset()
+        return api.dc.load(datasets=datasets, **load_params)
+
+    data_array = []
+    for index, product_name in enumerate(products):
+        product_datasets = [dataset for dataset in datasets if dataset.type.name == product_name]
+        if len(product_datasets) == 0:
+            continue
+        product_data = api.dc.load(datasets=product_datasets, **load_params)
+        if 'time' in product_data:
+            product_data['satellite'] = xr.DataArray(
+                np.full(product_data[list(product_data.data_vars)[0]].values.shape, index, dtype="int16"),
+                dims=('time', 'latitude', 'longitude'))
+            data_array.append(product_data)
+
+    if len(data_array) == 0:
+        return None
+    combined_data = xr.concat(data_array, 'time')
+    return combined_data.reindex({'time': sorted(combined_data.time.values)})
+
+
+def _get_aligned_ranges(value_range, tile_size, step, resolution, descending=False):
+    """Split a range at the storage tile boundaries and every step from the start of each tile
+
+    Tiles are on a grid with an origin of zero. Tiles with descending coordinates (a negative resolution, as with the
+    latitude of ingested products) are stored from their upper edge, so steps are taken down from the end of the tile.
+    Boundaries within half a pixel of the ends of the range are dropped so no range is a sliver without pixels.
+    """
+    low, high = min(value_range), max(value_range)
+    margin = resolution / 2
+    boundaries = []
+    tile_index = int(math.floor(low / tile_size))
+    while tile_index * tile_size < high:
+        tile_start = tile_index * tile_size
+        step_index = 0
+        while step_index * step < tile_size - margin:
+            offset = step_index * step
+            boundary = tile_start + tile_size - offset if descending and offset > 0 else tile_start + offset
+            if low + margin < boundary < high - margin:
+                boundaries.append(boundary)
+            step_index += 1
+        tile_index += 1
+    edges = [low] + sorted(boundaries) + [high]
+    return list(zip(edges[:-1], edges[1:]))
+
+
+def create_storage_aligned_chunks(datasets, longitude=None, latitude=None, geographic_chunk_size=0.5, **kwargs):
+    """Split a geographic extent into chunks aligned with the storage units of the datasets that will be loaded
+
+    Chunks never cross a storage tile boundary and are whole multiples of the internal NetCDF chunk shape from the
+    start of each tile, so each compressed block is only read by one chunk task and each chunk task opens as few
+    files as possible. The tile size, resolution, and internal chunking come from the product's storage definition,
+    with tiles on a grid from (0, 0) and descending axes chunked from the upper edge of each tile. Falls back to
+    create_geographic_chunks for products that aren't stored on a geographic grid.
+
+    Args:
+        datasets: list of datacube Dataset objects that will be loaded, e.g. from search_datasets.
+        longitude, latitude: (min, max) ranges to chunk.
+        geographic_chunk_size: approximate area of each chunk in square degrees, as with create_geographic_chunks.
+
+    Returns:
+        list of dicts with 'latitude' and 'longitude' ranges.
+    """
+    storage = datasets[0].type.definition.get('storage', {}) if len(datasets) > 0 else {}
+    tile_size, resolution = storage.get('tile_size', {}), storage.get('resolution', {})
+    if any(axis not in tile_size or axis not in resolution for axis in ['latitude', 'longitude']):
+        return create_geographic_chunks(
+            longitude=longitude, latitude=latitude, geographic_chunk_size=geographic_chunk_size)
+
+    chunk_side = math.sqrt(geographic_chunk_size)
+    ranges = {}
+    for axis, value_range in [('latitude', latitude), ('longitude', longitude)]:
+        axis_tile_size, axis_resolution = abs(tile_size[axis]), abs(resolution[axis])
+        block_size = storage.get('chunking', {}).get(axis, 1) * axis_resolution
+        step = min(max(1, int(round(chunk_side / block_size))) * block_size, axis_tile_size)
+        ranges[axis] = _get_aligned_ranges(value_range, axis_tile_size, step, axis_resolution,
+                                           descending=resolution[axis] < 0)
+    return [{
+        'latitude': latitude_range,
+        'longitude': longitude_range
+    } for latitude_range in ranges['latitude'] for longitude_range in ranges['longitude']]
@@ -0,0 +1,233 @@
+# Copyright 2016 United States Government as represented by the Administrator
+# of the National Aeronautics and Space Administration. All Rights Reserved.
+#
+# Portion of this code is Copyright Geoscience Australia, Licensed under the
+# Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License
+# at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# The CEOS 2 platform is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import fcntl
+import json
+import os
+import shutil
+import uuid
+
+import numpy as np
+import xarray as xr
+from django.conf import settings
+
+from apps.dc_algorithm.data_access import (create_storage_aligned_chunks, get_dataset_bounds, get_dataset_time,
+                                           ranges_intersect)
+from apps.dc_algorithm.product_cache import get_cache_key
+
+# Included in the keys of derived layers - increment a layer's version whenever the algorithm that creates it changes.
+DERIVED_LAYER_VERSIONS = {'wofs': 1, 'fractional_cover': 1}
+
+# Tiles are derived in blocks of about this many square degrees so the reflectance of a whole tile is never loaded.
+DERIVED_LAYER_BLOCK_SIZE = 0.05
+
+
+def get_derived_layer_dir():
+    """Get the directory derived layers are stored in - shared by all apps, so not under an app's base_result_dir"""
+    return settings.DERIVED_LAYER_DIR
+
+
+def _build_tile(tile_dir, name, compute, api, dataset, measurements, clean_mask_func, parameters):
+    """Derive a layer over the whole extent of a dataset and store each of its variables as a .npy file
+
+    Datasets of ingested products are storage tiles, so each tile is derived once whatever chunk first needs it.
+    Files are written to a temporary directory that is moved into place so tiles are never read partially written.
+
+    Returns:
+        True if the tile was stored, False if there is no data for the dataset.
+    """
+    latitude, longitude = get_dataset_bounds(dataset)
+    blocks = []
+    for block in create_storage_aligned_chunks(
+            [dataset], latitude=latitude, longitude=longitude, geographic_chunk_size=DERIVED_LAYER_BLOCK_SIZE):
+        data = api.dc.load(datasets=[dataset], measurements=measurements, **block)
+        if 'time' not in data.dims:
+            continue
+        blocks.append(compute(data, clean_mask=clean_mask_func(data), **parameters).isel(time=0, drop=True))
+    if len(blocks) == 0:
+        return False
+    layer = _merge_blocks(blocks, parameters.get('no_data', -9999))
+
+    temp_dir = "{}.{}.tmp".format(tile_dir, uuid.uuid4().hex)
+    os.makedirs(temp_dir)
+    for variable in layer.data_vars:
+        np.save(os.path.join(temp_dir, variable + ".npy"), layer[variable].values)
+    np.save(os.path.join(temp_dir, "latitude.npy"), layer.latitude.values)
+    np.save(os.path.join(temp_dir, "longitude.npy"), layer.longitude.values)
+    with open(os.path.join(temp_dir, "layer.json"), 'w') as layer_file:
+        json.dump({
+            'variables': list(layer.data_vars),
+            'attrs': {key: str(value) for key, value in layer.attrs.items()}
+        }, layer_file)
+    if os.path.exists(tile_dir):
+        shutil.rmtree(tile_dir)
+    os.rename(temp_dir, tile_dir)
+    return True
+
+
+def _get_pixel_indices(values, resolution):
+    return np.round(np.asarray(values, dtype=np.float64) / resolution).astype(np.int64)
+
+
+def _merge_blocks(blocks, no_data):
+    """Merge blocks of a layer on the same grid into a single layer
+
+    Blocks are loaded with inclusive bounds, so adjacent blocks can share a row or column of pixels. Coordinates are
+    matched by pixel index rather than value, as the coordinates of each block are computed from its own origin.
+    """
+    coords, indices = {}, {}
+    for axis in ['latitude', 'longitude']:
+        axis_values = next((block[axis].values for block in blocks if block[axis].size > 1), blocks[0][axis].values)
+        resolution = abs(float(axis_values[1] - axis_values[0])) if axis_values.size > 1 else 1
+        pixel_indices = [_get_pixel_indices(block[axis].values, resolution) for block in blocks]
+        unique_indices, first_index = np.unique(np.concatenate(pixel_indices), return_index=True)
+        axis_coords = np.concatenate([block[axis].values for block in blocks])[first_index]
+        # keep the orientation of the loaded data, e.g. descending latitudes.
+        if axis_values.size > 1 and axis_values[0] > axis_values[-1]:
+            unique_indices, axis_coords = unique_indices[::-1], axis_coords[::-1]
+        position = {pixel_index: position for position, pixel_index in enumerate(unique_indices.tolist())}
+        coords[axis] = axis_coords
+        indices[axis] = [np.array([position[pixel_index] for pixel_index in block_indices.tolist()])
+                         for block_indices in pixel_indices]
+
+    layer = xr.Dataset(coords=coords, attrs=blocks[0].attrs)
+    for variable in blocks[0].data_vars:
+        values = np.full((coords['latitude'].size, coords['longitude'].size), no_data, dtype=blocks[0][variable].dtype)
+        for index, block in enumerate(blocks):
+            values[np.ix_(indices['latitude'][index], indices['longitude'][index])] = block[variable].values
+        layer[variable] = (('latitude', 'longitude'), values)
+    return layer
+
+
+def _load_tile(tile_dir):
+    """Memory map a stored tile, or None if it isn't stored or was partially pruned"""
+    try:
+        with open(os.path.join(tile_dir, "layer.json")) as layer_file:
+            description = json.load(layer_file)
+        coords = {
+            'latitude': np.load(os.path.join(tile_dir, "latitude.npy")),
+            'longitude': np.load(os.path.join(tile_dir, "longitude.npy"))
+        }
+        tile = xr.Dataset(
+            {
+                variable: (('latitude', 'longitude'), np.load(os.path.join(tile_dir, variable + ".npy"), mmap_mode='r'))
+                for variable in description['variables']
+            },
+            coords=coords,
+            attrs=description['attrs'])
+    except (OSError, IOError, ValueError):
+        return None
+    # tiles are pruned by last use rather than creation.
+    for file_name in os.listdir(tile_dir):
+        os.utime(os.path.join(tile_dir, file_name), None)
+    return tile
+
+
+def _open_tile(name, compute, api, dataset, measurements, clean_mask_func, parameters):
+    """Open the tile of a derived layer for a dataset, deriving it first if it hasn't been derived by any app"""
+    latitude, longitude = get_dataset_bounds(dataset)
+    layer_dir = os.path.join(get_derived_layer_dir(), name)
+    tile_dir = os.path.join(layer_dir,
+                            get_cache_key(
+                                version=DERIVED_LAYER_VERSIONS[name],
+                                dataset=str(dataset.id),
+                                latitude=latitude,
+                                longitude=longitude,
+                                parameters=parameters))
+    tile = _load_tile(tile_dir)
+    if tile is not None:
+        return tile
+
+    os.makedirs(layer_dir, exist_ok=True)
+    # chunk tasks on a node share tiles - the lock ensures each tile is only derived once.
+    with open(tile_dir + ".lock", 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        tile = _load_tile(tile_dir)
+        if tile is None and _build_tile(tile_dir, name, compute, api, dataset, measurements, clean_mask_func,
+                                        parameters):
+            tile = _load_tile(tile_dir)
+    return tile
+
+
+def get_derived_layer(name, compute, api, data, datasets, measurements, clean_mask_func, no_data=-9999, **kwargs):
+    """Get a per-scene derived layer, e.g. a WOFS classification, for loaded data from a store shared by all apps
+
+    Layers are derived and stored per dataset - for ingested products, per storage tile and acquisition - keyed by
+    the dataset id, its extent, the layer version, and the parameters. Any app that needs the layer for any chunk of
+    the same tile reads it rather than deriving it from reflectance again, whatever its chunk size.
+
+    Args:
+        name: name of the layer - must be in DERIVED_LAYER_VERSIONS.
+        compute: function used to derive the layer, called as compute(data, clean_mask=clean_mask, **kwargs).
+        api: DataAccessApi instance used to load the tiles that haven't been derived yet.
+        data: xarray dataset with a time dimension - the layer is returned on the same times and grid.
+        datasets: list of the datasets that data was loaded from.
+        measurements: measurements required by compute.
+        clean_mask_func: function returning the clean mask for loaded data, e.g. from Satellite.get_clean_mask_func.
+        no_data: no data value - passed to compute and used for pixels outside of all tiles.
+        kwargs: additional arguments for compute - these are part of the key.
+
+    Returns:
+        xarray dataset containing the derived layer for each time in data.
+    """
+    parameters = dict(kwargs, no_data=no_data)
+    latitude = (float(data.latitude.min()), float(data.latitude.max()))
+    longitude = (float(data.longitude.min()), float(data.longitude.max()))
+
+    scenes = []
+    for time in data.time.values.astype('M8[ms]').tolist():
+        scene = None
+        for dataset in datasets:
+            dataset_latitude, dataset_longitude = get_dataset_bounds(dataset)
+            if get_dataset_time(dataset) != time or not (ranges_intersect(dataset_latitude, latitude) and
+                                                         ranges_intersect(dataset_longitude, longitude)):
+                continue
+            tile = _open_tile(name, compute, api, dataset, measurements, clean_mask_func, parameters)
+            if tile is None:
+                continue
+            tile = _reindex_like(tile, data, no_data)
+            # scenes split over several tiles are combined - the first tile with data wins, as with dc.load.
+            scene = tile if scene is None else scene.where(scene != no_data, tile)
+        scenes.append(scene)
+
+    # scenes without any stored tiles, e.g. data that isn't from an indexed dataset, are derived directly.
+    missing = [index for index, scene in enumerate(scenes) if scene is None]
+    if len(missing) > 0:
+        missing_data = data.isel(time=missing)
+        derived = compute(missing_data, clean_mask=clean_mask_func(missing_data), **parameters)
+        for derived_index, index in enumerate(missing):
+            scenes[index] = derived.isel(time=derived_index, drop=True)
+    return xr.concat(scenes, 'time').assign_coords(time=data.time.values)
+
+
+def _reindex_like(tile, data, no_data):
+    """Select the pixels of a tile on the grid of loaded data - pixels outside of the tile are set to no_data"""
+    resolution = min(
+        abs(float(tile[axis][1] - tile[axis][0])) if tile[axis].size > 1 else 0 for axis in ['latitude', 'longitude'])
+    reindexed = tile.reindex(
+        latitude=data.latitude.values, longitude=data.longitude.values, method='nearest', tolerance=resolution / 2)
+    return xr.Dataset(
+        {
+            variable: reindexed[variable].fillna(no_data).astype(tile[variable].dtype)
+            for variable in tile.data_vars
+        },
+        attrs=tile.attrs)
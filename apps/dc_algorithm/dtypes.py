@@ -0,0 +1,105 @@
+# Copyright 2016 United States Government as represented by the Administrator
+# of the National Aeronautics and Space Administration. All Rights Reserved.
+#
+# Portion of this code is Copyright Geoscience Australia, Licensed under the
+# Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License
+# at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# The CEOS 2 platform is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import numpy as np
+
+# Data is loaded in its native dtype (int16 for surface reflectance) and is never upcast by the dtype policy.
+# Floating point products are narrowed to the app's processing dtype before they are written to disk.
+DEFAULT_PROCESSING_DTYPE = 'float32'
+# Variables with a scale factor are stored as int16 multiples of it, with the smallest int16 value marking no data.
+# The attributes record how to decode them, and use names that NetCDF readers won't decode on their own.
+SCALED_DTYPE = np.int16
+SCALED_NO_DATA = np.iinfo(SCALED_DTYPE).min
+SCALE_FACTOR_ATTR = 'dtype_policy_scale_factor'
+NO_DATA_ATTR = 'dtype_policy_no_data'
+DTYPE_ATTR = 'dtype_policy_dtype'
+
+
+def narrow_dtype(data_array, dtype=DEFAULT_PROCESSING_DTYPE):
+    """Cast a floating point DataArray to dtype if dtype is narrower than its current dtype
+
+    Integer and boolean arrays are returned as is, so int16 reflectance bands and masks are never upcast.
+    """
+    dtype = np.dtype(dtype)
+    if np.issubdtype(data_array.dtype, np.floating) and data_array.dtype.itemsize > dtype.itemsize:
+        return data_array.astype(dtype)
+    return data_array
+
+
+def encode_scaled(data_array, scale_factor, dtype=DEFAULT_PROCESSING_DTYPE, no_data=-9999):
+    """Encode a floating point DataArray as int16 multiples of scale_factor, clipped to the int16 range
+
+    Args:
+        data_array: floating point xarray DataArray.
+        scale_factor: value of one int16 step, e.g. 0.0001 for indices in [-1, 1].
+        dtype: floating point dtype that the data is decoded to.
+        no_data: no data value - no data and non finite values are encoded as SCALED_NO_DATA.
+
+    Returns:
+        int16 DataArray with the attributes used by decode_scaled.
+    """
+    values = data_array.values
+    invalid = ~np.isfinite(values) if np.isnan(no_data) else (values == no_data) | ~np.isfinite(values)
+    with np.errstate(invalid='ignore'):
+        scaled = np.clip(np.round(values / scale_factor), SCALED_NO_DATA + 1, np.iinfo(SCALED_DTYPE).max)
+    scaled[invalid] = SCALED_NO_DATA
+    encoded = data_array.copy(data=scaled.astype(SCALED_DTYPE))
+    encoded.attrs.update({SCALE_FACTOR_ATTR: scale_factor, NO_DATA_ATTR: no_data, DTYPE_ATTR: np.dtype(dtype).name})
+    return encoded
+
+
+def decode_scaled(dataset):
+    """Decode all of the variables in a dataset that were encoded with encode_scaled, in place"""
+    for name in list(dataset.data_vars):
+        attrs = dict(dataset[name].attrs)
+        if SCALE_FACTOR_ATTR not in attrs:
+            continue
+        scaled = dataset[name].values
+        values = scaled.astype(attrs.pop(DTYPE_ATTR)) * attrs.pop(SCALE_FACTOR_ATTR)
+        values[scaled == SCALED_NO_DATA] = attrs.pop(NO_DATA_ATTR)
+        dataset[name] = dataset[name].copy(data=values)
+        dataset[name].attrs = attrs
+    return dataset
+
+
+def apply_dtype_policy(dataset, dtype=DEFAULT_PROCESSING_DTYPE, exclude=None, scale_factors=None, no_data=-9999):
+    """Narrow all of the floating point data variables in a dataset to dtype
+
+    Args:
+        dataset: xarray dataset, e.g. a composite or intermediate product.
+        dtype: dtype used for floating point data.
+        exclude: optional list of data variables that require float64, left unchanged.
+        scale_factors: optional dict of data variable names to scale factors - these are encoded as int16.
+        no_data: no data value of the scaled variables.
+
+    Returns:
+        the dataset with its floating point variables cast in place.
+    """
+    exclude = exclude or []
+    scale_factors = scale_factors or {}
+    for name in list(dataset.data_vars):
+        if name in exclude:
+            continue
+        if name in scale_factors and np.issubdtype(dataset[name].dtype, np.floating):
+            dataset[name] = encode_scaled(dataset[name], scale_factors[name], dtype=dtype, no_data=no_data)
+        else:
+            dataset[name] = narrow_dtype(dataset[name], dtype=dtype)
+    return dataset
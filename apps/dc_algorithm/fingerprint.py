@@ -0,0 +1,92 @@
+# Copyright 2016 United States Government as represented by the Administrator
+# of the National Aeronautics and Space Administration. All Rights Reserved.
+#
+# Portion of this code is Copyright Geoscience Australia, Licensed under the
+# Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License
+# at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# The CEOS 2 platform is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from django.conf import settings
+
+import math
+from contextlib import contextmanager
+import redis
+from redis.exceptions import LockError
+
+# Bounds within this fraction of a pixel of a pixel center are considered to include it, so float noise from the map
+# doesn't change which pixels a query snaps to.
+GRID_TOLERANCE = 1e-6
+
+# Submissions of queries with the same fingerprint are serialized with a Redis lock. Locks expire in case the process
+# holding one dies, and waiting for a lock gives up so a stuck lock never blocks submissions indefinitely.
+SUBMISSION_LOCK_PREFIX = "dc_algorithm.submission_lock"
+SUBMISSION_LOCK_TIMEOUT = 60
+SUBMISSION_LOCK_WAIT = 30
+
+_product_resolutions = {}
+
+
+def get_product_resolution(api, product):
+    """Get the (latitude, longitude) storage resolution of a product, or None if it isn't stored on a geographic grid
+
+    Resolutions are looked up in the index once per process.
+    """
+    if product not in _product_resolutions:
+        product_type = api.dc.index.products.get_by_name(product)
+        resolution = {} if product_type is None else product_type.definition.get('storage', {}).get('resolution', {})
+        _product_resolutions[product] = (resolution['latitude'], resolution['longitude']) \
+            if 'latitude' in resolution and 'longitude' in resolution else None
+    return _product_resolutions[product]
+
+
+def snap_to_grid(value_range, resolution):
+    """Snap a (min, max) range to the indices of the first and last pixel centers it contains
+
+    Pixels are assumed to have edges on multiples of the resolution, as with ingested products. Any two ranges
+    that snap to the same indices load the same pixels.
+
+    Returns:
+        tuple of the first and last pixel index along the axis.
+    """
+    resolution = abs(resolution)
+    low, high = min(value_range) / resolution - 0.5, max(value_range) / resolution - 0.5
+    return int(math.ceil(low - GRID_TOLERANCE)), int(math.floor(high + GRID_TOLERANCE))
+
+
+@contextmanager
+def submission_lock(name):
+    """Hold a short-lived distributed lock while looking up or creating a query
+
+    Used so concurrent submissions of the same query join a single task rather than racing to create and launch
+    duplicates. Yields whether the lock was acquired - if it couldn't be within SUBMISSION_LOCK_WAIT seconds,
+    the caller proceeds without it.
+
+    Args:
+        name: unique name for the query, e.g. the model label and fingerprint.
+    """
+    lock = redis.StrictRedis.from_url(settings.BROKER_URL).lock(
+        "{}:{}".format(SUBMISSION_LOCK_PREFIX, name),
+        timeout=SUBMISSION_LOCK_TIMEOUT,
+        blocking_timeout=SUBMISSION_LOCK_WAIT)
+    acquired = lock.acquire()
+    try:
+        yield acquired
+    finally:
+        if acquired:
+            try:
+                lock.release()
+            except LockError:  # the lock expired and may be held by another submission.
+                pass
@@ -24,13 +24,14 @@ from django import forms
 import datetime
 
 from apps.dc_algorithm.models import Area, Compositor
+from apps.dc_algorithm.band_math import compile_expression
 
 
 class AdditionalOptionsForm(forms.Form):
     """
     Django form to be created for selecting information and validating input for:
-        result_type
-        band_selection
+        compositor
+        band_math_expression
         title
         description
     Init function to initialize dynamic forms.
@@ -44,7 +45,22 @@ class AdditionalOptionsForm(forms.Form):
         label="Compositing Method:",
         widget=forms.Select(attrs={'class': 'field-long tooltipped'}))
 
+    band_math_expression = forms.CharField(
+        max_length=250,
+        initial='(nir - red) / (nir + red)',
+        help_text='Enter an expression over band names using + - * / **, parentheses, abs, sqrt, log, and exp.',
+        label="Band Math Expression:",
+        widget=forms.TextInput(attrs={'class': 'field-long tooltipped'}))
+
     def __init__(self, *args, **kwargs):
         datacube_platform = kwargs.pop('datacube_platform', None)
         super(AdditionalOptionsForm, self).__init__(*args, **kwargs)
         self.fields["compositor"].queryset = Compositor.objects.all()
+
+    def clean_band_math_expression(self):
+        expression = self.cleaned_data['band_math_expression'].strip()
+        try:
+            compile_expression(expression)
+        except ValueError as error:
+            raise forms.ValidationError(str(error))
+        return expression
@@ -29,11 +29,21 @@ from apps.dc_algorithm.models import (Query as BaseQuery, Metadata as BaseMetada
                                       BaseAnimationType, ToolInfo as BaseToolInfo)
 from utils.data_cube_utilities.dc_mosaic import (create_mosaic, create_median_mosaic, create_max_ndvi_mosaic,
                                                  create_min_ndvi_mosaic)
+from apps.dc_algorithm.band_math import compile_expression
+from apps.dc_algorithm.masking import count_clear
 
 import datetime
 import numpy as np
 
 
+def validate_band_math_expression(expression):
+    """Validate that an expression compiles, raising a ValidationError with the reason otherwise"""
+    try:
+        compile_expression(expression)
+    except ValueError as error:
+        raise ValidationError(str(error))
+
+
 class UserHistory(BaseUserHistory):
     """
     Extends the base user history adding additional fields
@@ -61,13 +71,20 @@ class Query(BaseQuery):
     """
     compositor = models.ForeignKey(Compositor)
 
+    band_math_expression = models.CharField(
+        max_length=250,
+        default='(nir - red) / (nir + red)',
+        validators=[validate_band_math_expression],
+        help_text="Band math expression, e.g. 2.5 * (nir - red) / (nir + 6 * red - 7.5 * blue + 1)")
+
     #TODO: add color scale here
     color_scale_path = '/home/' + settings.LOCAL_USER + '/Datacube/data_cube_ui/utils/color_scales/default_color_scale'
     base_result_dir = '/datacube/ui_results/band_math_app'
 
     class Meta(BaseQuery.Meta):
         unique_together = (('satellite', 'area_id', 'time_start', 'time_end', 'latitude_max', 'latitude_min',
-                            'longitude_max', 'longitude_min', 'title', 'description', 'compositor'))
+                            'longitude_max', 'longitude_min', 'title', 'description', 'compositor',
+                            'band_math_expression'))
         abstract = True
 
     def get_fields_with_labels(self, labels, field_names):
@@ -116,6 +133,19 @@ class Query(BaseQuery):
 
         return processing_methods.get(self.compositor.id, create_mosaic)
 
+    def get_required_measurements(self):
+        """implements get_required_measurements as required by the base class
+
+        See the base query class docstring for more information.
+
+        """
+        return self.get_band_math_expression().measurements + self.compositor.get_required_measurements(
+        ) + self.get_png_measurements()
+
+    def get_band_math_expression(self):
+        """Get the compiled band math expression for the query"""
+        return compile_expression(self.band_math_expression)
+
     @classmethod
     def get_or_create_query_from_post(cls, form_data, pixel_drill=False):
         """Implements the get_or_create_query_from_post func required by base class
@@ -139,13 +169,7 @@ class Query(BaseQuery):
         valid_query_fields = [field.name for field in cls._meta.get_fields()]
         query_data = {key: query_data[key] for key in valid_query_fields if key in query_data}
 
-        try:
-            query = cls.objects.get(pixel_drill_task=pixel_drill, **query_data)
-            return query, False
-        except cls.DoesNotExist:
-            query = cls(pixel_drill_task=pixel_drill, **query_data)
-            query.save()
-            return query, True
+        return cls.get_or_create_query(query_data, pixel_drill=pixel_drill)
 
 
 class Metadata(BaseMetadata):
@@ -171,7 +195,7 @@ class Metadata(BaseMetadata):
 
         """
         for metadata_index, time in enumerate(dataset.time.values.astype('M8[ms]').tolist()):
-            clean_pixels = np.sum(clear_mask[metadata_index, :, :] == True)
+            clean_pixels = count_clear(clear_mask, metadata_index)
             if time not in metadata:
                 metadata[time] = {}
                 metadata[time]['clean_pixels'] = 0
@@ -13,16 +13,17 @@ from collections import OrderedDict
 
 from utils.data_cube_utilities.data_access_api import DataAccessApi
 from utils.data_cube_utilities.dc_utilities import (create_cfmask_clean_mask, create_bit_mask, write_geotiff_from_xr,
-                                                    write_png_from_xr, write_single_band_png_from_xr,
-                                                    add_timestamp_data_to_xr, clear_attrs)
+                                                    write_png_from_xr, add_timestamp_data_to_xr, clear_attrs)
 from utils.data_cube_utilities.dc_chunker import (create_geographic_chunks, create_time_chunks,
                                                   combine_geographic_chunks)
 from apps.dc_algorithm.utils import create_2d_plot
+from apps.dc_algorithm.colorize import write_single_band_png
 from utils.data_cube_utilities.import_export import export_xarray_to_netcdf
 
 from .models import BandMathTask
 from apps.dc_algorithm.models import Satellite
 from apps.dc_algorithm.tasks import DCAlgorithmBase
+from apps.dc_algorithm.pipelines import record_pipeline
 
 logger = get_task_logger(__name__)
 
@@ -43,18 +44,16 @@ def pixel_drill(task_id=None):
     dc = DataAccessApi(config=task.config_path)
     single_pixel = dc.get_dataset_by_extent(**parameters).isel(latitude=0, longitude=0)
     clear_mask = task.satellite.get_clean_mask_func()(single_pixel)
-    single_pixel = single_pixel.where(single_pixel != task.satellite.no_data_value)
 
     dates = single_pixel.time.values
     if len(dates) < 2:
         task.update_status("ERROR", "There is only a single acquisition for your parameter set.")
         return None
 
-    def _apply_band_math(dataset):
-        #TODO: apply your band math here!
-        return (dataset.nir - dataset.red) / (dataset.nir + dataset.red)
-
-    datasets = [_apply_band_math(single_pixel).values.transpose()] + [clear_mask]
+    # the expression is evaluated before no data is replaced so it is no data wherever any of its bands are.
+    band_math = task.get_band_math_expression().evaluate(single_pixel, no_data=task.satellite.no_data_value)
+    band_math = band_math.where(band_math != task.satellite.no_data_value)
+    datasets = [band_math.values.transpose()] + [clear_mask]
     data_labels = ["Band Math Result"] + ["Clear"]
     titles = ["Band Math"] + ["Clear Mask"]
     style = ['ro', '.']
@@ -102,7 +101,7 @@ def parse_parameters_from_task(task_id=None):
         'time': (task.time_start, task.time_end),
         'longitude': (task.longitude_min, task.longitude_max),
         'latitude': (task.latitude_min, task.latitude_max),
-        'measurements': task.satellite.get_measurements()
+        'measurements': task.get_measurements()
     }
 
     task.execution_start = datetime.now()
@@ -229,11 +228,12 @@ def start_chunk_processing(chunk_details, task_id=None):
                 geographic_chunk=geographic_chunk,
                 time_chunk=time_chunk,
                 **parameters) for time_index, time_chunk in enumerate(time_chunks)
-        ]) | recombine_time_chunks.s(task_id=task_id) | process_band_math.s(task_id=task_id)
+        ]) | recombine_time_chunks.s(task_id=task_id)
         for geo_index, geographic_chunk in enumerate(geographic_chunks)
     ]) | recombine_geographic_chunks.s(task_id=task_id)
 
     processing_pipeline = (processing_pipeline | create_output_products.s(task_id=task_id)).apply_async()
+    record_pipeline(task_id, processing_pipeline)
     return True
 
 
@@ -320,7 +320,7 @@ def recombine_time_chunks(chunks, task_id=None):
 
     Open time chunked processed datasets and recombine them using the same function
     that was used to process them. This assumes an iterative algorithm - if it is not, then it will
-    simply return the data again.
+    simply return the data again. Band math is applied to the recombined data before it is written.
 
     Args:
         chunks: list of the return from the processing_task function - path, metadata, and {chunk ids}
@@ -358,35 +358,18 @@ def recombine_time_chunks(chunks, task_id=None):
                                                      no_data=task.satellite.no_data_value,
                                                      reverse_time=task.get_reverse_time())
 
+    # band math is applied in memory so each chunk is only written once.
+    combined_data = _apply_band_math(task, combined_data)
     path = os.path.join(task.get_temp_path(), "recombined_time_{}.nc".format(geo_chunk_id))
     export_xarray_to_netcdf(combined_data, path)
     logger.info("Done combining time chunks for geo: " + str(geo_chunk_id))
     return path, metadata, {'geo_chunk_id': geo_chunk_id, 'time_chunk_id': time_chunk_id}
 
 
-@task(name="band_math_app.process_band_math", base=BaseTask)
-def process_band_math(chunk, task_id=None):
-    """Apply some band math to a chunk and return the args
-
-    Opens the chunk dataset and applys some band math defined by _apply_band_math(dataset)
-    _apply_band_math creates some product using the bands already present in the dataset and
-    returns the dataarray. The data array is then appended under 'band_math', then saves the
-    result to disk in the same path as the nc file already exists.
-    """
-
-    def _apply_band_math(dataset):
-        #TODO: apply your band math here!
-        return (dataset.nir - dataset.red) / (dataset.nir + dataset.red)
-
-    if chunk is None:
-        return None
-
-    dataset = xr.open_dataset(chunk[0]).load()
-    dataset['band_math'] = _apply_band_math(dataset)
-    #remove previous nc and write band math to disk
-    os.remove(chunk[0])
-    export_xarray_to_netcdf(dataset, chunk[0])
-    return chunk
+def _apply_band_math(task, dataset):
+    """Add the task's band math expression to a recombined chunk under 'band_math'"""
+    dataset['band_math'] = task.get_band_math_expression().evaluate(dataset, no_data=task.satellite.no_data_value)
+    return dataset
 
 
 @task(name="band_math_app.recombine_geographic_chunks", base=BaseTask)
@@ -451,7 +434,7 @@ def create_output_products(data, task_id=None):
     task.final_metadata_from_dataset(dataset)
     task.metadata_from_dict(full_metadata)
 
-    bands = task.satellite.get_measurements() + ['band_math']
+    bands = task.get_measurements() + ['band_math']
 
     export_xarray_to_netcdf(dataset, task.data_netcdf_path)
     write_geotiff_from_xr(task.data_path, dataset.astype('int32'), bands=bands, no_data=task.satellite.no_data_value)
@@ -461,7 +444,7 @@ def create_output_products(data, task_id=None):
         bands=['red', 'green', 'blue'],
         scale=task.satellite.get_scale(),
         no_data=task.satellite.no_data_value)
-    write_single_band_png_from_xr(
+    write_single_band_png(
         task.result_path,
         dataset,
         band='band_math',
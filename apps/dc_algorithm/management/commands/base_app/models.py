@@ -26,6 +26,7 @@ from apps.dc_algorithm.models import Area, Compositor, Satellite
 from apps.dc_algorithm.models import (Query as BaseQuery, Metadata as BaseMetadata, Result as BaseResult, ResultType as
                                       BaseResultType, UserHistory as BaseUserHistory, AnimationType as
                                       BaseAnimationType, ToolInfo as BaseToolInfo)
+from apps.dc_algorithm.masking import count_clear
 
 # TODO: Fill in any required algorithm imports here. Remove mosaic if unused
 from utils.data_cube_utilities.dc_mosaic import (create_mosaic, create_median_mosaic, create_max_ndvi_mosaic,
@@ -153,6 +154,16 @@ class Query(BaseQuery):
 
         return processing_methods.get(self.compositor.id, create_mosaic)
 
+    # TODO: List the measurements used by the processing method and outputs - masking bands are added automatically.
+    # Returning None loads all of the satellite's measurements.
+    def get_required_measurements(self):
+        """implements get_required_measurements as required by the base class
+
+        See the base query class docstring for more information.
+
+        """
+        return self.compositor.get_required_measurements() + self.get_png_measurements()
+
     @classmethod
     def get_or_create_query_from_post(cls, form_data, pixel_drill=False):
         """Implements the get_or_create_query_from_post func required by base class
@@ -176,13 +187,7 @@ class Query(BaseQuery):
         valid_query_fields = [field.name for field in cls._meta.get_fields()]
         query_data = {key: query_data[key] for key in valid_query_fields if key in query_data}
 
-        try:
-            query = cls.objects.get(pixel_drill_task=pixel_drill, **query_data)
-            return query, False
-        except cls.DoesNotExist:
-            query = cls(pixel_drill_task=pixel_drill, **query_data)
-            query.save()
-            return query, True
+        return cls.get_or_create_query(query_data, pixel_drill=pixel_drill)
 
 
 class Metadata(BaseMetadata):
@@ -213,7 +218,7 @@ class Metadata(BaseMetadata):
 
         """
         for metadata_index, time in enumerate(dataset.time.values.astype('M8[ms]').tolist()):
-            clean_pixels = np.sum(clear_mask[metadata_index, :, :] == True)
+            clean_pixels = count_clear(clear_mask, metadata_index)
             if time not in metadata:
                 metadata[time] = {}
                 metadata[time]['clean_pixels'] = 0
@@ -22,6 +22,7 @@ from utils.data_cube_utilities.import_export import export_xarray_to_netcdf
 from .models import AppNameTask
 from apps.dc_algorithm.models import Satellite
 from apps.dc_algorithm.tasks import DCAlgorithmBase
+from apps.dc_algorithm.pipelines import record_pipeline
 
 logger = get_task_logger(__name__)
 
@@ -112,7 +113,7 @@ def parse_parameters_from_task(task_id=None):
         'time': (task.time_start, task.time_end),
         'longitude': (task.longitude_min, task.longitude_max),
         'latitude': (task.latitude_min, task.latitude_max),
-        'measurements': task.satellite.get_measurements()
+        'measurements': task.get_measurements()
     }
 
     task.execution_start = datetime.now()
@@ -247,6 +248,7 @@ def start_chunk_processing(chunk_details, task_id=None):
     ]) | recombine_time_chunks.s(task_id=task_id)
 
     processing_pipeline = (processing_pipeline | create_output_products.s(task_id=task_id)).apply_async()
+    record_pipeline(task_id, processing_pipeline)
     return True
 
 
@@ -507,7 +509,7 @@ def create_output_products(data, task_id=None):
     task.metadata_from_dict(full_metadata)
 
     # TODO: Set the bands that should be written to the final products
-    bands = task.satellite.get_measurements() + []
+    bands = task.get_measurements() + []
 
     # TODO: If you're creating pngs, specify the RGB bands
     png_bands = [task.query_type.red, task.query_type.green, task.query_type.blue]
@@ -0,0 +1,153 @@
+# Copyright 2016 United States Government as represented by the Administrator
+# of the National Aeronautics and Space Administration. All Rights Reserved.
+#
+# Portion of this code is Copyright Geoscience Australia, Licensed under the
+# Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License
+# at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# The CEOS 2 platform is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+
+# QA bands are decoded with a lookup table over the full uint16 domain - values outside of it (e.g. no_data) are unclear.
+LOOKUP_TABLE_SIZE = 2**16
+
+
+def _create_bit_lookup_table(valid_bits):
+    """Values are clear if any of the valid bits are set - equivalent to create_bit_mask"""
+    return (np.arange(LOOKUP_TABLE_SIZE) & sum(1 << bit for bit in valid_bits)) > 0
+
+
+def _create_value_lookup_table(valid_values):
+    """Values are clear if they are one of the valid values - equivalent to create_cfmask_clean_mask"""
+    lookup_table = np.zeros(LOOKUP_TABLE_SIZE, dtype=bool)
+    lookup_table[valid_values] = True
+    return lookup_table
+
+
+# pixel_qa: clear (bit 1) or water (bit 2). cf_mask: clear (0) or water (1).
+LOOKUP_TABLES = {'pixel_qa': _create_bit_lookup_table([1, 2]), 'cf_mask': _create_value_lookup_table([0, 1])}
+
+# number of set bits for each possible byte, used to count clear pixels without unpacking.
+POPCOUNT_TABLE = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+class PackedMask:
+    """A boolean mask stored bit-packed along its last axis
+
+    Packed masks are 8x smaller than a numpy boolean array. They are unpacked one time slice at a time by the
+    compositors and metadata functions - see get_mask_slice and count_clear. They are deliberately not sequences,
+    so anything else, e.g. the data cube utilities, needs a boolean array from unpack or np.asarray.
+    """
+
+    def __init__(self, packed, shape):
+        self.packed = packed
+        self.shape = tuple(shape)
+
+    @classmethod
+    def from_array(cls, mask):
+        mask = np.asarray(mask, dtype=bool)
+        return cls(np.packbits(mask, axis=-1), mask.shape)
+
+    @property
+    def nbytes(self):
+        return self.packed.nbytes
+
+    def unpack(self, index=None):
+        """Unpack the full mask or a single index along the first axis to a boolean array"""
+        packed = self.packed if index is None else self.packed[index]
+        return np.unpackbits(packed, axis=-1)[..., :self.shape[-1]].view(bool)
+
+    def count(self, index=None):
+        """Count the number of True values in the full mask or a single index along the first axis"""
+        packed = self.packed if index is None else self.packed[index]
+        return int(POPCOUNT_TABLE[packed].sum(dtype=np.int64))
+
+    def __array__(self, dtype=None, copy=None):
+        return self.unpack() if dtype is None else self.unpack().astype(dtype)
+
+
+def _decode(values, lookup_table):
+    """Decode a QA array to a packed mask one time slice at a time to avoid a full size boolean temporary"""
+    values = np.asarray(values)
+    if values.ndim < 2:
+        return np.packbits(_decode_slice(values, lookup_table), axis=-1)
+    packed = np.empty(values.shape[:-1] + ((values.shape[-1] + 7) // 8, ), dtype=np.uint8)
+    for index in range(values.shape[0]):
+        packed[index] = np.packbits(_decode_slice(values[index], lookup_table), axis=-1)
+    return packed
+
+
+def _decode_slice(values, lookup_table):
+    if values.dtype == np.uint16 or values.dtype == np.uint8:
+        return lookup_table[values]
+    valid = (values >= 0) & (values < lookup_table.size)
+    if not np.issubdtype(values.dtype, np.integer):
+        valid &= np.isfinite(values)
+    return lookup_table[np.where(valid, values, 0).astype(np.int64)] & valid
+
+
+# decoded masks are cached per loaded QA array - the array is weakly referenced so entries are dropped
+# along with the data they were decoded from. Data is not expected to be modified in place once loaded.
+_mask_cache = OrderedDict()
+MASK_CACHE_SIZE = 8
+
+
+def get_mask_slice(mask, index):
+    """Get a single time slice of a boolean or packed mask as a boolean array"""
+    if isinstance(mask, PackedMask):
+        return mask.unpack(index)
+    return np.asarray(mask[index], dtype=bool)
+
+
+def count_clear(mask, index=None):
+    """Count the clear pixels of a boolean or packed mask, or of a single time slice of it"""
+    if isinstance(mask, PackedMask):
+        return mask.count(index)
+    return int(np.count_nonzero(mask if index is None else mask[index]))
+
+
+def get_clean_mask(dataset, band, packed=False):
+    """Get a clean mask for a dataset from a QA band
+
+    Decoded masks are cached bit-packed, so repeated calls on the same loaded data don't decode the QA band again.
+
+    Args:
+        dataset: xarray dataset containing the QA band.
+        band: name of the QA band - pixel_qa or cf_mask.
+        packed: return the cached PackedMask rather than unpacking it. Packed masks are shared, so they must not be
+            modified - they are meant for functions that take masks one time slice at a time.
+
+    Returns:
+        boolean np array with the same shape as the QA band, or a PackedMask if packed is set. Each call returns a new
+        boolean array, so unpacked masks can be modified.
+    """
+    values = dataset[band].values
+    for key in [key for key, (reference, _) in _mask_cache.items() if reference() is None]:
+        del _mask_cache[key]
+
+    cached = _mask_cache.get(id(values))
+    if cached is None or cached[0]() is not values:
+        cached = (weakref.ref(values), PackedMask(_decode(values, LOOKUP_TABLES[band]), values.shape))
+        _mask_cache[id(values)] = cached
+        if len(_mask_cache) > MASK_CACHE_SIZE:
+            _mask_cache.popitem(last=False)
+    else:
+        _mask_cache.move_to_end(id(values))
+
+    return cached[1] if packed else cached[1].unpack()
@@ -19,7 +19,7 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
-from django.db import models
+from django.db import models, transaction, IntegrityError
 from django.core.exceptions import ValidationError
 from django.conf import settings
 
@@ -27,6 +27,12 @@ import datetime
 import uuid
 import os
 
+from apps.dc_algorithm.dtypes import DEFAULT_PROCESSING_DTYPE, apply_dtype_policy
+from apps.dc_algorithm.product_cache import get_cache_key
+from apps.dc_algorithm.fingerprint import get_product_resolution, snap_to_grid, submission_lock
+from apps.dc_algorithm.acquisition_catalog import list_acquisition_dates
+from utils.data_cube_utilities.data_access_api import DataAccessApi
+
 
 class Query(models.Model):
     """Base Query model meant to be inherited by a TaskClass
@@ -79,8 +85,24 @@ class Query(models.Model):
     #false by default, only change is false-> true
     complete = models.BooleanField(default=False)
 
+    # hash of everything that determines the query's results - see get_fingerprint.
+    fingerprint = models.CharField(max_length=40, default="", db_index=True)
+
     config_path = '/home/' + settings.LOCAL_USER + '/Datacube/data_cube_ui/config/.datacube.conf'
 
+    # dtype policy - floating point data is processed, stored between tasks, and exported as processing_dtype.
+    # Variables listed in float64_variables are kept as float64 where the precision is required, and variables in
+    # scaled_variables are stored between tasks as int16 multiples of their scale factor.
+    processing_dtype = DEFAULT_PROCESSING_DTYPE
+    float64_variables = []
+    scaled_variables = {}
+
+    # fields that don't change a query's results, excluded from its fingerprint.
+    cosmetic_fields = ['title', 'description']
+    # whether time_start and time_end only bound the data that is loaded, so the fingerprint can use the acquisitions
+    # in range instead. Apps that derive other time ranges from them, e.g. a baseline before time_start, set this False.
+    fingerprint_acquisitions = True
+
     class Meta:
         abstract = True
         unique_together = (('satellite', 'area_id', 'time_start', 'time_end', 'latitude_max', 'latitude_min',
@@ -92,6 +114,39 @@ class Query(models.Model):
     def get_unique_fields_as_list(self):
         return [getattr(self, field) for field in self._meta.unique_together[0]]
 
+    def get_fingerprint(self):
+        """Get a hash of everything that determines the results of this query
+
+        Queries with the same fingerprint produce the same products, so a submission can be attached to an
+        existing task rather than being processed again. Cosmetic fields are excluded, the bounds are snapped
+        to the product's pixel grid, and the time range is replaced by the acquisitions within it.
+
+        Returns:
+            hex digest string - the same length as the fingerprint field.
+        """
+        fields = [field for field in self._meta.unique_together[0] if field not in self.cosmetic_fields]
+        key = {field: getattr(self, self._meta.get_field(field).attname) for field in fields}
+        key['pixel_drill_task'] = self.pixel_drill_task
+
+        latitude, longitude = (self.latitude_min, self.latitude_max), (self.longitude_min, self.longitude_max)
+        products = self.satellite.get_products(self.area_id)
+        dc = DataAccessApi(config=self.config_path)
+        try:
+            resolution = get_product_resolution(dc, products[0])
+            if resolution is not None:
+                for field in ['latitude_min', 'latitude_max', 'longitude_min', 'longitude_max']:
+                    del key[field]
+                key['latitude'] = snap_to_grid(latitude, resolution[0])
+                key['longitude'] = snap_to_grid(longitude, resolution[1])
+            if self.fingerprint_acquisitions:
+                del key['time_start'], key['time_end']
+                key['acquisitions'] = list_acquisition_dates(
+                    dc, products=products, time=(self.time_start, self.time_end), latitude=latitude,
+                    longitude=longitude)
+        finally:
+            dc.close()
+        return get_cache_key(**key)
+
     def update_status(self, status, message):
         self.status = status
         self.message = message
@@ -108,6 +163,21 @@ class Query(models.Model):
             pass
         return temp_dir
 
+    def get_cache_path(self, cache_name, **key):
+        """Get a path for a product that can be reused across tasks, e.g. a baseline composite
+
+        The path is base_result_dir/cache/cache_name/ followed by a hash of the key, so the key
+        must contain everything the product depends on. Used with load_cached_product and store_cached_product.
+        """
+        if not self.base_result_dir:
+            raise NotImplementedError("You must define 'base_result_dir' in the inheriting class.")
+        cache_dir = os.path.join(self.base_result_dir, 'cache', cache_name)
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            pass
+        return os.path.join(cache_dir, get_cache_key(**key))
+
     def get_result_path(self):
         """Get the result directory for the task from base_result_dir and the pk"""
         if not self.base_result_dir:
@@ -184,6 +254,37 @@ class Query(models.Model):
         """
         raise NotImplementedError("You must define 'get_processing_method' in the inheriting class.")
 
+    def get_required_measurements(self):
+        """Defines the measurements used by the processing method and output products
+
+        Masking bands should not be included - they are added in get_measurements.
+        Only include bands used for png creation if a png is created, e.g. see get_png_measurements.
+
+        Returns:
+            list of measurement names, or None if all of the satellite's measurements are required.
+        """
+        #return ['red', 'nir'] + self.get_png_measurements()
+        raise NotImplementedError("You must define 'get_required_measurements' in the inheriting class.")
+
+    def get_png_measurements(self):
+        """Get the measurements required for true color png outputs - pixel drills only create plots"""
+        return [] if self.pixel_drill_task else ['red', 'green', 'blue']
+
+    def get_measurements(self):
+        """Get the measurements that should be loaded for this query
+
+        Combines the measurements required by the app with the satellite's masking bands.
+        """
+        return self.satellite.get_measurements(required=self.get_required_measurements())
+
+    def apply_dtype_policy(self, dataset):
+        """Narrow a dataset's floating point variables to the processing dtype before it is stored
+
+        Scaled variables are encoded as int16 - open_chunk decodes them when the chunk is opened.
+        """
+        return apply_dtype_policy(dataset, dtype=self.processing_dtype, exclude=self.float64_variables,
+                                  scale_factors=self.scaled_variables, no_data=self.satellite.no_data_value)
+
     @classmethod
     def get_queryset_from_history(cls, user_history, **kwargs):
         """Get a QuerySet of Query objects using the a user history queryset
@@ -231,19 +332,64 @@ class Query(models.Model):
 
             valid_query_fields = [field.name for field in cls._meta.get_fields()]
             query_data = {key: query_data[key] for key in valid_query_fields if key in query_data}
-            query = cls(pixel_drill_task=pixel_drill, **query_data)
 
-            try:
-                query = cls.objects.get(pixel_drill_task=pixel_drill, **query_data)
-                return query, False
-            except cls.DoesNotExist:
-                query = cls(pixel_drill_task=pixel_drill, **query_data)
-                query.save()
-                return query, True
+            return cls.get_or_create_query(query_data, pixel_drill=pixel_drill)
         """
         raise NotImplementedError(
             "You must define the classmethod 'get_or_create_query_from_post' in the inheriting class.")
 
+    @classmethod
+    def get_or_create_query(cls, query_data, pixel_drill=False):
+        """Get a query matching the query data, an equivalent query, or create a new one
+
+        Used by get_or_create_query_from_post once the query data has been formatted. Queries that match exactly
+        are returned as before, without computing a fingerprint. Otherwise, a query with the same fingerprint that
+        hasn't failed or been cancelled is returned - complete queries first - so the submission is attached to its
+        results through the user's history rather than starting a new pipeline. The fingerprint lookup and creation
+        are done while holding a lock on the fingerprint, so concurrent identical submissions create a single query
+        and only one is reported as new. Pixel drills are cheap to rerun and are never fingerprinted.
+
+        Args:
+            query_data: dict of field values for this model.
+            pixel_drill: whether the query is a pixel drill.
+
+        Returns:
+            Tuple containing the query model and a boolean value signifying if it was created or loaded.
+        """
+        try:
+            return cls.objects.get(pixel_drill_task=pixel_drill, **query_data), False
+        except cls.DoesNotExist:
+            pass
+
+        query = cls(pixel_drill_task=pixel_drill, **query_data)
+        if pixel_drill:
+            return cls._create_query(query, query_data, pixel_drill)
+
+        query.fingerprint = query.get_fingerprint()
+        with submission_lock("{}:{}".format(cls._meta.label_lower, query.fingerprint)):
+            # an identical submission may have been created while the fingerprint was computed.
+            try:
+                return cls.objects.get(pixel_drill_task=pixel_drill, **query_data), False
+            except cls.DoesNotExist:
+                pass
+
+            equivalent_query = cls.objects.filter(fingerprint=query.fingerprint).exclude(
+                status__in=['ERROR', 'CANCELLED']).order_by('-complete', '-execution_start').first()
+            if equivalent_query is not None:
+                return equivalent_query, False
+
+            return cls._create_query(query, query_data, pixel_drill)
+
+    @classmethod
+    def _create_query(cls, query, query_data, pixel_drill):
+        """Save a new query, joining a matching query that was created concurrently instead of failing."""
+        try:
+            with transaction.atomic():
+                query.save()
+        except IntegrityError:
+            return cls.objects.get(pixel_drill_task=pixel_drill, **query_data), False
+        return query, True
+
 
 class Metadata(models.Model):
     """Base Metadata model meant to be inherited by a TaskClass
@@ -294,14 +440,14 @@ class Metadata(models.Model):
         Args:
             metadata: existing metadata dict keyed by time
             dataset: xarray dataset
-            clear_mask: boolean mask
+            clear_mask: boolean or packed mask - count with apps.dc_algorithm.masking.count_clear
 
         Returns:
             metadata dict keyed by datetime
         """
         """
         for metadata_index, time in enumerate(dataset.time.values.astype('M8[ms]').tolist()):
-            clean_pixels = np.sum(clear_mask[metadata_index, :, :] == True)
+            clean_pixels = count_clear(clear_mask, metadata_index)
             if time not in metadata:
                 metadata[time] = {}
                 metadata[time]['clean_pixels'] = 0
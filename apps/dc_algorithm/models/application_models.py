@@ -26,7 +26,7 @@ import datetime
 import uuid
 import numpy as np
 
-from utils.data_cube_utilities.dc_utilities import (create_cfmask_clean_mask, create_bit_mask)
+from apps.dc_algorithm.masking import get_clean_mask, PackedMask
 
 
 class Satellite(models.Model):
@@ -91,24 +91,27 @@ class Satellite(models.Model):
     def get_scale(self):
         return (self.data_min, self.data_max)
 
-    def get_measurements(self):
-        return self.measurements.split(",")
-
-    def get_clean_mask_func(self):
+    def get_clean_mask_func(self, packed=False):
         """Get the func required to generate a clear mask for a dataset. Defaults to returning all True
 
         The returned func will be specific to the measurements or product/platform and will take a single xr dataset
-        argument, returning a boolean np array of the same shape as ds.
+        argument, returning a boolean mask of the same shape as ds. Decoded QA bands are cached bit-packed - see
+        apps.dc_algorithm.masking.
+
+        Args:
+            packed: return a read only PackedMask rather than a boolean array. Only pass packed masks to functions
+                that take them one time slice at a time - the dc_algorithm compositors, baselines, and metadata.
         
         """
 
         def return_all_true(ds):
-            return np.full(ds[self.get_measurements()[0]].shape(), True)
+            clear_mask = np.full(ds[list(ds.data_vars)[0]].shape, True)
+            return PackedMask.from_array(clear_mask) if packed else clear_mask
 
         options = {
-            'bit_mask': lambda ds: create_bit_mask(ds.pixel_qa, [1, 2]),
-            'cf_mask': lambda ds: create_cfmask_clean_mask(ds.cf_mask),
-            'default': lambda ds: return_all_true
+            'bit_mask': lambda ds: get_clean_mask(ds, 'pixel_qa', packed=packed),
+            'cf_mask': lambda ds: get_clean_mask(ds, 'cf_mask', packed=packed),
+            'default': return_all_true
         }
         key = 'bit_mask' if 'pixel_qa' in self.get_measurements() else 'cf_mask' if 'cf_mask' in self.get_measurements(
         ) else 'default'
@@ -127,8 +130,25 @@ class Satellite(models.Model):
     def get_products(self, area_id):
         return [prefix + area_id for prefix in self.product_prefix.split(",")]
 
-    def get_measurements(self):
-        return self.measurements.split(",")
+    def get_measurements(self, required=None):
+        """Get the list of measurements to load for this satellite
+
+        Args:
+            required: optional list of measurements - if provided, only these and the
+                masking bands are returned. Measurements the satellite doesn't have are dropped.
+
+        Returns:
+            list of measurement names in the order listed on the model.
+        """
+        measurements = self.measurements.split(",")
+        if required is None:
+            return measurements
+        required = set(required) | set(self.get_mask_measurements())
+        return [measurement for measurement in measurements if measurement in required]
+
+    def get_mask_measurements(self):
+        """Get the measurements required by the clean mask func"""
+        return [measurement for measurement in ['pixel_qa', 'cf_mask'] if measurement in self.get_measurements()]
 
 
 class Area(models.Model):
@@ -241,3 +261,11 @@ class Compositor(models.Model):
 
     def is_iterative(self):
         return self.id not in ["median_pixel", "geo_median", "medoid"]
+
+    def supports_time_chunking(self):
+        """Median pixel mosaics are built from mergeable sketches - other non iterative compositors require all data"""
+        return self.id not in ["geo_median", "medoid"]
+
+    def get_required_measurements(self):
+        """Get the measurements required to select pixels - all loaded bands are composited regardless"""
+        return ['red', 'nir'] if self.id in ["max_ndvi", "min_ndvi"] else []
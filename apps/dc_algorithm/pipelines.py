@@ -0,0 +1,99 @@
+# Copyright 2016 United States Government as represented by the Administrator
+# of the National Aeronautics and Space Administration. All Rights Reserved.
+#
+# Portion of this code is Copyright Geoscience Australia, Licensed under the
+# Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License
+# at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# The CEOS 2 platform is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+from django.conf import settings
+
+import redis
+from celery import current_app
+from celery.result import AsyncResult, GroupResult
+
+# The ids of every Celery task dispatched for a query task are kept in a Redis list so that the pipeline can be
+# revoked in bulk when the task is cancelled. Entries expire well after any task could still be running.
+PIPELINE_KEY_PREFIX = "dc_algorithm.pipeline"
+PIPELINE_EXPIRATION = 7 * 24 * 60 * 60
+
+
+def _get_connection():
+    return redis.StrictRedis.from_url(settings.BROKER_URL)
+
+
+def _get_pipeline_key(task_id):
+    return "{}:{}".format(PIPELINE_KEY_PREFIX, task_id)
+
+
+def get_result_ids(result):
+    """Get the ids of all tasks in a dispatched canvas, following chain parents and group members"""
+    ids = []
+    pending = [result]
+    while len(pending) > 0:
+        result = pending.pop()
+        if result is None or result.id in ids:
+            continue
+        ids.append(result.id)
+        if isinstance(result, GroupResult):
+            pending.extend(result.results)
+        pending.append(result.parent)
+    return ids
+
+
+def record_pipeline(task_id, result):
+    """Record the Celery task ids of a dispatched pipeline for a query task
+
+    Args:
+        task_id: id of the query task model.
+        result: AsyncResult or GroupResult returned by apply_async.
+    """
+    connection = _get_connection()
+    key = _get_pipeline_key(task_id)
+    pipeline = connection.pipeline()
+    pipeline.rpush(key, *get_result_ids(result))
+    pipeline.expire(key, PIPELINE_EXPIRATION)
+    pipeline.execute()
+
+
+def get_pipeline_ids(task_id):
+    """Get the Celery task ids recorded for a query task"""
+    return [member.decode('utf-8') for member in _get_connection().lrange(_get_pipeline_key(task_id), 0, -1)]
+
+
+def revoke_pipeline(task_id):
+    """Revoke all recorded tasks for a query task with a single broadcast
+
+    Workers discard revoked messages without running them. Tasks that have already started are not terminated -
+    they stop at their next cancellation check.
+
+    Returns:
+        list of the revoked task ids.
+    """
+    ids = get_pipeline_ids(task_id)
+    if len(ids) > 0:
+        current_app.control.revoke(ids)
+    return ids
+
+
+def pipeline_in_flight(task_id):
+    """Check whether any recorded task for a query task is still running"""
+    return any(AsyncResult(result_id).state == 'STARTED' for result_id in get_pipeline_ids(task_id))
+
+
+def clear_pipeline(task_id):
+    """Remove the recorded task ids for a query task"""
+    _get_connection().delete(_get_pipeline_key(task_id))
@@ -0,0 +1,95 @@
+# Copyright 2016 United States Government as represented by the Administrator
+# of the National Aeronautics and Space Administration. All Rights Reserved.
+#
+# Portion of this code is Copyright Geoscience Australia, Licensed under the
+# Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License
+# at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# The CEOS 2 platform is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import hashlib
+import json
+import os
+import pickle
+import uuid
+from datetime import datetime, timedelta
+
+import xarray as xr
+
+from utils.data_cube_utilities.import_export import export_xarray_to_netcdf
+
+# Cached products are shared by all tasks of an app - entries that haven't been used for this long are removed.
+CACHE_MAX_AGE = timedelta(days=30)
+
+
+def get_cache_key(**key):
+    """Hash a dict of everything a cached product depends on to a stable file name
+
+    Values are serialized with str if they aren't JSON serializable, e.g. dates.
+    """
+    return hashlib.sha1(json.dumps(key, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def get_dataset_ids(datasets):
+    """Get the sorted ids of a list of datasets - including these in a key invalidates entries when data changes"""
+    return sorted(str(dataset.id) for dataset in datasets)
+
+
+def load_cached_product(path):
+    """Load a cached product stored with store_cached_product
+
+    Args:
+        path: cache path, e.g. from Query.get_cache_path
+
+    Returns:
+        tuple of the dataset and metadata, or None if the product isn't cached.
+    """
+    try:
+        with xr.open_dataset(path + ".nc") as dataset:
+            dataset.load()
+        with open(path + ".pickle", 'rb') as metadata_file:
+            metadata = pickle.load(metadata_file)
+    except (OSError, IOError, EOFError, pickle.UnpicklingError):
+        return None
+    # entries are pruned by last use rather than creation.
+    for extension in [".nc", ".pickle"]:
+        os.utime(path + extension, None)
+    return dataset, metadata
+
+
+def store_cached_product(path, dataset, metadata=None):
+    """Store a product and its metadata so that it can be reused by later tasks
+
+    Files are written to a temporary name and moved into place so concurrent tasks never read partial entries.
+    """
+    temp_suffix = ".{}.tmp".format(uuid.uuid4().hex)
+    export_xarray_to_netcdf(dataset, path + ".nc" + temp_suffix)
+    with open(path + ".pickle" + temp_suffix, 'wb') as metadata_file:
+        pickle.dump(metadata, metadata_file)
+    # the metadata is moved first - entries are only loaded once the dataset exists.
+    os.replace(path + ".pickle" + temp_suffix, path + ".pickle")
+    os.replace(path + ".nc" + temp_suffix, path + ".nc")
+
+
+def prune_cache(cache_dir, max_age=CACHE_MAX_AGE):
+    """Remove all cache files under a directory that haven't been used within max_age"""
+    if not os.path.exists(cache_dir):
+        return
+    time_threshold = (datetime.now() - max_age).timestamp()
+    for directory, _, file_names in os.walk(cache_dir):
+        for file_name in file_names:
+            path = os.path.join(directory, file_name)
+            if os.path.getmtime(path) < time_threshold:
+                os.remove(path)
@@ -0,0 +1,65 @@
+# Copyright 2016 United States Government as represented by the Administrator
+# of the National Aeronautics and Space Administration. All Rights Reserved.
+#
+# Portion of this code is Copyright Geoscience Australia, Licensed under the
+# Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License
+# at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# The CEOS 2 platform is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import numpy as np
+import xarray as xr
+
+# Pixels are classified as landslides where NDWI drops by more than this much from the baseline, red reflectance rises
+# by more than this fraction of the baseline, and the terrain is steeper than this many degrees.
+SLIP_NDWI_CHANGE = -0.2
+SLIP_RED_CHANGE = 0.4
+SLIP_SLOPE_DEGREES = 15
+
+
+def compute_slip_from_slope(baseline_data, target_data, slope, no_data=-9999):
+    """Compute the SLIP mask for a baseline and target mosaic from a precomputed slope
+
+    Applies the SLIP criteria - an NDWI decrease, a red reflectance increase, and steep terrain - with the slope taken
+    from the static layer store rather than derived from the DEM of every chunk - see static_layers.get_static_layer.
+
+    Args:
+        baseline_data, target_data: xarray datasets over latitude and longitude with red, nir, and swir1 bands.
+        slope: xarray DataArray of slopes in degrees on the same grid.
+        no_data: no data value - pixels with no data in either mosaic are never classified as landslides.
+
+    Returns:
+        int16 xarray DataArray over latitude and longitude - 1 for landslides, 0 otherwise.
+    """
+    bands = ['red', 'nir', 'swir1']
+    baseline = {band: baseline_data[band].values.astype(np.float64) for band in bands}
+    target = {band: target_data[band].values.astype(np.float64) for band in bands}
+    valid = np.ones(target['red'].shape, dtype=bool)
+    for band in bands:
+        valid &= (baseline[band] != no_data) & (target[band] != no_data)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ndwi_change = (target['nir'] - target['swir1']) / (target['nir'] + target['swir1']) - \
+            (baseline['nir'] - baseline['swir1']) / (baseline['nir'] + baseline['swir1'])
+        red_change = (target['red'] - baseline['red']) / baseline['red']
+        slip = valid & (ndwi_change < SLIP_NDWI_CHANGE) & (red_change > SLIP_RED_CHANGE) & \
+            (np.asarray(slope) > SLIP_SLOPE_DEGREES)
+
+    return xr.DataArray(
+        slip.astype(np.int16),
+        coords={'latitude': target_data.latitude,
+                'longitude': target_data.longitude},
+        dims=['latitude', 'longitude'])
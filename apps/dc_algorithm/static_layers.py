@@ -0,0 +1,176 @@
+# Copyright 2016 United States Government as represented by the Administrator
+# of the National Aeronautics and Space Administration. All Rights Reserved.
+#
+# Portion of this code is Copyright Geoscience Australia, Licensed under the
+# Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License
+# at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# The CEOS 2 platform is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import fcntl
+import math
+import os
+import shutil
+import uuid
+
+import numpy as np
+import xarray as xr
+
+# Static layers, e.g. elevation, are stored in fixed tiles of this many degrees so they can be shared by any query.
+# Chunks are much smaller than tiles, so most chunks are served from a single tile.
+STATIC_TILE_SIZE = 0.5
+
+# Slope is derived when a tile is built and stored alongside its values - see get_static_layer. It is in degrees,
+# computed from the elevation gradient with pixels assumed to be this many meters apart, as SLIP has always done.
+SLOPE_RESOLUTION = 30
+
+# memory mapped tiles that have been opened by this process, by tile directory and kind, with the tile directory's
+# inode and modification time so tiles that are rebuilt or removed are reopened.
+_open_tiles = {}
+
+
+def _get_tile_extent(index):
+    return (index * STATIC_TILE_SIZE, (index + 1) * STATIC_TILE_SIZE)
+
+
+def _get_tile_indices(extent):
+    return range(int(math.floor(min(extent) / STATIC_TILE_SIZE)), int(math.floor(max(extent) / STATIC_TILE_SIZE)) + 1)
+
+
+def compute_slope(values, resolution=SLOPE_RESOLUTION, no_data=-9999):
+    """Compute the slope of an elevation array in degrees - no data is treated as zero elevation"""
+    elevation = values.astype(np.float32)
+    elevation[(elevation == no_data) | ~np.isfinite(elevation)] = 0
+    gradient_y, gradient_x = np.gradient(elevation, resolution)
+    return np.rad2deg(np.arctan(np.sqrt(gradient_x**2 + gradient_y**2)))
+
+
+def _build_tile(api, tile_dir, product, measurement, latitude, longitude):
+    """Load a tile of a static layer and store its values, slope, and coordinates as .npy files
+
+    Files are written to a temporary directory that is moved into place so tiles are never read partially written.
+    Tiles without data aren't stored, so they are loaded again if the static product is later ingested over them.
+    Slopes are computed over the whole tile, so only pixels on the edge of a tile use one sided differences.
+
+    Returns:
+        True if the tile was stored, False if there is no data for the tile.
+    """
+    data = api.dc.load(product=product, measurements=[measurement], latitude=latitude, longitude=longitude)
+    if measurement not in data:
+        return False
+    temp_dir = "{}.{}.tmp".format(tile_dir, uuid.uuid4().hex)
+    os.makedirs(temp_dir)
+    # static layers have a single time slice.
+    values = data[measurement].isel(time=0).values
+    np.save(os.path.join(temp_dir, "values.npy"), values)
+    slope = compute_slope(values, no_data=data[measurement].attrs.get('nodata', -9999))
+    np.save(os.path.join(temp_dir, "slope.npy"), slope)
+    np.save(os.path.join(temp_dir, "latitude.npy"), data.latitude.values)
+    np.save(os.path.join(temp_dir, "longitude.npy"), data.longitude.values)
+    if os.path.exists(tile_dir):
+        shutil.rmtree(tile_dir)
+    os.rename(temp_dir, tile_dir)
+    return True
+
+
+def _open_tile(api, cache_dir, product, measurement, latitude_index, longitude_index, kind='values'):
+    """Open a tile of a static layer, building it first if it doesn't exist on this node
+
+    Returns:
+        memory mapped xarray DataArray, or None if there is no data for the tile.
+    """
+    tile_dir = os.path.join(cache_dir, product, measurement, "{}_{}".format(latitude_index, longitude_index))
+    opened = _open_tiles.get((tile_dir, kind))
+    if opened is not None and opened[0] == _get_tile_signature(tile_dir):
+        return opened[1]
+
+    os.makedirs(os.path.dirname(tile_dir), exist_ok=True)
+    # workers on a node share tiles - the lock ensures each tile is only loaded from the Data Cube once.
+    with open(tile_dir + ".lock", 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        # tiles stored by earlier versions may be empty or lack derived layers, so they are rebuilt as well.
+        if not os.path.exists(os.path.join(tile_dir, kind + ".npy")) and not _build_tile(
+                api, tile_dir, product, measurement, _get_tile_extent(latitude_index),
+                _get_tile_extent(longitude_index)):
+            return None
+        signature = _get_tile_signature(tile_dir)
+
+    tile = xr.DataArray(
+        np.load(os.path.join(tile_dir, kind + ".npy"), mmap_mode='r'),
+        coords=[np.load(os.path.join(tile_dir, "latitude.npy")),
+                np.load(os.path.join(tile_dir, "longitude.npy"))],
+        dims=['latitude', 'longitude'],
+        name=measurement if kind == 'values' else kind)
+    _open_tiles[(tile_dir, kind)] = (signature, tile)
+    return tile
+
+
+def _get_tile_signature(tile_dir):
+    try:
+        stat = os.stat(tile_dir)
+    except OSError:
+        return None
+    return (stat.st_ino, stat.st_mtime_ns)
+
+
+def get_static_layer(api, cache_dir, product, measurement, latitude, longitude, like=None, kind='values'):
+    """Get a static layer, e.g. elevation, over an extent from a tiled store shared by all tasks and workers on a node
+
+    Tiles are loaded from the Data Cube the first time they're used and memory mapped afterwards, so static
+    data is loaded once per area rather than once per chunk per task.
+
+    Args:
+        api: DataAccessApi instance
+        cache_dir: directory to store tiles in.
+        product, measurement: product and measurement of the static layer, e.g. terra_aster_gdm_vietnam and dem
+        latitude, longitude: (min, max) ranges to get.
+        like: optional dataset to match the grid of - the nearest static layer pixel is used for each pixel.
+        kind: 'values' for the static layer itself, or 'slope' for its slope in degrees, e.g. for elevation.
+
+    Returns:
+        xarray DataArray with dims latitude and longitude, or None if there is no data for the extent.
+    """
+    rows = []
+    # Data Cube latitudes are descending, so tiles are concatenated from north to south.
+    for latitude_index in reversed(_get_tile_indices(latitude)):
+        row = []
+        for longitude_index in _get_tile_indices(longitude):
+            tile = _open_tile(api, cache_dir, product, measurement, latitude_index, longitude_index, kind=kind)
+            if tile is not None:
+                row.append(_select_extent(tile, latitude, longitude))
+        if len(row) > 0:
+            rows.append(xr.concat(row, 'longitude'))
+    if len(rows) == 0:
+        return None
+    layer = xr.concat(rows, 'latitude')
+
+    # tiles are loaded with inclusive bounds, so adjacent tiles can share a row or column of pixels.
+    _, latitude_indices = np.unique(layer.latitude.values, return_index=True)
+    _, longitude_indices = np.unique(layer.longitude.values, return_index=True)
+    layer = layer.isel(latitude=np.sort(latitude_indices), longitude=np.sort(longitude_indices))
+    if layer.size == 0:
+        return None
+
+    if like is not None:
+        layer = layer.sel(latitude=like.latitude.values, longitude=like.longitude.values, method='nearest')
+        return layer.assign_coords(latitude=like.latitude.values, longitude=like.longitude.values)
+    return _select_extent(layer, latitude, longitude, pad=False)
+
+
+def _select_extent(layer, latitude, longitude, pad=True):
+    """Select an extent from a layer, padded by a pixel so that the nearest pixels to its edges are included"""
+    padding = abs(float(layer.latitude[1] - layer.latitude[0])) if pad and layer.latitude.size > 1 else 0
+    return layer.sel(latitude=slice(max(latitude) + padding, min(latitude) - padding),
+                     longitude=slice(min(longitude) - padding, max(longitude) + padding))
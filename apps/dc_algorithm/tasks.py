@@ -4,9 +4,18 @@ from celery.decorators import periodic_task
 from celery.task.schedules import crontab
 from datetime import datetime, timedelta
 import shutil
+import os
 from django.apps import apps
 
 from .models import Application
+from .product_cache import prune_cache
+from .derived_layers import get_derived_layer_dir
+from .pipelines import revoke_pipeline, pipeline_in_flight, clear_pipeline
+from .chunk_transport import remove_chunks
+
+# Cancelled tasks are cleaned up once none of their chunk tasks are running, checking this often in seconds.
+CANCEL_POLL_INTERVAL = 5
+CANCEL_MAX_POLLS = 120
 
 
 class DCAlgorithmBase(celery.Task):
@@ -89,6 +98,9 @@ def clear_cache():
             history_model.objects.filter(task_id=task.pk).delete()
             shutil.rmtree(task.get_result_path())
             task.delete()
+        if task_model.base_result_dir:
+            prune_cache(os.path.join(task_model.base_result_dir, 'cache'))
+    prune_cache(get_derived_layer_dir())
     print("Cache Cleared.")
 
 
@@ -125,5 +137,28 @@ def task_clean_up(*args, **kwargs):
                                 "keyword argument."
     task_model = kwargs['task_model']
     task = eval("{}.objects.get(pk='{}')".format(task_model, task_id))
+    remove_chunks(task.get_temp_path())
     shutil.rmtree(task.get_temp_path())
-    return True
\ No newline at end of file
+    return True
+
+
+@task(name="dc_algorithm.cancel_task", bind=True, max_retries=CANCEL_MAX_POLLS)
+def cancel_task(self, task_id=None, task_model=None):
+    """
+    Stops the Celery tasks of a cancelled query task and cleans up after them.
+    All of the task's queued chunk tasks are revoked with a single broadcast, then cleanup is deferred
+    until the chunk tasks that were already running have stopped at their cancellation checks.
+
+    Parameters
+    ----------
+    task_id: UUID or str
+        The ID of the Django task - it must already be marked as cancelled.
+    task_model: str
+        The name of the `django.db.models.Model` representing the query task - see `task_clean_up`.
+    """
+    # revoking is repeated on each poll in case the pipeline was dispatched after the task was cancelled.
+    revoke_pipeline(task_id)
+    if pipeline_in_flight(task_id) and self.request.retries < self.max_retries:
+        raise self.retry(countdown=CANCEL_POLL_INTERVAL)
+    clear_pipeline(task_id)
+    return task_clean_up(task_id=task_id, task_model=task_model)
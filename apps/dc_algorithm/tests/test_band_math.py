@@ -0,0 +1,109 @@
+# Copyright 2016 United States Government as represented by the Administrator
+# of the National Aeronautics and Space Administration. All Rights Reserved.
+#
+# Portion of this code is Copyright Geoscience Australia, Licensed under the
+# Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License
+# at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# The CEOS 2 platform is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import unittest
+
+import numpy as np
+import xarray as xr
+
+from apps.dc_algorithm.band_math import BandMathExpression, compile_expression
+
+NO_DATA = -9999
+
+
+def _create_dataset(shape=(3, 5, 6)):
+    random_state = np.random.RandomState(0)
+    dataset = xr.Dataset(
+        {band: (('time', 'latitude', 'longitude'), random_state.randint(1, 10000, shape).astype(np.int16))
+         for band in ['blue', 'red', 'nir', 'swir1']},
+        coords={'time': np.arange(shape[0]), 'latitude': np.arange(shape[1]), 'longitude': np.arange(shape[2])})
+    dataset.red.values[0, 0, 0] = NO_DATA
+    return dataset
+
+
+class BandMathExpressionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dataset = _create_dataset()
+        # the reference is computed over every pixel, the no data pixel is ignored when comparing.
+        self.bands = {band: np.where(self.dataset[band].values == NO_DATA, np.nan, self.dataset[band].values)
+                      for band in self.dataset.data_vars}
+
+    def _assert_equivalent(self, expression, reference, **kwargs):
+        result = BandMathExpression(expression).evaluate(self.dataset, no_data=NO_DATA, **kwargs)
+        self.assertEqual(result.dtype, np.float32)
+        self.assertEqual(result.dims, self.dataset.red.dims)
+        self.assertEqual(result.values[0, 0, 0], NO_DATA)
+        np.testing.assert_allclose(result.values.ravel()[1:], reference.ravel()[1:], rtol=1e-5)
+
+    def test_ndvi(self):
+        bands = self.bands
+        self._assert_equivalent("(nir - red) / (nir + red)",
+                                (bands['nir'] - bands['red']) / (bands['nir'] + bands['red']))
+
+    def test_evi(self):
+        bands = self.bands
+        self._assert_equivalent("2.5 * (nir - red) / (nir + 6 * red - 7.5 * blue + 1)",
+                                2.5 * (bands['nir'] - bands['red']) /
+                                (bands['nir'] + 6 * bands['red'] - 7.5 * bands['blue'] + 1))
+
+    def test_functions_and_powers(self):
+        bands = self.bands
+        self._assert_equivalent("sqrt(abs(-nir)) + log(red) - exp(-swir1 / 10000) + red ** 0.5",
+                                np.sqrt(bands['nir']) + np.log(bands['red']) - np.exp(-bands['swir1'] / 10000) +
+                                bands['red']**0.5)
+
+    def test_blocks_match_single_block(self):
+        expression = BandMathExpression("(nir - swir1) / (nir + swir1) * red")
+        np.testing.assert_array_equal(
+            expression.evaluate(self.dataset, block_size=7).values,
+            expression.evaluate(self.dataset).values)
+
+    def test_clean_mask_and_non_finite_values(self):
+        clean_mask = np.ones(self.dataset.red.shape, dtype=bool)
+        clean_mask[1] = False
+        self.dataset.nir.values[2, 0, 0] = 0
+        self.dataset.red.values[2, 0, 0] = 0
+        result = BandMathExpression("(nir - red) / (nir + red)").evaluate(self.dataset, clean_mask=clean_mask)
+        self.assertTrue((result.values[1] == NO_DATA).all())
+        self.assertEqual(result.values[2, 0, 0], NO_DATA)
+
+    def test_measurements(self):
+        self.assertEqual(BandMathExpression("nir - red + nir").measurements, ['nir', 'red'])
+
+    def test_invalid_expressions(self):
+        for expression in ["nir -", "__import__('os')", "red.values", "1 + 2", "nir if red else blue", "max(red)"]:
+            with self.assertRaises(ValueError):
+                BandMathExpression(expression)
+            with self.assertRaises(ValueError):
+                compile_expression(expression)
+
+    def test_compile_expression(self):
+        expression = compile_expression("(nir - red) / (nir + red)")
+        self.assertIs(compile_expression("(nir - red) / (nir + red)"), expression)
+        np.testing.assert_array_equal(
+            expression.evaluate(self.dataset, no_data=NO_DATA).values,
+            BandMathExpression("(nir - red) / (nir + red)").evaluate(self.dataset, no_data=NO_DATA).values)
+
+    def test_missing_bands(self):
+        with self.assertRaises(ValueError):
+            BandMathExpression("green - red").evaluate(self.dataset)
@@ -0,0 +1,109 @@
+# Copyright 2016 United States Government as represented by the Administrator
+# of the National Aeronautics and Space Administration. All Rights Reserved.
+#
+# Portion of this code is Copyright Geoscience Australia, Licensed under the
+# Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License
+# at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# The CEOS 2 platform is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import os
+import tempfile
+from unittest import mock
+
+import numpy as np
+import xarray as xr
+from django.test import SimpleTestCase, override_settings
+
+from apps.dc_algorithm import chunk_transport
+from apps.dc_algorithm.chunk_transport import open_chunk, remove_chunks, store_chunk
+from apps.dc_algorithm.dtypes import apply_dtype_policy
+
+
+@override_settings(CHUNK_SHARED_MEMORY=True)
+class SharedMemoryChunkTestCase(SimpleTestCase):
+
+    def setUp(self):
+        self.shared_memory_dir = tempfile.mkdtemp()
+        patcher = mock.patch.object(chunk_transport, 'SHARED_MEMORY_DIR', self.shared_memory_dir)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.temp_path = os.path.join(tempfile.mkdtemp(), 'temp', '1')
+        self.path = os.path.join(self.temp_path, "geo_chunk_0.nc")
+        self.dataset = xr.Dataset(
+            {
+                'red': (('latitude', 'longitude'), np.arange(12, dtype=np.int16).reshape(3, 4), {'units': '1'}),
+                'ndvi': (('latitude', 'longitude'), np.linspace(-1, 1, 12, dtype=np.float32).reshape(3, 4))
+            },
+            coords={'latitude': np.linspace(1, 0, 3), 'longitude': np.linspace(0, 1, 4)},
+            attrs={'crs': 'EPSG:4326'})
+
+    def test_round_trip(self):
+        self.assertEqual(store_chunk(self.dataset, self.path), self.path)
+        # nothing is written to the temp path when the segment is written.
+        self.assertFalse(os.path.exists(self.path))
+        xr.testing.assert_identical(open_chunk(self.path), self.dataset)
+
+    def test_files_are_written_for_other_nodes(self):
+        with mock.patch.object(chunk_transport, 'export_xarray_to_netcdf') as export:
+            store_chunk(self.dataset, self.path, consumer_host=chunk_transport.socket.gethostname())
+            export.assert_not_called()
+            store_chunk(self.dataset, os.path.join(self.temp_path, "geo_chunk_1.nc"), consumer_host='other-node')
+            export.assert_called_once_with(self.dataset, os.path.join(self.temp_path, "geo_chunk_1.nc"))
+        self.assertFalse(os.path.exists(chunk_transport._get_segment_path(
+            os.path.join(self.temp_path, "geo_chunk_1.nc"))))
+
+    def test_files_are_written_if_segments_fail(self):
+        with mock.patch.object(chunk_transport, 'export_xarray_to_netcdf') as export, \
+                mock.patch.object(chunk_transport.np, 'save', side_effect=OSError(28, "No space left on device")):
+            store_chunk(self.dataset, self.path)
+            export.assert_called_once_with(self.dataset, self.path)
+            self.assertFalse(os.path.exists(chunk_transport._get_segment_path(self.path)))
+            self.assertEqual(os.listdir(os.path.dirname(chunk_transport._get_segment_path(self.path))), [])
+
+            with override_settings(CHUNK_SHARED_MEMORY_FALLBACK=False):
+                with self.assertRaises(OSError):
+                    store_chunk(self.dataset, self.path)
+
+    def test_scaled_variables_are_decoded(self):
+        store_chunk(apply_dtype_policy(self.dataset.copy(deep=True), scale_factors={'ndvi': 0.0001}), self.path)
+        chunk = open_chunk(self.path)
+        self.assertEqual(chunk.ndvi.dtype, np.float32)
+        xr.testing.assert_allclose(chunk, self.dataset, atol=0.00005)
+
+    def test_opened_chunks_are_copy_on_write(self):
+        store_chunk(self.dataset, self.path)
+        chunk = open_chunk(self.path)
+        chunk.red.values[...] = 0
+        xr.testing.assert_identical(open_chunk(self.path), self.dataset)
+
+    def test_remove_chunks(self):
+        store_chunk(self.dataset, self.path)
+        remove_chunks(self.temp_path)
+        self.assertFalse(os.path.exists(chunk_transport._get_segment_path(self.path)))
+
+    def test_stale_segments_are_removed(self):
+        other_path = os.path.join(tempfile.mkdtemp(), "geo_chunk_1.nc")
+        store_chunk(self.dataset, other_path)
+        segment_path = chunk_transport._get_segment_path(other_path)
+        stale_time = os.path.getmtime(segment_path) - chunk_transport.SHARED_MEMORY_MAX_AGE - 1
+        os.utime(segment_path, (stale_time, stale_time))
+        store_chunk(self.dataset, self.path)
+
+        remove_chunks(os.path.join(tempfile.mkdtemp(), 'temp', '2'))
+        self.assertFalse(os.path.exists(segment_path))
+        self.assertTrue(os.path.exists(chunk_transport._get_segment_path(self.path)))
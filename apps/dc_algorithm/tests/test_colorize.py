@@ -0,0 +1,106 @@
+# Copyright 2016 United States Government as represented by the Administrator
+# of the National Aeronautics and Space Administration. All Rights Reserved.
+#
+# Portion of this code is Copyright Geoscience Australia, Licensed under the
+# Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License
+# at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# The CEOS 2 platform is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import os
+import struct
+import tempfile
+import unittest
+import zlib
+
+import numpy as np
+import xarray as xr
+
+from apps.dc_algorithm.colorize import ColorLookupTable, read_color_scale, write_single_band_png
+
+COLOR_SCALE = """0 0 0 0
+50% 255 0 0
+100 255 255 255 128
+nv 1 2 3
+"""
+
+
+def _read_png(path):
+    """Decode an unfiltered 8 bit RGBA PNG, as written by write_colorized_png"""
+    with open(path, 'rb') as png_file:
+        data = png_file.read()[8:]
+    chunks = {}
+    while data:
+        length, chunk_type = struct.unpack(">I4s", data[:8])
+        chunks[chunk_type] = chunks.get(chunk_type, b'') + data[8:8 + length]
+        data = data[12 + length:]
+    width, height = struct.unpack(">II", chunks[b'IHDR'][:8])
+    rows = np.frombuffer(zlib.decompress(chunks[b'IDAT']), dtype=np.uint8).reshape(height, width * 4 + 1)
+    return rows[:, 1:].reshape(height, width, 4)
+
+
+class ColorizeTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.color_scale = os.path.join(self.temp_dir, "color_scale")
+        with open(self.color_scale, 'w') as color_scale_file:
+            color_scale_file.write(COLOR_SCALE)
+
+    def test_read_color_scale(self):
+        entries, no_data_color = read_color_scale(self.color_scale)
+        self.assertEqual([value for value, _ in entries], [0.0, '50%', 100.0])
+        np.testing.assert_array_equal(entries[2][1], [255, 255, 255, 128])
+        np.testing.assert_array_equal(no_data_color, [1, 2, 3, 255])
+
+    def test_lookup_table_matches_interpolation(self):
+        values = np.linspace(0, 100, 1001)
+        lookup_table = ColorLookupTable.from_color_scale(self.color_scale, values=values)
+        entry_values, entry_colors = [0, 50, 100], np.array([[0, 0, 0, 255], [255, 0, 0, 255], [255, 255, 255, 128]])
+        expected = np.stack([np.interp(values, entry_values, entry_colors[:, index]) for index in range(4)], axis=-1)
+        # values are quantized to one of 256 bins, so colors are within half a bin's color change, plus rounding.
+        bin_width = 100 / 255
+        max_color_change = np.abs(np.diff(entry_colors, axis=0)).max() / 50
+        error = np.abs(lookup_table.colorize(values).astype(np.float64) - expected).max()
+        self.assertLessEqual(error, max_color_change * bin_width / 2 + 0.5)
+
+    def test_nearest_color_entry(self):
+        lookup_table = ColorLookupTable.from_color_scale(self.color_scale, interpolate=False, values=[0, 100])
+        np.testing.assert_array_equal(lookup_table.colorize(np.array([10, 40, 90])),
+                                      [[0, 0, 0, 255], [255, 0, 0, 255], [255, 255, 255, 128]])
+
+    def test_write_single_band_png(self):
+        values = np.linspace(0, 100, 600 * 3).reshape(600, 3)
+        values[0, 0] = -9999
+        values[1, 1] = np.nan
+        dataset = xr.Dataset({'band': (('latitude', 'longitude'), values)})
+        path = os.path.join(self.temp_dir, "band.png")
+        write_single_band_png(path, dataset, 'band', color_scale=self.color_scale)
+
+        image = _read_png(path)
+        self.assertEqual(image.shape, (600, 3, 4))
+        np.testing.assert_array_equal(image[0, 0], [1, 2, 3, 255])
+        np.testing.assert_array_equal(image[1, 1], [1, 2, 3, 255])
+        np.testing.assert_array_equal(image[-1, -1], [255, 255, 255, 128])
+
+        write_single_band_png(path, dataset, 'band', color_scale=self.color_scale, fill_color='transparent')
+        np.testing.assert_array_equal(_read_png(path)[0, 0], [0, 0, 0, 0])
+
+    def test_write_all_no_data_png(self):
+        dataset = xr.Dataset({'band': (('latitude', 'longitude'), np.full((4, 3), -9999.0))})
+        path = os.path.join(self.temp_dir, "band.png")
+        write_single_band_png(path, dataset, 'band', color_scale=self.color_scale, fill_color='transparent')
+        np.testing.assert_array_equal(_read_png(path), np.zeros((4, 3, 4)))
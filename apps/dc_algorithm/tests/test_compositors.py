@@ -0,0 +1,206 @@
+# Copyright 2016 United States Government as represented by the Administrator
+# of the National Aeronautics and Space Administration. All Rights Reserved.
+#
+# Portion of this code is Copyright Geoscience Australia, Licensed under the
+# Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License
+# at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# The CEOS 2 platform is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import unittest
+import warnings
+
+import numpy as np
+import xarray as xr
+
+from apps.dc_algorithm.compositors import (create_geomedian_mosaic, create_mosaic_from_stack,
+                                           create_mosaic_with_clear_counts, create_ndvi_mosaic_from_stack,
+                                           create_streaming_median_mosaic, finalize_median_sketch,
+                                           MEDIAN_EXACT_OBSERVATIONS, MEDIAN_HISTOGRAM_BINS)
+from apps.dc_algorithm.masking import PackedMask
+
+NO_DATA = -9999
+
+
+def _create_dataset(seed=0, shape=(24, 6, 7), bands=('red', 'nir')):
+    random_state = np.random.RandomState(seed)
+    coords = {'time': np.arange(shape[0]), 'latitude': np.arange(shape[1]), 'longitude': np.arange(shape[2])}
+    dataset = xr.Dataset(
+        {band: (('time', 'latitude', 'longitude'), random_state.randint(0, 10000, shape).astype(np.int16))
+         for band in bands},
+        coords=coords)
+    clean_mask = random_state.rand(*shape) > 0.3
+    return dataset, clean_mask
+
+
+class StreamingMedianTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dataset, self.clean_mask = _create_dataset()
+        # one pixel has no clear observations at all.
+        self.clean_mask[:, 0, 0] = False
+        self.data_range = (0, 10000)
+
+    def _get_reference(self, band):
+        values = np.where(self.clean_mask, self.dataset[band].values, np.nan)
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            return np.nanmedian(values, axis=0)
+
+    def test_exact_for_few_observations(self):
+        sketch = create_streaming_median_mosaic(
+            self.dataset, clean_mask=self.clean_mask, no_data=NO_DATA, data_range=self.data_range)
+        mosaic = finalize_median_sketch(sketch, no_data=NO_DATA)
+        for band in ['red', 'nir']:
+            reference = self._get_reference(band)
+            self.assertEqual(mosaic[band].dtype, self.dataset[band].dtype)
+            self.assertEqual(mosaic[band].values[0, 0], NO_DATA)
+            has_data = ~np.isnan(reference)
+            np.testing.assert_array_equal(mosaic[band].values[has_data], np.round(reference[has_data]))
+
+    def test_bounded_by_bin_width_for_many_observations(self):
+        self.dataset, self.clean_mask = _create_dataset(shape=(MEDIAN_EXACT_OBSERVATIONS * 3, 6, 7))
+        sketch = create_streaming_median_mosaic(
+            self.dataset, clean_mask=self.clean_mask, no_data=NO_DATA, data_range=self.data_range)
+        mosaic = finalize_median_sketch(sketch, no_data=NO_DATA)
+        bin_width = (self.data_range[1] - self.data_range[0]) / MEDIAN_HISTOGRAM_BINS
+        self.assertTrue((self.clean_mask.sum(axis=0) > MEDIAN_EXACT_OBSERVATIONS).all())
+        for band in ['red', 'nir']:
+            reference = self._get_reference(band)
+            self.assertLessEqual(np.abs(mosaic[band].values - reference).max(), bin_width)
+
+    def test_merged_sketches_match_single_sketch(self):
+        parameters = {'no_data': NO_DATA, 'data_range': self.data_range}
+        # the second stack has pixels whose observations only stop fitting in the sketch once chunks are merged.
+        for dataset, clean_mask in [(self.dataset, self.clean_mask), _create_dataset(seed=5, shape=(60, 6, 7))]:
+            full_sketch = create_streaming_median_mosaic(dataset, clean_mask=clean_mask, **parameters)
+            self.assertEqual(full_sketch.red_histogram.dtype, np.uint32)
+            merged_sketch = None
+            for time_slice in [slice(0, 10), slice(10, 37), slice(37, None)]:
+                merged_sketch = create_streaming_median_mosaic(
+                    dataset.isel(time=time_slice),
+                    clean_mask=clean_mask[time_slice],
+                    intermediate_product=merged_sketch,
+                    **parameters)
+            for name in full_sketch.data_vars:
+                self.assertEqual(merged_sketch[name].dtype, full_sketch[name].dtype)
+                np.testing.assert_array_equal(merged_sketch[name].values, full_sketch[name].values)
+
+    def test_no_data_is_excluded(self):
+        self.dataset.red.values[:12] = NO_DATA
+        sketch = create_streaming_median_mosaic(self.dataset, no_data=NO_DATA, data_range=self.data_range)
+        self.assertTrue((sketch.red_histogram.sum('histogram_bin') == 12).all())
+
+
+class MosaicFromStackTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.dataset, self.clean_mask = _create_dataset(seed=1)
+        self.dataset.red.values[3, 2, 2] = NO_DATA
+
+    def _create_mosaic(self, reverse_time=False):
+        """Scene by scene reference - each no data pixel is filled by the next clear observation, as in create_mosaic"""
+        mosaic = {band: np.full(self.dataset[band].shape[1:], NO_DATA) for band in self.dataset.data_vars}
+        times = range(len(self.dataset.time))
+        for index in reversed(times) if reverse_time else times:
+            for band in self.dataset.data_vars:
+                values = self.dataset[band].values[index]
+                fill = (mosaic[band] == NO_DATA) & self.clean_mask[index] & (values != NO_DATA)
+                mosaic[band][fill] = values[fill]
+        return mosaic
+
+    def test_equivalent_to_create_mosaic(self):
+        for reverse_time in [False, True]:
+            mosaic = create_mosaic_from_stack(
+                self.dataset, clean_mask=self.clean_mask, no_data=NO_DATA, reverse_time=reverse_time)
+            reference = self._create_mosaic(reverse_time=reverse_time)
+            for band in self.dataset.data_vars:
+                np.testing.assert_array_equal(mosaic[band].values, reference[band])
+
+    def test_max_ndvi_equivalent_to_scene_by_scene(self):
+        red, nir = self.dataset.red.values.astype(np.float32), self.dataset.nir.values.astype(np.float32)
+        ndvi = np.where(self.clean_mask, (nir - red) / (nir + red), -np.inf)
+        selected = np.argmax(ndvi, axis=0)
+        has_clear = self.clean_mask.any(axis=0)
+
+        mosaic = create_ndvi_mosaic_from_stack(self.dataset, clean_mask=self.clean_mask, no_data=NO_DATA)
+        for band in ['red', 'nir']:
+            expected = np.take_along_axis(self.dataset[band].values, selected[np.newaxis], axis=0)[0]
+            np.testing.assert_array_equal(mosaic[band].values[has_clear], expected[has_clear])
+            self.assertTrue((mosaic[band].values[~has_clear] == NO_DATA).all())
+
+
+def _get_geomedian(points, iterations=2000):
+    """Pixel by pixel Weiszfeld reference in float64, as computed by hdmedians"""
+    estimate = points.mean(axis=0)
+    for _ in range(iterations):
+        distances = np.maximum(np.linalg.norm(points - estimate, axis=1), 1e-12)
+        estimate = (points / distances[:, np.newaxis]).sum(axis=0) / (1 / distances).sum()
+    return estimate
+
+
+class GeomedianTestCase(unittest.TestCase):
+
+    def test_equivalent_to_pixel_by_pixel(self):
+        dataset, clean_mask = _create_dataset(seed=2, shape=(15, 3, 4), bands=('red', 'green', 'blue'))
+        clean_mask[:, 0, 0] = False
+        mosaic = create_geomedian_mosaic(dataset, clean_mask=clean_mask, no_data=NO_DATA, tolerance=0.01)
+        bands = ['red', 'green', 'blue']
+        for latitude in range(3):
+            for longitude in range(4):
+                clear = clean_mask[:, latitude, longitude]
+                composited = [mosaic[band].values[latitude, longitude] for band in bands]
+                if not clear.any():
+                    self.assertEqual(composited, [NO_DATA] * 3)
+                    continue
+                points = np.stack([dataset[band].values[clear, latitude, longitude] for band in bands], axis=1)
+                np.testing.assert_allclose(composited, np.round(_get_geomedian(points.astype(np.float64))), atol=1)
+
+
+class ClearCountsTestCase(unittest.TestCase):
+
+    def test_equivalent_to_mosaic_and_counts(self):
+        dataset, clean_mask = _create_dataset(seed=3)
+        product = None
+        for time_slice in [slice(0, 9), slice(9, None)]:
+            product = create_mosaic_with_clear_counts(
+                dataset.isel(time=time_slice), clean_mask=clean_mask[time_slice], intermediate_product=product,
+                no_data=NO_DATA)
+
+        mosaic = create_mosaic_from_stack(dataset, clean_mask=clean_mask, no_data=NO_DATA)
+        for band in dataset.data_vars:
+            np.testing.assert_array_equal(product[band].values, mosaic[band].values)
+        np.testing.assert_array_equal(product.total_pixels.values, len(dataset.time))
+        np.testing.assert_array_equal(product.total_clear.values, clean_mask.sum(axis=0))
+        np.testing.assert_allclose(product.clear_percentage.values, clean_mask.mean(axis=0))
+
+
+class PackedMaskTestCase(unittest.TestCase):
+
+    def test_packed_masks_match_boolean_masks(self):
+        dataset, clean_mask = _create_dataset(seed=4, shape=(12, 5, 11), bands=('red', 'nir', 'pixel_qa'))
+        packed_mask = PackedMask.from_array(clean_mask)
+        compositors = [
+            create_mosaic_from_stack, create_ndvi_mosaic_from_stack, create_mosaic_with_clear_counts,
+            lambda *args, **kwargs: create_streaming_median_mosaic(*args, data_range=(0, 10000),
+                                                                   mask_bands=['pixel_qa'], **kwargs),
+            lambda *args, **kwargs: create_geomedian_mosaic(*args, mask_bands=['pixel_qa'], **kwargs)
+        ]
+        for compositor in compositors:
+            expected = compositor(dataset, clean_mask=clean_mask, no_data=NO_DATA)
+            product = compositor(dataset, clean_mask=packed_mask, no_data=NO_DATA)
+            for name in expected.data_vars:
+                np.testing.assert_array_equal(product[name].values, expected[name].values)
@@ -0,0 +1,73 @@
+# Copyright 2016 United States Government as represented by the Administrator
+# of the National Aeronautics and Space Administration. All Rights Reserved.
+#
+# Portion of this code is Copyright Geoscience Australia, Licensed under the
+# Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License
+# at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# The CEOS 2 platform is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import unittest
+
+from apps.dc_algorithm.data_access import create_storage_aligned_chunks
+
+
+class _DatasetType:
+
+    def __init__(self, storage):
+        self.definition = {'storage': storage}
+
+
+class _Dataset:
+
+    def __init__(self, storage):
+        self.type = _DatasetType(storage)
+
+
+def _get_boundaries(chunks, axis):
+    return sorted(set(value for chunk in chunks for value in chunk[axis]))
+
+
+class CreateStorageAlignedChunksTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # 1 degree tiles of 0.01 degree pixels, chunked internally in 10 x 10 pixel blocks.
+        self.storage = {
+            'tile_size': {'latitude': 1.0, 'longitude': 1.0},
+            'resolution': {'latitude': -0.01, 'longitude': 0.01},
+            'chunking': {'latitude': 10, 'longitude': 10}
+        }
+
+    def test_chunks_are_aligned_with_blocks(self):
+        chunks = create_storage_aligned_chunks(
+            [_Dataset(self.storage)], longitude=(0.05, 1.45), latitude=(0.05, 1.45), geographic_chunk_size=0.09)
+        # blocks of descending axes start at the north edge of each tile, ascending axes at the west edge.
+        latitude_boundaries = [round(value, 6) for value in _get_boundaries(chunks, 'latitude')]
+        longitude_boundaries = [round(value, 6) for value in _get_boundaries(chunks, 'longitude')]
+        self.assertEqual(latitude_boundaries, [0.05, 0.1, 0.4, 0.7, 1.0, 1.1, 1.4, 1.45])
+        self.assertEqual(longitude_boundaries, [0.05, 0.3, 0.6, 0.9, 1.0, 1.3, 1.45])
+        self.assertEqual(len(chunks), 7 * 6)
+
+    def test_chunks_cover_the_extent(self):
+        chunks = create_storage_aligned_chunks(
+            [_Dataset(self.storage)], longitude=(-0.52, 0.61), latitude=(-0.33, 0.27), geographic_chunk_size=0.01)
+        area = sum((max(chunk['latitude']) - min(chunk['latitude'])) *
+                   (max(chunk['longitude']) - min(chunk['longitude'])) for chunk in chunks)
+        self.assertAlmostEqual(area, (0.61 + 0.52) * (0.33 + 0.27))
+        for axis, extent in [('latitude', (-0.33, 0.27)), ('longitude', (-0.52, 0.61))]:
+            boundaries = _get_boundaries(chunks, axis)
+            self.assertAlmostEqual(boundaries[0], extent[0])
+            self.assertAlmostEqual(boundaries[-1], extent[1])
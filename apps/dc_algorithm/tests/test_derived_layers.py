@@ -0,0 +1,138 @@
+# Copyright 2016 United States Government as represented by the Administrator
+# of the National Aeronautics and Space Administration. All Rights Reserved.
+#
+# Portion of this code is Copyright Geoscience Australia, Licensed under the
+# Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License
+# at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# The CEOS 2 platform is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import datetime
+import math
+import tempfile
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+import xarray as xr
+from django.test import SimpleTestCase, override_settings
+
+from apps.dc_algorithm import derived_layers
+from apps.dc_algorithm.derived_layers import get_derived_layer
+
+NO_DATA = -9999
+RESOLUTION = 0.01
+TILE_SIZE = 0.2
+STORAGE = {
+    'tile_size': {'latitude': TILE_SIZE, 'longitude': TILE_SIZE},
+    'resolution': {'latitude': -RESOLUTION, 'longitude': RESOLUTION},
+    'chunking': {'latitude': 5, 'longitude': 5}
+}
+
+
+def _create_dataset(latitude_index, longitude_index, time):
+    bounds = SimpleNamespace(bottom=latitude_index * TILE_SIZE, top=(latitude_index + 1) * TILE_SIZE,
+                             left=longitude_index * TILE_SIZE, right=(longitude_index + 1) * TILE_SIZE)
+    return SimpleNamespace(
+        id="{}_{}_{}".format(latitude_index, longitude_index, time.isoformat()),
+        center_time=time,
+        type=SimpleNamespace(definition={'storage': STORAGE}),
+        extent=SimpleNamespace(to_crs=lambda crs: SimpleNamespace(boundingbox=bounds)))
+
+
+def _get_pixels(value_range):
+    return np.arange(int(math.floor(min(value_range) / RESOLUTION + 1e-6)),
+                     int(math.ceil(max(value_range) / RESOLUTION - 1e-6)))
+
+
+class _DataCube:
+    """Loads a synthetic red band for the pixels of each dataset's tile that intersect the query"""
+
+    def __init__(self):
+        self.loaded_pixels = 0
+
+    def load(self, datasets=None, measurements=None, latitude=None, longitude=None):
+        latitude_pixels, longitude_pixels = _get_pixels(latitude)[::-1], _get_pixels(longitude)
+        times = sorted(set(dataset.center_time for dataset in datasets))
+        red = np.full((len(times), latitude_pixels.size, longitude_pixels.size), NO_DATA, dtype=np.int16)
+        for dataset in datasets:
+            bounds = dataset.extent.to_crs(None).boundingbox
+            in_tile = np.outer((latitude_pixels >= round(bounds.bottom / RESOLUTION)) &
+                               (latitude_pixels < round(bounds.top / RESOLUTION)),
+                               (longitude_pixels >= round(bounds.left / RESOLUTION)) &
+                               (longitude_pixels < round(bounds.right / RESOLUTION)))
+            values = (latitude_pixels[:, np.newaxis] * 37 + longitude_pixels * 11 + dataset.center_time.day) % 1000
+            red[times.index(dataset.center_time)][in_tile] = values[in_tile]
+        if not (red != NO_DATA).any():
+            return xr.Dataset()
+        self.loaded_pixels += red.size
+        return xr.Dataset(
+            {'red': (('time', 'latitude', 'longitude'), red)},
+            coords={
+                'time': np.array(times, dtype='datetime64[ns]'),
+                'latitude': (latitude_pixels + 0.5) * RESOLUTION,
+                'longitude': (longitude_pixels + 0.5) * RESOLUTION
+            })
+
+
+def _classify(data, clean_mask=None, no_data=NO_DATA):
+    return xr.Dataset({
+        'wofs': xr.DataArray(np.where(data.red.values == no_data, no_data, data.red.values > 500).astype(np.int16),
+                             dims=('time', 'latitude', 'longitude'))
+    }, coords=data.coords)
+
+
+class DerivedLayerTestCase(SimpleTestCase):
+
+    def setUp(self):
+        settings_override = override_settings(DERIVED_LAYER_DIR=tempfile.mkdtemp())
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        # tiles are derived in several blocks that share their edges.
+        patcher = mock.patch.object(derived_layers, 'DERIVED_LAYER_BLOCK_SIZE', 0.01)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.api = SimpleNamespace(dc=_DataCube())
+        self.times = [datetime.datetime(2016, 1, day) for day in [1, 17]]
+        self.datasets = [
+            _create_dataset(latitude_index, longitude_index, time)
+            for latitude_index in range(2) for longitude_index in range(2) for time in self.times
+        ]
+        self.compute = mock.Mock(side_effect=_classify)
+
+    def _get_layer(self, latitude, longitude):
+        data = self.api.dc.load(datasets=self.datasets, latitude=latitude, longitude=longitude)
+        layer = get_derived_layer('wofs', self.compute, self.api, data, self.datasets, ['red'],
+                                  lambda data: np.ones(data.red.shape, dtype=bool), no_data=NO_DATA)
+        return data, layer
+
+    def test_equivalent_to_classifying_chunks(self):
+        for latitude, longitude in [((0.05, 0.1), (0.13, 0.31)), ((0.0, 0.4), (0.0, 0.4)), ((0.21, 0.23), (0.2, 0.22))]:
+            data, layer = self._get_layer(latitude, longitude)
+            np.testing.assert_array_equal(layer.wofs.values, _classify(data).wofs.values)
+            np.testing.assert_array_equal(layer.time.values, data.time.values)
+
+    def test_tiles_are_derived_once(self):
+        self._get_layer((0.05, 0.1), (0.05, 0.1))
+        # one tile in two scenes, each derived in four blocks.
+        self.assertEqual(self.compute.call_count, 2 * 4)
+        loaded_pixels = self.api.dc.loaded_pixels
+        # any other chunk of the same tiles, whatever its size, reads the stored tiles.
+        self._get_layer((0.0, 0.2), (0.0, 0.2))
+        self._get_layer((0.11, 0.13), (0.02, 0.19))
+        self.assertEqual(self.compute.call_count, 2 * 4)
+        self.assertEqual(self.api.dc.loaded_pixels - loaded_pixels, 2 * 20 * 20 + 2 * 2 * 17)
@@ -0,0 +1,74 @@
+# Copyright 2016 United States Government as represented by the Administrator
+# of the National Aeronautics and Space Administration. All Rights Reserved.
+#
+# Portion of this code is Copyright Geoscience Australia, Licensed under the
+# Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License
+# at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# The CEOS 2 platform is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import unittest
+
+import numpy as np
+import xarray as xr
+
+from apps.dc_algorithm.dtypes import SCALED_NO_DATA, apply_dtype_policy, decode_scaled
+
+NO_DATA = -9999
+
+
+class DtypePolicyTestCase(unittest.TestCase):
+
+    def setUp(self):
+        ratio = np.linspace(-1, 1, 12).reshape(3, 4)
+        ratio[0, 0] = NO_DATA
+        ratio[0, 1] = np.nan
+        self.dataset = xr.Dataset({
+            'red': (('latitude', 'longitude'), np.arange(12, dtype=np.int16).reshape(3, 4)),
+            'ndvi': (('latitude', 'longitude'), ratio),
+            'ratio': (('latitude', 'longitude'), ratio.copy())
+        })
+
+    def test_default_policy(self):
+        dataset = apply_dtype_policy(self.dataset.copy(deep=True))
+        self.assertEqual(dataset.red.dtype, np.int16)
+        self.assertEqual(dataset.ndvi.dtype, np.float32)
+        self.assertEqual(dataset.ratio.dtype, np.float32)
+
+    def test_float64_override(self):
+        dataset = apply_dtype_policy(self.dataset.copy(deep=True), exclude=['ratio'])
+        self.assertEqual(dataset.ndvi.dtype, np.float32)
+        self.assertEqual(dataset.ratio.dtype, np.float64)
+        dataset = apply_dtype_policy(self.dataset.copy(deep=True), dtype='float64')
+        self.assertEqual(dataset.ndvi.dtype, np.float64)
+
+    def test_scaled_override(self):
+        dataset = apply_dtype_policy(self.dataset.copy(deep=True), scale_factors={'ndvi': 0.0001}, no_data=NO_DATA)
+        self.assertEqual(dataset.ndvi.dtype, np.int16)
+        self.assertEqual(dataset.ratio.dtype, np.float32)
+        self.assertEqual(dataset.ndvi.values[0, 0], SCALED_NO_DATA)
+        self.assertEqual(dataset.ndvi.values[0, 1], SCALED_NO_DATA)
+
+        decoded = decode_scaled(dataset)
+        self.assertEqual(decoded.ndvi.dtype, np.float32)
+        self.assertEqual(decoded.ndvi.attrs, {})
+        expected = self.dataset.ndvi.values.copy()
+        expected[0, 1] = NO_DATA
+        np.testing.assert_allclose(decoded.ndvi.values, expected, atol=0.00005)
+
+    def test_scaled_values_are_clipped(self):
+        dataset = xr.Dataset({'evi': (('x',), np.array([-10.0, 10.0]))})
+        decoded = decode_scaled(apply_dtype_policy(dataset, scale_factors={'evi': 0.0001}))
+        np.testing.assert_allclose(decoded.evi.values, [-3.2767, 3.2767], atol=0.00005)
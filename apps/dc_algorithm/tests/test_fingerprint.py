@@ -0,0 +1,87 @@
+# Copyright 2016 United States Government as represented by the Administrator
+# of the National Aeronautics and Space Administration. All Rights Reserved.
+#
+# Portion of this code is Copyright Geoscience Australia, Licensed under the
+# Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License
+# at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# The CEOS 2 platform is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import unittest
+
+from apps.dc_algorithm import fingerprint
+from apps.dc_algorithm.fingerprint import get_product_resolution, snap_to_grid
+
+
+class _Product:
+
+    def __init__(self, definition):
+        self.definition = definition
+
+
+class _Index:
+
+    def __init__(self, products):
+        self.products = self
+        self._products = products
+        self.lookups = 0
+
+    def get_by_name(self, name):
+        self.lookups += 1
+        return self._products.get(name)
+
+
+class _Api:
+
+    def __init__(self, products):
+        self.dc = self
+        self.index = _Index(products)
+
+
+class SnapToGridTestCase(unittest.TestCase):
+
+    def test_ranges_with_the_same_pixels_match(self):
+        resolution = 0.00027
+        # pixel centers are at (index + 0.5) * resolution - both ranges contain pixels 3704 to 7406.
+        self.assertEqual(snap_to_grid((1.0, 2.0), resolution), (3704, 7406))
+        self.assertEqual(snap_to_grid((1.00001, 2.00001), resolution), snap_to_grid((1.0, 2.0), resolution))
+        self.assertEqual(snap_to_grid((2.0, 1.0), -resolution), snap_to_grid((1.0, 2.0), resolution))
+
+    def test_ranges_with_different_pixels_differ(self):
+        resolution = 0.1
+        self.assertEqual(snap_to_grid((0.0, 1.0), resolution), (0, 9))
+        self.assertEqual(snap_to_grid((0.0, 1.06), resolution), (0, 10))
+        self.assertEqual(snap_to_grid((0.06, 1.0), resolution), (1, 9))
+
+    def test_pixel_centers_on_the_boundary(self):
+        self.assertEqual(snap_to_grid((0.05, 0.95), 0.1), (0, 9))
+
+
+class GetProductResolutionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        fingerprint._product_resolutions.clear()
+
+    def test_resolutions_are_memoized(self):
+        api = _Api({
+            'ls7_ledaps_vietnam': _Product({'storage': {'resolution': {'latitude': -0.00027, 'longitude': 0.00027}}}),
+            'ls7_ledaps_utm': _Product({'storage': {'resolution': {'x': 30, 'y': -30}}})
+        })
+        self.assertEqual(get_product_resolution(api, 'ls7_ledaps_vietnam'), (-0.00027, 0.00027))
+        self.assertEqual(get_product_resolution(api, 'ls7_ledaps_vietnam'), (-0.00027, 0.00027))
+        self.assertIsNone(get_product_resolution(api, 'ls7_ledaps_utm'))
+        self.assertIsNone(get_product_resolution(api, 'missing'))
+        self.assertEqual(api.index.lookups, 3)
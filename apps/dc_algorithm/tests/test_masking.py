@@ -0,0 +1,100 @@
+# Copyright 2016 United States Government as represented by the Administrator
+# of the National Aeronautics and Space Administration. All Rights Reserved.
+#
+# Portion of this code is Copyright Geoscience Australia, Licensed under the
+# Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License
+# at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# The CEOS 2 platform is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import unittest
+
+import numpy as np
+import xarray as xr
+
+from apps.dc_algorithm.masking import PackedMask, count_clear, get_clean_mask, get_mask_slice
+
+
+def _create_dataset(band, values):
+    return xr.Dataset({band: (('time', 'latitude', 'longitude'), values)})
+
+
+class PackedMaskTestCase(unittest.TestCase):
+
+    def setUp(self):
+        # an odd last axis exercises the padding of the final packed byte.
+        self.mask = np.random.RandomState(0).rand(4, 5, 13) > 0.5
+
+    def test_round_trip(self):
+        packed_mask = PackedMask.from_array(self.mask)
+        np.testing.assert_array_equal(packed_mask.unpack(), self.mask)
+        np.testing.assert_array_equal(np.asarray(packed_mask), self.mask)
+        self.assertEqual(packed_mask.nbytes, 4 * 5 * 2)
+
+    def test_time_slice(self):
+        packed_mask = PackedMask.from_array(self.mask)
+        for index in range(len(self.mask)):
+            np.testing.assert_array_equal(packed_mask.unpack(index), self.mask[index])
+            self.assertEqual(packed_mask.count(index), self.mask[index].sum())
+        self.assertEqual(packed_mask.count(), self.mask.sum())
+
+    def test_not_a_sequence(self):
+        # numpy must convert packed masks through __array__ rather than treating them as a sequence of indices.
+        packed_mask = PackedMask.from_array(self.mask)
+        self.assertFalse(hasattr(packed_mask, '__getitem__'))
+        values = np.arange(self.mask.size).reshape(self.mask.shape)
+        np.testing.assert_array_equal(values[np.asarray(packed_mask)], values[self.mask])
+
+
+class GetCleanMaskTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.values = np.random.RandomState(0).randint(0, 2**16, (3, 4, 11)).astype(np.uint16)
+
+    def test_pixel_qa(self):
+        # equivalent to create_bit_mask with the clear and water bits.
+        expected = ((self.values & (1 << 1)) > 0) | ((self.values & (1 << 2)) > 0)
+        mask = get_clean_mask(_create_dataset('pixel_qa', self.values), 'pixel_qa')
+        self.assertIsInstance(mask, np.ndarray)
+        np.testing.assert_array_equal(mask, expected)
+
+    def test_cf_mask(self):
+        values = self.values % 5
+        expected = (values == 0) | (values == 1)
+        np.testing.assert_array_equal(get_clean_mask(_create_dataset('cf_mask', values), 'cf_mask'), expected)
+
+    def test_no_data(self):
+        values = np.array([[[-9999, 2, 4, 1, 70000]]], dtype=np.int32)
+        mask = get_clean_mask(_create_dataset('pixel_qa', values), 'pixel_qa')
+        np.testing.assert_array_equal(mask, [[[False, True, True, False, False]]])
+
+    def test_cached_masks_are_copies(self):
+        dataset = _create_dataset('pixel_qa', self.values)
+        mask = get_clean_mask(dataset, 'pixel_qa')
+        expected = mask.copy()
+        mask[...] = False
+        np.testing.assert_array_equal(get_clean_mask(dataset, 'pixel_qa'), expected)
+
+    def test_packed(self):
+        dataset = _create_dataset('pixel_qa', self.values)
+        mask = get_clean_mask(dataset, 'pixel_qa')
+        packed_mask = get_clean_mask(dataset, 'pixel_qa', packed=True)
+        self.assertIsInstance(packed_mask, PackedMask)
+        self.assertIs(get_clean_mask(dataset, 'pixel_qa', packed=True), packed_mask)
+        for index in range(len(mask)):
+            np.testing.assert_array_equal(get_mask_slice(packed_mask, index), get_mask_slice(mask, index))
+            self.assertEqual(count_clear(packed_mask, index), count_clear(mask, index))
+        self.assertEqual(count_clear(packed_mask), count_clear(mask))
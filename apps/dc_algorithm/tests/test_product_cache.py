@@ -0,0 +1,83 @@
+# Copyright 2016 United States Government as represented by the Administrator
+# of the National Aeronautics and Space Administration. All Rights Reserved.
+#
+# Portion of this code is Copyright Geoscience Australia, Licensed under the
+# Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License
+# at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# The CEOS 2 platform is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import os
+import tempfile
+import time
+import unittest
+from datetime import date, timedelta
+
+import numpy as np
+import xarray as xr
+
+from apps.dc_algorithm.product_cache import (get_cache_key, get_dataset_ids, load_cached_product, prune_cache,
+                                             store_cached_product)
+
+
+class _Dataset:
+
+    def __init__(self, id):
+        self.id = id
+
+
+class GetCacheKeyTestCase(unittest.TestCase):
+
+    def test_keys_are_stable_and_order_independent(self):
+        key = get_cache_key(product='ls7_ledaps_vietnam', time=(date(2017, 1, 1), date(2017, 6, 1)), version=1)
+        self.assertEqual(len(key), 40)
+        self.assertEqual(
+            get_cache_key(version=1, time=(date(2017, 1, 1), date(2017, 6, 1)), product='ls7_ledaps_vietnam'), key)
+        self.assertNotEqual(get_cache_key(product='ls7_ledaps_vietnam', time=(date(2017, 1, 1), date(2017, 6, 1)),
+                                          version=2), key)
+
+    def test_dataset_ids_are_sorted(self):
+        self.assertEqual(get_dataset_ids([_Dataset('b'), _Dataset('a')]), ['a', 'b'])
+
+
+class CachedProductTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.cache_dir, get_cache_key(name='baseline'))
+        self.dataset = xr.Dataset(
+            {'red': (('latitude', 'longitude'), np.arange(6, dtype=np.int16).reshape(2, 3))},
+            coords={'latitude': [1.0, 0.0], 'longitude': [0.0, 0.5, 1.0]})
+
+    def test_round_trip(self):
+        self.assertIsNone(load_cached_product(self.path))
+        store_cached_product(self.path, self.dataset, {'clean_pixels': 6})
+        dataset, metadata = load_cached_product(self.path)
+        xr.testing.assert_equal(dataset, self.dataset)
+        self.assertEqual(metadata, {'clean_pixels': 6})
+        self.assertEqual(sorted(os.listdir(self.cache_dir)),
+                         sorted([os.path.basename(self.path) + extension for extension in [".nc", ".pickle"]]))
+
+    def test_prune_cache(self):
+        stale_path = os.path.join(self.cache_dir, "stale")
+        for path in [self.path, stale_path]:
+            with open(path, 'w') as cache_file:
+                cache_file.write("entry")
+        stale_time = time.time() - timedelta(days=2).total_seconds()
+        os.utime(stale_path, (stale_time, stale_time))
+
+        prune_cache(self.cache_dir, max_age=timedelta(days=1))
+        self.assertEqual(os.listdir(self.cache_dir), [os.path.basename(self.path)])
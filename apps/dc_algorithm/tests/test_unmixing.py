@@ -0,0 +1,77 @@
+# Copyright 2016 United States Government as represented by the Administrator
+# of the National Aeronautics and Space Administration. All Rights Reserved.
+#
+# Portion of this code is Copyright Geoscience Australia, Licensed under the
+# Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License
+# at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# The CEOS 2 platform is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+
+import unittest
+
+import numpy as np
+import xarray as xr
+
+from apps.dc_algorithm.unmixing import EndmemberUnmixer, FRACTIONAL_COVER_BANDS, frac_coverage_classify
+
+try:
+    from scipy.optimize import nnls
+except ImportError:
+    nnls = None
+
+
+class EndmemberUnmixerTestCase(unittest.TestCase):
+
+    def setUp(self):
+        random_state = np.random.RandomState(0)
+        self.end_members = random_state.rand(12, 3)
+        # a mix of pixels inside the endmember cone and pixels that need some abundances clamped to zero.
+        self.features = np.vstack([random_state.rand(200, 3).dot(self.end_members.T),
+                                   random_state.randn(200, 12)])
+        self.abundances = EndmemberUnmixer(self.end_members).unmix(self.features)
+
+    @unittest.skipIf(nnls is None, "scipy is not installed")
+    def test_equivalent_to_nnls(self):
+        expected = np.array([nnls(self.end_members, pixel)[0] for pixel in self.features])
+        np.testing.assert_allclose(self.abundances, expected, atol=1e-8)
+
+    def test_optimality_conditions(self):
+        # x >= 0, E^T (E x - b) >= 0, and x . E^T (E x - b) = 0 characterize the nnls solution.
+        gradient = (self.abundances.dot(self.end_members.T) - self.features).dot(self.end_members)
+        self.assertTrue((self.abundances >= 0).all())
+        self.assertTrue((gradient > -1e-8).all())
+        np.testing.assert_allclose(np.sum(self.abundances * gradient, axis=1), 0, atol=1e-8)
+
+
+class FracCoverageClassifyTestCase(unittest.TestCase):
+
+    def test_blocks_and_clean_mask(self):
+        random_state = np.random.RandomState(1)
+        shape = (6, 7)
+        dataset = xr.Dataset(
+            {band: (('latitude', 'longitude'), random_state.randint(100, 5000, shape).astype(np.int16))
+             for band in FRACTIONAL_COVER_BANDS},
+            coords={'latitude': np.arange(shape[0]), 'longitude': np.arange(shape[1])})
+        clean_mask = random_state.rand(*shape) > 0.3
+
+        result = frac_coverage_classify(dataset, clean_mask=clean_mask, no_data=-9999)
+        blocked_result = frac_coverage_classify(dataset, clean_mask=clean_mask, no_data=-9999, block_size=5)
+        unmasked_result = frac_coverage_classify(dataset, no_data=-9999)
+        for band in ['bs', 'pv', 'npv']:
+            self.assertEqual(result[band].dtype, np.int16)
+            np.testing.assert_array_equal(result[band].values, blocked_result[band].values)
+            self.assertTrue((result[band].values[~clean_mask] == -9999).all())
+            np.testing.assert_array_equal(result[band].values[clean_mask], unmasked_result[band].values[clean_mask])
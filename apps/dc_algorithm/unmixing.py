@@ -0,0 +1,177 @@
+# Copyright 2016 United States Government as represented by the Administrator
+# of the National Aeronautics and Space Administration. All Rights Reserved.
+#
+# Portion of this code is Copyright Geoscience Australia, Licensed under the
+# Apache License, Version 2.0 (the "License"); you may not use this file
+# except in compliance with the License. You may obtain a copy of the License
+# at
+#
+#    http://www.apache.org/licenses/LICENSE-2.0
+#
+# The CEOS 2 platform is licensed under the Apache License, Version 2.0 (the
+# "License"); you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+# http://www.apache.org/licenses/LICENSE-2.0.
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import hashlib
+import itertools
+import os
+from collections import OrderedDict
+
+import numpy as np
+import xarray as xr
+
+from utils.data_cube_utilities import dc_fractional_coverage_classifier
+from apps.dc_algorithm.derived_layers import DERIVED_LAYER_VERSIONS, get_derived_layer_dir
+from apps.dc_algorithm.product_cache import get_cache_key, load_cached_product, store_cached_product
+
+# Landsat endmembers distributed with the data cube utilities - one row per spectral feature, columns are pv, npv, bs.
+ENDMEMBERS_PATH = os.path.join(os.path.dirname(dc_fractional_coverage_classifier.__file__), 'endmembers_landsat.csv')
+SUM_TO_ONE_WEIGHT = 0.02
+FRACTIONAL_COVER_BANDS = ['blue', 'green', 'red', 'nir', 'swir1', 'swir2']
+
+# Pixels are unmixed this many at a time, so the feature matrix is bounded by the block rather than the data.
+UNMIXING_BLOCK_SIZE = 2**16
+
+
+class EndmemberUnmixer:
+    """Batched non-negative least squares unmixing against a fixed endmember matrix
+
+    Each pixel is solved as min ||E x - b|| subject to x >= 0. With only a few endmembers the solution is the
+    least squares solution over one of the subsets of endmembers, so the Gram matrix of every subset is inverted
+    once and each block of pixels is solved with a few matrix products - the only per-pixel work is picking the
+    feasible subset with the smallest residual. Results are equivalent to scipy.optimize.nnls.
+
+    Attributes:
+        end_members: endmember matrix with one row per feature and one column per endmember.
+    """
+
+    def __init__(self, end_members):
+        self.end_members = np.asarray(end_members, dtype=np.float64)
+        gram = self.end_members.T.dot(self.end_members)
+        count = self.end_members.shape[1]
+        self._subsets = [(list(subset), np.linalg.inv(gram[np.ix_(subset, subset)]))
+                         for size in range(1, count + 1) for subset in itertools.combinations(range(count), size)]
+
+    def unmix(self, features):
+        """Unmix an n x features matrix of pixels, returning an n x endmembers matrix of abundances"""
+        # the residual of a subset's least squares solution is ||b||^2 - x.(E^T b), so only E^T b is needed.
+        projected = features.dot(self.end_members)
+        abundances = np.zeros(projected.shape)
+        best_reduction = np.zeros(len(projected))
+        for subset, inverse in self._subsets:
+            subset_projected = projected[:, subset]
+            solution = subset_projected.dot(inverse.T)
+            reduction = np.sum(solution * subset_projected, axis=1)
+            better = np.all(solution >= 0, axis=1) & (reduction > best_reduction)
+            best_reduction[better] = reduction[better]
+            abundances[better] = 0
+            abundances[np.ix_(better, subset)] = solution[better]
+        return abundances
+
+
+_unmixer = None
+
+
+def _get_unmixer():
+    global _unmixer
+    if _unmixer is None:
+        end_members = np.loadtxt(ENDMEMBERS_PATH, delimiter=',')
+        # a weighted row of ones pulls the abundances towards summing to one.
+        _unmixer = EndmemberUnmixer(np.vstack([end_members, np.full((1, end_members.shape[1]), SUM_TO_ONE_WEIGHT)]))
+    return _unmixer
+
+
+def _get_features(reflectance):
+    """Expand an n x 6 reflectance matrix to the spectral features the endmembers are defined over
+
+    Features are the bands, their logs, band * log, and the pairwise products of bands, pairwise products of logs,
+    and pairwise normalized differences, followed by a constant for the sum to one constraint.
+    """
+    with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        logs = np.log(reflectance)
+        first, second = np.triu_indices(reflectance.shape[1], 1)
+        features = np.hstack([
+            reflectance, logs, reflectance * logs, reflectance[:, first] * reflectance[:, second],
+            logs[:, first] * logs[:, second],
+            (reflectance[:, second] - reflectance[:, first]) / (reflectance[:, second] + reflectance[:, first])
+        ])
+        features = np.nan_to_num(features)
+    return np.hstack([features, np.ones((len(features), 1))])
+
+
+def frac_coverage_classify(dataset_in, clean_mask=None, no_data=-9999, block_size=UNMIXING_BLOCK_SIZE):
+    """Classify a composite into bare soil, photosynthetic, and non-photosynthetic vegetation percentages
+
+    Equivalent to the data cube utilities' frac_coverage_classify, but only clean pixels are unmixed and they are
+    solved in blocks with EndmemberUnmixer rather than with one nnls call per pixel.
+
+    Args:
+        dataset_in: xarray dataset with latitude and longitude dimensions containing the FRACTIONAL_COVER_BANDS.
+        clean_mask: boolean mask of the pixels to classify - all pixels if None.
+        no_data: value used for pixels that aren't clean.
+
+    Returns:
+        xarray dataset containing int16 bs, pv, and npv bands.
+    """
+    shape = dataset_in[FRACTIONAL_COVER_BANDS[0]].shape
+    clean_mask = np.ones(shape, dtype=bool) if clean_mask is None else np.asarray(clean_mask, dtype=bool)
+    clean_indices = np.flatnonzero(clean_mask)
+    bands = [dataset_in[band].values.reshape(-1) for band in FRACTIONAL_COVER_BANDS]
+
+    unmixer = _get_unmixer()
+    result = np.full((clean_mask.size, unmixer.end_members.shape[1]), no_data, dtype=np.int16)
+    for start in range(0, len(clean_indices), block_size):
+        indices = clean_indices[start:start + block_size]
+        reflectance = np.stack([band[indices] for band in bands], axis=1).astype(np.float64) * 0.0001
+        # features of non-positive reflectances are saturated, so their solutions can overflow to no cover.
+        with np.errstate(over='ignore', invalid='ignore'):
+            abundances = unmixer.unmix(_get_features(reflectance))
+        result[indices] = (abundances.clip(0, 2.54) * 100).astype(np.int16)
+
+    dims = ('latitude', 'longitude')
+    pv_band, npv_band, bs_band = [result[:, index].reshape(shape) for index in range(3)]
+    return xr.Dataset(
+        OrderedDict([('bs', (dims, bs_band)), ('pv', (dims, pv_band)), ('npv', (dims, npv_band))]),
+        coords={'latitude': dataset_in.latitude.values,
+                'longitude': dataset_in.longitude.values})
+
+
+def _get_fingerprint(dataset_in, clean_mask, no_data):
+    """Hash the composite values, clean mask, and extent that a fractional cover result depends on"""
+    fingerprint = hashlib.sha1()
+    for band in FRACTIONAL_COVER_BANDS:
+        fingerprint.update(np.ascontiguousarray(dataset_in[band].values).tobytes())
+    if clean_mask is not None:
+        fingerprint.update(np.packbits(np.asarray(clean_mask, dtype=bool)).tobytes())
+    for coordinate in ('latitude', 'longitude'):
+        fingerprint.update(dataset_in[coordinate].values.tobytes())
+    fingerprint.update(str(no_data).encode('utf-8'))
+    return fingerprint.hexdigest()
+
+
+def get_fractional_cover(dataset_in, clean_mask=None, no_data=-9999):
+    """Get the fractional cover of a composite, only unmixing composites that haven't been unmixed before
+
+    Results are cached by a fingerprint of the composite itself in the shared derived layer directory, so the
+    same composite unmixed by fractional_cover and spectral_anomaly - or by repeated requests - is only solved once.
+    See frac_coverage_classify for parameters.
+    """
+    layer_dir = os.path.join(get_derived_layer_dir(), 'fractional_cover')
+    os.makedirs(layer_dir, exist_ok=True)
+    path = os.path.join(layer_dir,
+                        get_cache_key(
+                            version=DERIVED_LAYER_VERSIONS['fractional_cover'],
+                            fingerprint=_get_fingerprint(dataset_in, clean_mask, no_data)))
+    cached = load_cached_product(path)
+    if cached is not None:
+        return cached[0]
+    fractional_cover = frac_coverage_classify(dataset_in, clean_mask=clean_mask, no_data=no_data)
+    store_cached_product(path, fractional_cover)
+    return fractional_cover
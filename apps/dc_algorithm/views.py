@@ -29,9 +29,8 @@ from django.apps import apps
 
 from apps.dc_algorithm.forms import DataSelectionForm
 from .models import Application, Satellite, Area
-from apps.dc_algorithm.tasks import task_clean_up
+from apps.dc_algorithm.tasks import cancel_task
 
-import time
 
 class ToolClass:
     """Base class for all Tool related classes
@@ -729,12 +728,10 @@ class SubmitNewSubsetRequest(View, ToolClass):
         updated_task = self._get_task_model_update_func()(requested_task, **request.POST)
         updated_task.pk = None
         updated_task_data = {field: getattr(updated_task, field) for field in task_model._meta.unique_together[0]}
-        try:
-            updated_task = task_model.objects.get(**updated_task_data)
-        except task_model.DoesNotExist:
-            updated_task = task_model(**updated_task_data)
-            updated_task.save()
-            #only run if this is a new task
+        updated_task, new_task = task_model.get_or_create_query(
+            updated_task_data, pixel_drill=updated_task.pixel_drill_task)
+        #only run if this is a new task
+        if new_task:
             self._get_celery_task_func().delay(task_id=updated_task.pk)
 
         user_id = request.user.id
@@ -816,11 +813,14 @@ class CancelRequest(View, ToolClass):
         task_model = self._get_tool_model(task_model_name)
         task = task_model.objects.get(pk=task_id)
 
+        # Equivalent submissions share a task - only stop it once nobody else is waiting on it.
+        if history_model.objects.filter(task_id=task_id).exists():
+            return JsonResponse({'status': "OK"})
+
         # Mark the task as cancelled so it can know to stop if it is running.
         task.update_status('CANCELLED', 'The task has been cancelled.')
 
-        # Clean up asynchronously.
-        time.sleep(10) # Wait a few seconds for the task to stop.
-        task_clean_up.s(task_id=task_id, task_model=task_model_name).apply_async()
+        # Revoke queued work and clean up asynchronously once running chunks have stopped.
+        cancel_task.s(task_id=task_id, task_model=task_model_name).apply_async()
 
         return JsonResponse({'status': "OK"})
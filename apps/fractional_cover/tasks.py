@@ -10,18 +10,23 @@ import stringcase
 
 from utils.data_cube_utilities.data_access_api import DataAccessApi
 from utils.data_cube_utilities.dc_utilities import (create_cfmask_clean_mask, create_bit_mask, write_geotiff_from_xr,
-                                                    write_png_from_xr, write_single_band_png_from_xr,
-                                                    add_timestamp_data_to_xr, clear_attrs)
+                                                    write_png_from_xr, add_timestamp_data_to_xr, clear_attrs)
 from utils.data_cube_utilities.dc_chunker import (create_geographic_chunks, create_time_chunks,
                                                   combine_geographic_chunks)
-from utils.data_cube_utilities.dc_fractional_coverage_classifier import frac_coverage_classify
 from utils.data_cube_utilities.dc_water_classifier import wofs_classify
 from apps.dc_algorithm.utils import create_2d_plot
+from apps.dc_algorithm.data_access import (search_datasets, select_datasets, group_datasets_by_geographic_chunk,
+                                           get_acquisition_dates, load_datasets, stack_fits_in_memory,
+                                           create_storage_aligned_chunks)
+from apps.dc_algorithm.compositors import finalize_median_sketch
+from apps.dc_algorithm.unmixing import frac_coverage_classify, get_fractional_cover
 from utils.data_cube_utilities.import_export import export_xarray_to_netcdf
+from apps.dc_algorithm.chunk_transport import store_chunk, open_chunk
 
 from .models import FractionalCoverTask
 from apps.dc_algorithm.models import Satellite
 from apps.dc_algorithm.tasks import DCAlgorithmBase, check_cancel_task, task_clean_up
+from apps.dc_algorithm.pipelines import record_pipeline
 
 logger = get_task_logger(__name__)
 
@@ -117,7 +122,7 @@ def parse_parameters_from_task(self, task_id=None):
         'time': (task.time_start, task.time_end),
         'longitude': (task.longitude_min, task.longitude_max),
         'latitude': (task.latitude_min, task.latitude_max),
-        'measurements': task.satellite.get_measurements()
+        'measurements': task.get_measurements()
     }
 
     task.execution_start = datetime.now()
@@ -144,17 +149,20 @@ def validate_parameters(self, parameters, task_id=None):
 
     dc = DataAccessApi(config=task.config_path)
 
+    # the only index search for this task - the datasets are passed down to the chunk processing tasks.
+    datasets = search_datasets(dc, **parameters)
+
     #validate for any number of criteria here - num acquisitions, etc.
-    acquisitions = dc.list_combined_acquisition_dates(**parameters)
+    acquisitions = get_acquisition_dates(datasets)
 
     if len(acquisitions) < 1:
         task.complete = True
         task.update_status("ERROR", "There are no acquistions for this parameter set.")
         return None
 
-    if not task.compositor.is_iterative() and (task.time_end - task.time_start).days > 367:
+    if not task.compositor.supports_time_chunking() and (task.time_end - task.time_start).days > 367:
         task.complete = True
-        task.update_status("ERROR", "Median pixel operations are only supported for single year time periods.")
+        task.update_status("ERROR", "Geomedian and medoid operations are only supported for single year time periods.")
         return None
 
     if check_cancel_task(self, task): return
@@ -169,7 +177,7 @@ def validate_parameters(self, parameters, task_id=None):
         return None
 
     dc.close()
-    return parameters
+    return {**parameters, 'datasets': datasets}
 
 
 @task(name="fractional_cover.perform_task_chunking", base=BaseTask, bind=True)
@@ -183,7 +191,7 @@ def perform_task_chunking(self, parameters, task_id=None):
         parameters: parameter stream containing all kwargs to load data
 
     Returns:
-        parameters with a list of geographic and time ranges
+        parameters with a list of geographic and time ranges and the datasets in each geographic chunk
     """
     if parameters is None:
         return None
@@ -191,11 +199,12 @@ def perform_task_chunking(self, parameters, task_id=None):
     task = FractionalCoverTask.objects.get(pk=task_id)
     if check_cancel_task(self, task): return
 
-    dc = DataAccessApi(config=task.config_path)
-    dates = dc.list_combined_acquisition_dates(**parameters)
+    datasets = parameters.pop('datasets')
+    dates = get_acquisition_dates(datasets)
     task_chunk_sizing = task.get_chunk_size()
 
-    geographic_chunks = create_geographic_chunks(
+    geographic_chunks = create_storage_aligned_chunks(
+        datasets,
         longitude=parameters['longitude'],
         latitude=parameters['latitude'],
         geographic_chunk_size=task_chunk_sizing['geographic'])
@@ -204,10 +213,14 @@ def perform_task_chunking(self, parameters, task_id=None):
         dates, _reversed=task.get_reverse_time(), time_chunk_size=task_chunk_sizing['time'])
     logger.info("Time chunks: {}, Geo chunks: {}".format(len(time_chunks), len(geographic_chunks)))
 
-    dc.close()
     if check_cancel_task(self, task): return
     task.update_status("WAIT", "Chunked parameter set.")
-    return {'parameters': parameters, 'geographic_chunks': geographic_chunks, 'time_chunks': time_chunks}
+    return {
+        'parameters': parameters,
+        'geographic_chunks': geographic_chunks,
+        'time_chunks': time_chunks,
+        'geographic_chunk_datasets': group_datasets_by_geographic_chunk(datasets, geographic_chunks)
+    }
 
 
 @task(name="fractional_cover.start_chunk_processing", base=BaseTask, bind=True)
@@ -227,20 +240,21 @@ def start_chunk_processing(self, chunk_details, task_id=None):
     parameters = chunk_details.get('parameters')
     geographic_chunks = chunk_details.get('geographic_chunks')
     time_chunks = chunk_details.get('time_chunks')
+    geographic_chunk_datasets = chunk_details.get('geographic_chunk_datasets')
 
     task = FractionalCoverTask.objects.get(pk=task_id)
 
     # Get an estimate of the amount of work to be done: the number of scenes
     # to process, also considering intermediate chunks to be combined.
     num_scenes = len(geographic_chunks) * sum([len(time_chunk) for time_chunk in time_chunks])
-    # recombine_time_chunks() and process_band_math() scenes:
+    # recombine_time_chunks() scenes:
     # num_scn_per_chk * len(time_chunks) * len(geographic_chunks)
     num_scn_per_chk = round(num_scenes / (len(time_chunks) * len(geographic_chunks)))
     # recombine_geographic_chunks() and create_output_products() scenes:
     # num_scn_per_chk_geo * len(geographic_chunks)
     num_scn_per_chk_geo = round(num_scenes / len(geographic_chunks))
-    # Scene processing progress is tracked in: processing_task(), recombine_time_chunks(),
-    # and process_band_math(). Scenes in process_band_math() are counted twice
+    # Scene processing progress is tracked in: processing_task() and recombine_time_chunks(),
+    # which counts the scenes of each chunk once for recombining and twice for the band math
     # for the sake of tracking progress because it takes so long to run. So 1 + 1 + 2 = 4.
     task.total_scenes = 4 * num_scenes
     task.scenes_processed = 0
@@ -259,13 +273,15 @@ def start_chunk_processing(self, chunk_details, task_id=None):
                 time_chunk_id=time_index,
                 geographic_chunk=geographic_chunk,
                 time_chunk=time_chunk,
+                datasets=select_datasets(geographic_chunk_datasets[geo_index], time=time_chunk),
                 **parameters) for time_index, time_chunk in enumerate(time_chunks)
-        ]) | recombine_time_chunks.s(task_id=task_id, num_scn_per_chk=num_scn_per_chk)
-           | process_band_math.s(task_id=task_id, num_scn_per_chk=2*num_scn_per_chk_geo)
+        ]) | recombine_time_chunks.s(
+            task_id=task_id, num_scn_per_chk=num_scn_per_chk, num_scn_per_chk_geo=num_scn_per_chk_geo)
         for geo_index, geographic_chunk in enumerate(geographic_chunks)
     ]) | recombine_geographic_chunks.s(task_id=task_id)
        | create_output_products.s(task_id=task_id)
        | task_clean_up.si(task_id=task_id, task_model='FractionalCoverTask')).apply_async()
+    record_pipeline(task_id, processing_pipeline)
 
     return True
 
@@ -277,6 +293,7 @@ def processing_task(self,
                     time_chunk_id=None,
                     geographic_chunk=None,
                     time_chunk=None,
+                    datasets=None,
                     **parameters):
     """Process a parameter set and save the results to disk.
 
@@ -289,6 +306,7 @@ def processing_task(self,
         task_id, geo_chunk_id, time_chunk_id: identification for the main task and what chunk this is processing
         geographic_chunk: range of latitude and longitude to load - dict with keys latitude, longitude
         time_chunk: list of acquisition dates
+        datasets: list of datasets resolved by the planner that intersect this chunk
         parameters: all required kwargs to load data.
 
     Returns:
@@ -308,16 +326,19 @@ def processing_task(self,
     def _get_datetime_range_containing(*time_ranges):
         return (min(time_ranges) - timedelta(microseconds=1), max(time_ranges) + timedelta(microseconds=1))
 
+    # iterative compositors are applied to the full time chunk at once if it fits in memory.
+    iterative = task.get_iterative() and not stack_fits_in_memory(
+        datasets, measurements=parameters['measurements'], **geographic_chunk)
     times = list(
         map(_get_datetime_range_containing, time_chunk)
-        if task.get_iterative() else [_get_datetime_range_containing(time_chunk[0], time_chunk[-1])])
+        if iterative else [_get_datetime_range_containing(time_chunk[0], time_chunk[-1])])
     dc = DataAccessApi(config=task.config_path)
     updated_params = parameters
     updated_params.update(geographic_chunk)
     iteration_data = None
     for time_index, time in enumerate(times):
         updated_params.update({'time': time})
-        data = dc.get_stacked_datasets_by_extent(**updated_params)
+        data = load_datasets(dc, select_datasets(datasets, time=time), **updated_params)
 
         if check_cancel_task(self, task): return
 
@@ -325,7 +346,7 @@ def processing_task(self,
             logger.info("Invalid chunk.")
             continue
 
-        clear_mask = task.satellite.get_clean_mask_func()(data)
+        clear_mask = task.satellite.get_clean_mask_func(packed=True)(data)
         add_timestamp_data_to_xr(data)
 
         metadata = task.metadata_from_dataset(metadata, data, clear_mask, updated_params)
@@ -337,30 +358,31 @@ def processing_task(self,
                                                       reverse_time=task.get_reverse_time())
 
         if check_cancel_task(self, task): return
-        task.scenes_processed = F('scenes_processed') + 1
+        task.scenes_processed = F('scenes_processed') + (1 if iterative else len(time_chunk))
         # Avoid overwriting the task's status if it is cancelled.
         task.save(update_fields=['scenes_processed'])
     if iteration_data is None:
         return None
 
     path = os.path.join(task.get_temp_path(), chunk_id + ".nc")
-    export_xarray_to_netcdf(iteration_data, path)
+    store_chunk(task.apply_dtype_policy(iteration_data), path)
     dc.close()
     logger.info("Done with chunk: " + chunk_id)
     return path, metadata, {'geo_chunk_id': geo_chunk_id, 'time_chunk_id': time_chunk_id}
 
 
 @task(name="fractional_cover.recombine_time_chunks", base=BaseTask, bind=True)
-def recombine_time_chunks(self, chunks, task_id=None, num_scn_per_chk=None):
+def recombine_time_chunks(self, chunks, task_id=None, num_scn_per_chk=None, num_scn_per_chk_geo=None):
     """Recombine processed chunks over the time index.
 
     Open time chunked processed datasets and recombine them using the same function
     that was used to process them. This assumes an iterative algorithm - if it is not, then it will
-    simply return the data again.
+    simply return the data again. The fractional cover band math is applied to the recombined data before it is written.
 
     Args:
         chunks: list of the return from the processing_task function - path, metadata, and {chunk ids}
         num_scn_per_chk: The number of scenes per chunk. Used to determine task progress.
+        num_scn_per_chk_geo: The number of scenes per geographic chunk. Used to determine task progress.
 
     Returns:
         path to the output product, metadata dict, and a dict containing the geo/time ids
@@ -381,7 +403,7 @@ def recombine_time_chunks(self, chunks, task_id=None, num_scn_per_chk=None):
     combined_data = None
     for index, chunk in enumerate(total_chunks):
         metadata.update(chunk[1])
-        data = xr.open_dataset(chunk[0])
+        data = open_chunk(chunk[0])
         if combined_data is None:
             combined_data = data
             task.scenes_processed = F('scenes_processed') + num_scn_per_chk
@@ -403,46 +425,26 @@ def recombine_time_chunks(self, chunks, task_id=None, num_scn_per_chk=None):
     if combined_data is None:
         return None
 
+    # median sketches are only finalized once all of the time chunks have been merged.
+    combined_data = finalize_median_sketch(combined_data, no_data=task.satellite.no_data_value)
+    # band math is applied in memory so each chunk is only written once.
+    combined_data = _apply_band_math(task, combined_data)
     path = os.path.join(task.get_temp_path(), "recombined_time_{}.nc".format(geo_chunk_id))
-    export_xarray_to_netcdf(combined_data, path)
+    store_chunk(task.apply_dtype_policy(combined_data), path)
+    task.scenes_processed = F('scenes_processed') + 2 * num_scn_per_chk_geo
+    task.save(update_fields=['scenes_processed'])
     logger.info("Done combining time chunks for geo: " + str(geo_chunk_id))
     return path, metadata, {'geo_chunk_id': geo_chunk_id, 'time_chunk_id': time_chunk_id}
 
 
-@task(name="fractional_cover.process_band_math", base=BaseTask, bind=True)
-def process_band_math(self, chunk, task_id=None, num_scn_per_chk=None):
-    """Apply some band math to a chunk and return the args
-
-    Opens the chunk dataset and applys some band math defined by _apply_band_math(dataset)
-    _apply_band_math creates some product using the bands already present in the dataset and
-    returns the dataarray. The data array is then appended under 'band_math', then saves the
-    result to disk in the same path as the nc file already exists.
-
-    Args:
-        chunk: The return from the recombine_time_chunks function - path, metadata, and {chunk ids}
-        num_scn_per_chk: The number of scenes per chunk. Used to determine task progress.
-    """
-    task = FractionalCoverTask.objects.get(pk=task_id)
-    if check_cancel_task(self, task): return
-
-    def _apply_band_math(dataset):
-        clear_mask = task.satellite.get_clean_mask_func()(dataset)
-        # mask out water manually. Necessary for frac. cover.
-        wofs = wofs_classify(dataset, clean_mask=clear_mask, mosaic=True)
-        clear_mask[wofs.wofs.values == 1] = False
-        return frac_coverage_classify(dataset, clean_mask=clear_mask, no_data=task.satellite.no_data_value)
-
-    if chunk is None:
-        return None
-
-    dataset = xr.open_dataset(chunk[0]).load()
-    dataset = xr.merge([dataset, _apply_band_math(dataset)])
-    #remove previous nc and write band math to disk
-    os.remove(chunk[0])
-    export_xarray_to_netcdf(dataset, chunk[0])
-    task.scenes_processed = F('scenes_processed') + num_scn_per_chk
-    task.save(update_fields=['scenes_processed'])
-    return chunk
+def _apply_band_math(task, dataset):
+    """Add the fractional cover bands to a recombined chunk"""
+    clear_mask = task.satellite.get_clean_mask_func()(dataset)
+    # mask out water manually. Necessary for frac. cover.
+    wofs = wofs_classify(dataset, clean_mask=clear_mask, mosaic=True)
+    clear_mask[wofs.wofs.values == 1] = False
+    return xr.merge(
+        [dataset, get_fractional_cover(dataset, clean_mask=clear_mask, no_data=task.satellite.no_data_value)])
 
 
 @task(name="fractional_cover.recombine_geographic_chunks", base=BaseTask, bind=True)
@@ -472,12 +474,12 @@ def recombine_geographic_chunks(self, chunks, task_id=None):
     chunk_data = []
     for index, chunk in enumerate(total_chunks):
         metadata = task.combine_metadata(metadata, chunk[1])
-        current_chunk_data = xr.open_dataset(chunk[0])
+        current_chunk_data = open_chunk(chunk[0])
         chunk_data.append(current_chunk_data)
     combined_data = combine_geographic_chunks(chunk_data)
 
     path = os.path.join(task.get_temp_path(), "recombined_geo_{}.nc".format(time_chunk_id))
-    export_xarray_to_netcdf(combined_data, path)
+    store_chunk(combined_data, path)
     logger.info("Done combining geographic chunks for time: " + str(time_chunk_id))
     return path, metadata, {'geo_chunk_id': geo_chunk_id, 'time_chunk_id': time_chunk_id}
 
@@ -497,7 +499,7 @@ def create_output_products(self, data, task_id=None):
     if check_cancel_task(self, task): return
 
     full_metadata = data[1]
-    dataset = xr.open_dataset(data[0])
+    dataset = open_chunk(data[0])
 
     task.result_path = os.path.join(task.get_result_path(), "band_math.png")
     task.mosaic_path = os.path.join(task.get_result_path(), "png_mosaic.png")
@@ -506,7 +508,7 @@ def create_output_products(self, data, task_id=None):
     task.final_metadata_from_dataset(dataset)
     task.metadata_from_dict(full_metadata)
 
-    bands = task.satellite.get_measurements() + ['pv', 'npv', 'bs']
+    bands = task.get_measurements() + ['pv', 'npv', 'bs']
 
     export_xarray_to_netcdf(dataset, task.data_netcdf_path)
     write_geotiff_from_xr(task.data_path, dataset.astype('int32'), bands=bands, no_data=task.satellite.no_data_value)
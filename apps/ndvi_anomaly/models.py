@@ -26,6 +26,7 @@ from apps.dc_algorithm.models import Area, Compositor, Satellite
 from apps.dc_algorithm.models import (Query as BaseQuery, Metadata as BaseMetadata, Result as BaseResult, ResultType as
                                       BaseResultType, UserHistory as BaseUserHistory, AnimationType as
                                       BaseAnimationType, ToolInfo as BaseToolInfo)
+from apps.dc_algorithm.masking import count_clear
 from utils.data_cube_utilities.dc_mosaic import create_median_mosaic
 
 import numpy as np
@@ -57,6 +58,10 @@ class Query(BaseQuery):
     baseline_selection = models.CharField(max_length=100, default="1,2,3,4,5,6,7,8,9,10,11,12")
 
     base_result_dir = '/datacube/ui_results/ndvi_anomaly'
+    # the baseline is selected from the years before time_start, so the time range is part of the fingerprint.
+    fingerprint_acquisitions = False
+    # percentage change is a ratio against the baseline NDVI, which loses precision in float32 as it approaches 0.
+    processing_dtype = 'float64'
     color_scales = {
         'baseline_ndvi':
         '/home/' + settings.LOCAL_USER + '/Datacube/data_cube_ui/utils/color_scales/ndvi',
@@ -89,7 +94,7 @@ class Query(BaseQuery):
 
         See the base query class docstring for more information.
         """
-        return {'time': None, 'geographic': 0.01}
+        return {'time': None, 'geographic': 0.1}
 
     def get_iterative(self):
         """implements get_iterative as required by the base class
@@ -112,6 +117,13 @@ class Query(BaseQuery):
         """
         return create_median_mosaic
 
+    def get_required_measurements(self):
+        """implements get_required_measurements as required by the base class
+
+        See the base query class docstring for more information.
+        """
+        return ['red', 'nir'] + self.get_png_measurements()
+
     @classmethod
     def get_or_create_query_from_post(cls, form_data, pixel_drill=False):
         """Implements the get_or_create_query_from_post func required by base class
@@ -134,13 +146,7 @@ class Query(BaseQuery):
         valid_query_fields = [field.name for field in cls._meta.get_fields()]
         query_data = {key: query_data[key] for key in valid_query_fields if key in query_data}
 
-        try:
-            query = cls.objects.get(pixel_drill_task=pixel_drill, **query_data)
-            return query, False
-        except cls.DoesNotExist:
-            query = cls(pixel_drill_task=pixel_drill, **query_data)
-            query.save()
-            return query, True
+        return cls.get_or_create_query(query_data, pixel_drill=pixel_drill)
 
 
 class Metadata(BaseMetadata):
@@ -165,7 +171,7 @@ class Metadata(BaseMetadata):
         See the base metadata class docstring for more information.
         """
         for metadata_index, time in enumerate(dataset.time.values.astype('M8[ms]').tolist()):
-            clean_pixels = np.sum(clear_mask[metadata_index, :, :] == True)
+            clean_pixels = count_clear(clear_mask, metadata_index)
             if time not in metadata:
                 metadata[time] = {}
                 metadata[time]['clean_pixels'] = 0
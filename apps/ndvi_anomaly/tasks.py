@@ -5,21 +5,28 @@ from celery import chain, group, chord
 from celery.utils.log import get_task_logger
 from datetime import datetime, timedelta
 import xarray as xr
+import numpy as np
 import os
 
 from utils.data_cube_utilities.data_access_api import DataAccessApi
 from utils.data_cube_utilities.dc_utilities import (create_cfmask_clean_mask, create_bit_mask, write_geotiff_from_xr,
-                                                    write_png_from_xr, write_single_band_png_from_xr,
-                                                    add_timestamp_data_to_xr, clear_attrs)
+                                                    write_png_from_xr, add_timestamp_data_to_xr, clear_attrs)
 from utils.data_cube_utilities.dc_chunker import (create_geographic_chunks, group_datetimes_by_month,
                                                   combine_geographic_chunks)
-from utils.data_cube_utilities.dc_ndvi_anomaly import compute_ndvi_anomaly
 from apps.dc_algorithm.utils import create_2d_plot
+from apps.dc_algorithm.colorize import write_single_band_png
+from apps.dc_algorithm.baseline import accumulate_baseline_ndvi, get_mean_ndvi, BASELINE_VERSION
+from apps.dc_algorithm.data_access import (search_datasets, select_datasets, group_datasets_by_geographic_chunk,
+                                           get_acquisition_dates, load_datasets, get_dataset_time,
+                                           create_storage_aligned_chunks)
+from apps.dc_algorithm.product_cache import load_cached_product, store_cached_product, get_dataset_ids
 from utils.data_cube_utilities.import_export import export_xarray_to_netcdf
+from apps.dc_algorithm.chunk_transport import store_chunk, open_chunk
 
 from .models import NdviAnomalyTask
 from apps.dc_algorithm.models import Satellite
 from apps.dc_algorithm.tasks import DCAlgorithmBase, check_cancel_task, task_clean_up
+from apps.dc_algorithm.pipelines import record_pipeline
 
 logger = get_task_logger(__name__)
 
@@ -61,7 +68,7 @@ def parse_parameters_from_task(self, task_id=None):
         'time': (task.time_start, task.time_end),
         'longitude': (task.longitude_min, task.longitude_max),
         'latitude': (task.latitude_min, task.latitude_max),
-        'measurements': task.satellite.get_measurements()
+        'measurements': task.get_measurements()
     }
 
     task.execution_start = datetime.now()
@@ -88,7 +95,10 @@ def validate_parameters(self, parameters, task_id=None):
 
     dc = DataAccessApi(config=task.config_path)
 
-    acquisitions = dc.list_acquisition_dates(**parameters)
+    # the only index search for this task - covers both the selected scene and all possible baseline scenes.
+    # the datasets are passed down to the chunk processing tasks.
+    datasets = search_datasets(dc, **{**parameters, 'time': (datetime(1000, 1, 1), task.time_end)})
+    acquisitions = get_acquisition_dates(datasets, time=parameters['time'])
 
     if len(acquisitions) < 1:
         task.complete = True
@@ -96,12 +106,9 @@ def validate_parameters(self, parameters, task_id=None):
         return None
 
     # the actual acquisitino exists, lets try the baseline:
-    validation_params = {**parameters}
-    # there were no acquisitions in the year 1000, hopefully
-    validation_params.update({
-        'time': (task.time_start.replace(year=task.time_start.year - 5), task.time_start - timedelta(microseconds=1))
-    })
-    acquisitions = dc.list_acquisition_dates(**validation_params)
+    acquisitions = get_acquisition_dates(
+        datasets,
+        time=(task.time_start.replace(year=task.time_start.year - 5), task.time_start - timedelta(microseconds=1)))
 
     # list/map/int chain required to cast int to each baseline month, it won't work if they're strings.
     grouped_dates = group_datetimes_by_month(acquisitions, months=list(map(int, task.baseline_selection.split(","))))
@@ -124,7 +131,7 @@ def validate_parameters(self, parameters, task_id=None):
         return None
 
     dc.close()
-    return parameters
+    return {**parameters, 'datasets': datasets}
 
 
 @task(name="ndvi_anomaly.perform_task_chunking", base=BaseTask, bind=True)
@@ -138,7 +145,7 @@ def perform_task_chunking(self, parameters, task_id=None):
         parameters: parameter stream containing all kwargs to load data
 
     Returns:
-        parameters with a list of geographic and time ranges
+        parameters with a list of geographic and time ranges and the datasets in each geographic chunk
     """
     if parameters is None:
         return None
@@ -146,17 +153,18 @@ def perform_task_chunking(self, parameters, task_id=None):
     task = NdviAnomalyTask.objects.get(pk=task_id)
     if check_cancel_task(self, task): return
 
-    dc = DataAccessApi(config=task.config_path)
+    datasets = parameters.pop('datasets')
     task_chunk_sizing = task.get_chunk_size()
 
-    geographic_chunks = create_geographic_chunks(
+    geographic_chunks = create_storage_aligned_chunks(
+        datasets,
         longitude=parameters['longitude'],
         latitude=parameters['latitude'],
         geographic_chunk_size=task_chunk_sizing['geographic'])
 
-    grouped_dates_params = {**parameters}
-    grouped_dates_params.update({'time': (datetime(1000, 1, 1), task.time_start - timedelta(microseconds=1))})
-    acquisitions = dc.list_acquisition_dates(**grouped_dates_params)
+    # there were no acquisitions in the year 1000, hopefully
+    acquisitions = get_acquisition_dates(
+        datasets, time=(datetime(1000, 1, 1), task.time_start - timedelta(microseconds=1)))
     grouped_dates = group_datetimes_by_month(acquisitions, months=list(map(int, task.baseline_selection.split(","))))
     # create a single monolithic list of all acq. dates - there should be only one.
     time_chunks = []
@@ -167,10 +175,14 @@ def perform_task_chunking(self, parameters, task_id=None):
 
     logger.info("Time chunks: {}, Geo chunks: {}".format(len(time_chunks), len(geographic_chunks)))
 
-    dc.close()
     if check_cancel_task(self, task): return
     task.update_status("WAIT", "Chunked parameter set.")
-    return {'parameters': parameters, 'geographic_chunks': geographic_chunks, 'time_chunks': time_chunks}
+    return {
+        'parameters': parameters,
+        'geographic_chunks': geographic_chunks,
+        'time_chunks': time_chunks,
+        'geographic_chunk_datasets': group_datasets_by_geographic_chunk(datasets, geographic_chunks)
+    }
 
 
 @task(name="ndvi_anomaly.start_chunk_processing", base=BaseTask, bind=True)
@@ -190,6 +202,7 @@ def start_chunk_processing(self, chunk_details, task_id=None):
     parameters = chunk_details.get('parameters')
     geographic_chunks = chunk_details.get('geographic_chunks')
     time_chunks = chunk_details.get('time_chunks')
+    geographic_chunk_datasets = chunk_details.get('geographic_chunk_datasets')
 
     assert len(time_chunks) == 1, "There should only be one time chunk for NDVI anomaly operations."
 
@@ -211,10 +224,12 @@ def start_chunk_processing(self, chunk_details, task_id=None):
                 time_chunk_id=time_index,
                 geographic_chunk=geographic_chunk,
                 time_chunk=time_chunk,
+                datasets=geographic_chunk_datasets[geo_index],
                 **parameters) for time_index, time_chunk in enumerate(time_chunks)
         ]) for geo_index, geographic_chunk in enumerate(geographic_chunks)
     ]) | recombine_geographic_chunks.s(task_id=task_id) | create_output_products.s(task_id=task_id) \
        | task_clean_up.si(task_id=task_id, task_model='NdviAnomalyTask')).apply_async()
+    record_pipeline(task_id, processing_pipeline)
 
     return True
 
@@ -226,6 +241,7 @@ def processing_task(self,
                     time_chunk_id=None,
                     geographic_chunk=None,
                     time_chunk=None,
+                    datasets=None,
                     **parameters):
     """Process a parameter set and save the results to disk.
 
@@ -238,6 +254,7 @@ def processing_task(self,
         task_id, geo_chunk_id, time_chunk_id: identification for the main task and what chunk this is processing
         geographic_chunk: range of latitude and longitude to load - dict with keys latitude, longitude
         time_chunk: list of acquisition dates
+        datasets: list of datasets resolved by the planner that intersect this chunk - baseline and selected scene
         parameters: all required kwargs to load data.
 
     Returns:
@@ -262,33 +279,54 @@ def processing_task(self,
     updated_params = parameters
     updated_params.update(geographic_chunk)
 
-    # Generate the baseline data - one time slice at a time
-    full_dataset = []
-    for time_index, time in enumerate(time_chunk):
-        updated_params.update({'time': _get_datetime_range_containing(time)})
-        data = dc.get_dataset_by_extent(**updated_params)
-
-        if check_cancel_task(self, task): return
-
-        if data is None or 'time' not in data:
-            logger.info("Invalid chunk.")
-            continue
-        full_dataset.append(data.copy(deep=True))
+    # Baselines only depend on the baseline scenes, so they are shared by every task over the same chunk.
+    baseline_times = set(time_chunk)
+    baseline_cache_path = task.get_cache_path(
+        'baseline',
+        version=BASELINE_VERSION,
+        area_id=task.area_id,
+        product=parameters['product'],
+        measurements=parameters['measurements'],
+        geographic_chunk=geographic_chunk,
+        datasets=get_dataset_ids([dataset for dataset in datasets if get_dataset_time(dataset) in baseline_times]))
+    cached_baseline = load_cached_product(baseline_cache_path)
+    if cached_baseline is not None:
+        baseline, metadata = cached_baseline
+        task.scenes_processed = F('scenes_processed') + len(time_chunk)
+        task.save(update_fields=['scenes_processed'])
+    else:
+        # Accumulate the baseline NDVI one time slice at a time - only the running sum and count are kept.
+        baseline = None
+        for time_index, time in enumerate(time_chunk):
+            updated_params.update({'time': _get_datetime_range_containing(time)})
+            data = load_datasets(dc, select_datasets(datasets, time=updated_params['time']), **updated_params)
+
+            if check_cancel_task(self, task): return
+
+            if data is None or 'time' not in data:
+                logger.info("Invalid chunk.")
+                continue
+
+            clear_mask = task.satellite.get_clean_mask_func(packed=True)(data)
+            metadata = task.metadata_from_dataset(metadata, data, clear_mask, parameters)
+            baseline = accumulate_baseline_ndvi(
+                data, clean_mask=clear_mask, intermediate_product=baseline, no_data=task.satellite.no_data_value)
+
+            task.scenes_processed = F('scenes_processed') + 1
+            task.save(update_fields=['scenes_processed'])
+
+        if baseline is not None:
+            store_cached_product(baseline_cache_path, baseline, metadata)
 
     # load selected scene and mosaic just in case we got two scenes (handles scene boundaries/overlapping data)
     updated_params.update({'time': base_scene_time_range})
-    selected_scene = dc.get_dataset_by_extent(**updated_params)
+    selected_scene = load_datasets(dc, select_datasets(datasets, time=base_scene_time_range), **updated_params)
 
     if check_cancel_task(self, task): return
 
-    if len(full_dataset) == 0 or 'time' not in selected_scene:
+    if baseline is None or 'time' not in selected_scene:
         return None
 
-    #concat individual slices over time, compute metadata + mosaic
-    baseline_data = xr.concat(full_dataset, 'time')
-    baseline_clear_mask = task.satellite.get_clean_mask_func()(baseline_data)
-    metadata = task.metadata_from_dataset(metadata, baseline_data, baseline_clear_mask, parameters)
-
     selected_scene_clear_mask = task.satellite.get_clean_mask_func()(selected_scene)
     metadata = task.metadata_from_dataset(metadata, selected_scene, selected_scene_clear_mask, parameters)
     selected_scene = task.get_processing_method()(selected_scene,
@@ -300,19 +338,26 @@ def processing_task(self,
 
     if check_cancel_task(self, task): return
 
-    ndvi_products = compute_ndvi_anomaly(
-        baseline_data,
-        selected_scene,
-        baseline_clear_mask=baseline_clear_mask,
-        selected_scene_clear_mask=selected_scene_clear_mask,
-        no_data=task.satellite.no_data_value)
+    # the baseline is only kept as a running sum, so the anomaly is taken against its mean NDVI directly.
+    no_data = task.satellite.no_data_value
+    scene_valid = (selected_scene.red != no_data) & (selected_scene.nir != no_data) & selected_scene_clear_mask
+    red, nir = selected_scene.red.astype(np.float64), selected_scene.nir.astype(np.float64)
+    scene_ndvi = ((nir - red) / (nir + red)).where(scene_valid)
+    if 'time' in scene_ndvi.dims:
+        scene_ndvi = scene_ndvi.mean('time')
+    baseline_ndvi = get_mean_ndvi(baseline)
+    ndvi_products = xr.Dataset({
+        'scene_ndvi': scene_ndvi,
+        'baseline_ndvi': baseline_ndvi,
+        'ndvi_difference': scene_ndvi - baseline_ndvi,
+        'ndvi_percentage_change': (scene_ndvi - baseline_ndvi) / baseline_ndvi
+    })
+    for name in ndvi_products.data_vars:
+        ndvi_products[name] = ndvi_products[name].where(np.isfinite(ndvi_products[name]), no_data)
     full_product = xr.merge([ndvi_products, selected_scene])
 
-    task.scenes_processed = F('scenes_processed') + 1
-    task.save(update_fields=['scenes_processed'])
-
     path = os.path.join(task.get_temp_path(), chunk_id + ".nc")
-    export_xarray_to_netcdf(full_product, path)
+    store_chunk(task.apply_dtype_policy(full_product), path)
     dc.close()
     logger.info("Done with chunk: " + chunk_id)
     return path, metadata, {'geo_chunk_id': geo_chunk_id, 'time_chunk_id': time_chunk_id}
@@ -345,11 +390,11 @@ def recombine_geographic_chunks(self, chunks, task_id=None):
     chunk_data = []
     for index, chunk in enumerate(total_chunks):
         metadata = task.combine_metadata(metadata, chunk[1])
-        chunk_data.append(xr.open_dataset(chunk[0]))
+        chunk_data.append(open_chunk(chunk[0]))
     combined_data = combine_geographic_chunks(chunk_data)
 
     path = os.path.join(task.get_temp_path(), "recombined_geo_{}.nc".format(time_chunk_id))
-    export_xarray_to_netcdf(combined_data, path)
+    store_chunk(combined_data, path)
     logger.info("Done combining geographic chunks for time: " + str(time_chunk_id))
     return path, metadata, {'geo_chunk_id': geo_chunk_id, 'time_chunk_id': time_chunk_id}
 
@@ -369,7 +414,7 @@ def create_output_products(self, data, task_id=None):
     if check_cancel_task(self, task): return
 
     full_metadata = data[1]
-    dataset = xr.open_dataset(data[0])
+    dataset = open_chunk(data[0])
 
     task.result_path = os.path.join(task.get_result_path(), "ndvi_difference.png")
     task.scene_ndvi_path = os.path.join(task.get_result_path(), "scene_ndvi.png")
@@ -381,31 +426,32 @@ def create_output_products(self, data, task_id=None):
     task.final_metadata_from_dataset(dataset)
     task.metadata_from_dict(full_metadata)
 
-    bands = task.satellite.get_measurements() + ['scene_ndvi', 'baseline_ndvi',
+    bands = task.get_measurements() + ['scene_ndvi', 'baseline_ndvi',
                                                  'ndvi_difference', 'ndvi_percentage_change']
 
     export_xarray_to_netcdf(dataset, task.data_netcdf_path)
 
-    write_geotiff_from_xr(task.data_path, dataset.astype('float64'), bands=bands, no_data=task.satellite.no_data_value)
-    write_single_band_png_from_xr(
+    write_geotiff_from_xr(
+        task.data_path, dataset.astype(task.processing_dtype), bands=bands, no_data=task.satellite.no_data_value)
+    write_single_band_png(
         task.result_path,
         dataset,
         'ndvi_difference',
         color_scale=task.color_scales['ndvi_difference'],
         no_data=task.satellite.no_data_value)
-    write_single_band_png_from_xr(
+    write_single_band_png(
         task.ndvi_percentage_change_path,
         dataset,
         'ndvi_percentage_change',
         color_scale=task.color_scales['ndvi_percentage_change'],
         no_data=task.satellite.no_data_value)
-    write_single_band_png_from_xr(
+    write_single_band_png(
         task.scene_ndvi_path,
         dataset,
         'scene_ndvi',
         color_scale=task.color_scales['scene_ndvi'],
         no_data=task.satellite.no_data_value)
-    write_single_band_png_from_xr(
+    write_single_band_png(
         task.baseline_ndvi_path,
         dataset,
         'baseline_ndvi',
@@ -25,6 +25,7 @@ from apps.dc_algorithm.models import Area, Compositor, Satellite
 from apps.dc_algorithm.models import (Query as BaseQuery, Metadata as BaseMetadata, Result as BaseResult, ResultType as
                                       BaseResultType, UserHistory as BaseUserHistory, AnimationType as
                                       BaseAnimationType, ToolInfo as BaseToolInfo)
+from apps.dc_algorithm.masking import count_clear
 from utils.data_cube_utilities.dc_mosaic import (create_mosaic, create_mean_mosaic)
 
 import numpy as np
@@ -110,6 +111,14 @@ class Query(BaseQuery):
 
         return processing_methods.get(self.baseline_method.id, create_mosaic)
 
+    def get_required_measurements(self):
+        """implements get_required_measurements as required by the base class
+
+        See the base query class docstring for more information.
+        """
+        # red and ndwi change are compared against the baseline.
+        return ['red', 'nir', 'swir1'] + self.get_png_measurements()
+
     @classmethod
     def get_or_create_query_from_post(cls, form_data, pixel_drill=False):
         """Implements the get_or_create_query_from_post func required by base class
@@ -132,13 +141,7 @@ class Query(BaseQuery):
         valid_query_fields = [field.name for field in cls._meta.get_fields()]
         query_data = {key: query_data[key] for key in valid_query_fields if key in query_data}
 
-        try:
-            query = cls.objects.get(pixel_drill_task=pixel_drill, **query_data)
-            return query, False
-        except cls.DoesNotExist:
-            query = cls(pixel_drill_task=pixel_drill, **query_data)
-            query.save()
-            return query, True
+        return cls.get_or_create_query(query_data, pixel_drill=pixel_drill)
 
 
 class Metadata(BaseMetadata):
@@ -163,7 +166,7 @@ class Metadata(BaseMetadata):
 
         See the base metadata class docstring for more information.
         """
-        clean_pixels = np.sum(clear_mask == True)
+        clean_pixels = count_clear(clear_mask)
         slip_slice = dataset.slip.values
         if time not in metadata:
             metadata[time] = {}
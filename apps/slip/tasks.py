@@ -12,14 +12,21 @@ from utils.data_cube_utilities.dc_utilities import (create_cfmask_clean_mask, cr
                                                     write_png_from_xr, add_timestamp_data_to_xr, clear_attrs)
 from utils.data_cube_utilities.dc_chunker import (create_geographic_chunks, generate_baseline,
                                                   combine_geographic_chunks)
-from utils.data_cube_utilities.dc_slip import compute_slip, mask_mosaic_with_slip
+from utils.data_cube_utilities.dc_slip import mask_mosaic_with_slip
 from utils.data_cube_utilities.dc_mosaic import create_mosaic
 from apps.dc_algorithm.utils import create_2d_plot
+from apps.dc_algorithm.data_access import (search_datasets, select_datasets, group_datasets_by_geographic_chunk,
+                                           get_acquisition_dates, load_datasets, create_storage_aligned_chunks)
+from apps.dc_algorithm.acquisition_catalog import list_acquisition_dates
+from apps.dc_algorithm.static_layers import get_static_layer
+from apps.dc_algorithm.slip import compute_slip_from_slope
 from utils.data_cube_utilities.import_export import export_xarray_to_netcdf
+from apps.dc_algorithm.chunk_transport import store_chunk, open_chunk
 
 from .models import SlipTask
 from apps.dc_algorithm.models import Satellite
 from apps.dc_algorithm.tasks import DCAlgorithmBase, check_cancel_task, task_clean_up
+from apps.dc_algorithm.pipelines import record_pipeline
 
 logger = get_task_logger(__name__)
 
@@ -31,9 +38,11 @@ class BaseTask(DCAlgorithmBase):
 @task(name="slip.get_acquisition_list")
 def get_acquisition_list(task, area_id, satellite, date):
     dc = DataAccessApi(config=task.config_path)
-    # lists all acquisition dates for use in single tmeslice queries.
+    # lists all acquisition dates up to the date for use in single tmeslice queries - served by the catalog
+    # rather than scanning the index.
     product = satellite.product_prefix + area_id
-    acquisitions = dc.list_acquisition_dates(product, satellite.datacube_platform, time=(datetime(1900, 1, 1), date))
+    acquisitions = [acquisition for acquisition in list_acquisition_dates(dc, product=product) if acquisition <= date]
+    dc.close()
     return acquisitions
 
 
@@ -70,7 +79,7 @@ def parse_parameters_from_task(self, task_id=None):
         'time': (task.time_start, task.time_end),
         'longitude': (task.longitude_min, task.longitude_max),
         'latitude': (task.latitude_min, task.latitude_max),
-        'measurements': task.satellite.get_measurements()
+        'measurements': task.get_measurements()
     }
 
     task.execution_start = datetime.now()
@@ -97,7 +106,9 @@ def validate_parameters(self, parameters, task_id=None):
 
     dc = DataAccessApi(config=task.config_path)
 
-    acquisitions = dc.list_acquisition_dates(**parameters)
+    # the only index search for this task - the datasets are passed down to the chunk processing tasks.
+    datasets = search_datasets(dc, **parameters)
+    acquisitions = get_acquisition_dates(datasets)
 
     if len(acquisitions) < 1:
         task.complete = True
@@ -113,7 +124,8 @@ def validate_parameters(self, parameters, task_id=None):
     validation_parameters.pop('time')
     validation_parameters.pop('measurements')
     validation_parameters.update({'product': 'terra_aster_gdm_' + task.area_id, 'platform': 'TERRA'})
-    if len(dc.list_acquisition_dates(**validation_parameters)) < 1:
+    dem_datasets = search_datasets(dc, **validation_parameters)
+    if len(dem_datasets) < 1:
         task.complete = True
         task.update_status("ERROR", "There is no elevation data for this parameter set.")
         return None
@@ -130,7 +142,7 @@ def validate_parameters(self, parameters, task_id=None):
         return None
 
     dc.close()
-    return parameters
+    return {**parameters, 'datasets': datasets}
 
 
 @task(name="slip.perform_task_chunking", base=BaseTask, bind=True)
@@ -144,7 +156,7 @@ def perform_task_chunking(self, parameters, task_id=None):
         parameters: parameter stream containing all kwargs to load data
 
     Returns:
-        parameters with a list of geographic and time ranges
+        parameters with a list of geographic and time ranges and the datasets in each geographic chunk
     """
     if parameters is None:
         return None
@@ -152,11 +164,12 @@ def perform_task_chunking(self, parameters, task_id=None):
     task = SlipTask.objects.get(pk=task_id)
     if check_cancel_task(self, task): return
 
-    dc = DataAccessApi(config=task.config_path)
-    dates = dc.list_acquisition_dates(**parameters)
+    datasets = parameters.pop('datasets')
+    dates = get_acquisition_dates(datasets)
     task_chunk_sizing = task.get_chunk_size()
 
-    geographic_chunks = create_geographic_chunks(
+    geographic_chunks = create_storage_aligned_chunks(
+        datasets,
         longitude=parameters['longitude'],
         latitude=parameters['latitude'],
         geographic_chunk_size=task_chunk_sizing['geographic'])
@@ -165,10 +178,14 @@ def perform_task_chunking(self, parameters, task_id=None):
 
     logger.info("Time chunks: {}, Geo chunks: {}".format(len(time_chunks), len(geographic_chunks)))
 
-    dc.close()
     if check_cancel_task(self, task): return
     task.update_status("WAIT", "Chunked parameter set.")
-    return {'parameters': parameters, 'geographic_chunks': geographic_chunks, 'time_chunks': time_chunks}
+    return {
+        'parameters': parameters,
+        'geographic_chunks': geographic_chunks,
+        'time_chunks': time_chunks,
+        'geographic_chunk_datasets': group_datasets_by_geographic_chunk(datasets, geographic_chunks)
+    }
 
 
 @task(name="slip.start_chunk_processing", base=BaseTask, bind=True)
@@ -188,6 +205,7 @@ def start_chunk_processing(self, chunk_details, task_id=None):
     parameters = chunk_details.get('parameters')
     geographic_chunks = chunk_details.get('geographic_chunks')
     time_chunks = chunk_details.get('time_chunks')
+    geographic_chunk_datasets = chunk_details.get('geographic_chunk_datasets')
 
     task = SlipTask.objects.get(pk=task_id)
     task.total_scenes = len(geographic_chunks) * len(time_chunks) * (task.get_chunk_size()['time']
@@ -207,10 +225,12 @@ def start_chunk_processing(self, chunk_details, task_id=None):
                 time_chunk_id=time_index,
                 geographic_chunk=geographic_chunk,
                 time_chunk=time_chunk,
+                datasets=select_datasets(geographic_chunk_datasets[geo_index], time=time_chunk),
                 **parameters) for time_index, time_chunk in enumerate(time_chunks)
         ]) | recombine_time_chunks.s(task_id=task_id) for geo_index, geographic_chunk in enumerate(geographic_chunks)
     ]) | recombine_geographic_chunks.s(task_id=task_id) | create_output_products.s(task_id=task_id)\
        | task_clean_up.si(task_id=task_id, task_model='SlipTask')).apply_async()
+    record_pipeline(task_id, processing_pipeline)
 
     return True
 
@@ -222,6 +242,7 @@ def processing_task(self,
                     time_chunk_id=None,
                     geographic_chunk=None,
                     time_chunk=None,
+                    datasets=None,
                     **parameters):
     """Process a parameter set and save the results to disk.
 
@@ -236,6 +257,7 @@ def processing_task(self,
         task_id, geo_chunk_id, time_chunk_id: identification for the main task and what chunk this is processing
         geographic_chunk: range of latitude and longitude to load - dict with keys latitude, longitude
         time_chunk: list of acquisition dates
+        datasets: list of datasets resolved by the planner that intersect this chunk
         parameters: all required kwargs to load data.
 
     Returns:
@@ -259,16 +281,23 @@ def processing_task(self,
     updated_params = {**parameters}
     updated_params.update(geographic_chunk)
     updated_params.update({'time': time_range})
-    data = dc.get_dataset_by_extent(**updated_params)
+    data = load_datasets(dc, select_datasets(datasets, time=time_range), **updated_params)
 
-    #grab dem data as well
-    dem_parameters = {**updated_params}
-    dem_parameters.update({'product': 'terra_aster_gdm_' + task.area_id, 'platform': 'TERRA'})
-    dem_parameters.pop('time')
-    dem_parameters.pop('measurements')
-    dem_data = dc.get_dataset_by_extent(**dem_parameters)
+    if 'time' not in data:
+        return None
 
-    if 'time' not in data or 'time' not in dem_data:
+    # elevation is static, so its slope is precomputed in the tile store shared by all tasks rather than loaded
+    # from the Data Cube and derived for every chunk.
+    slope = get_static_layer(
+        dc,
+        os.path.join(task.base_result_dir, 'static'),
+        'terra_aster_gdm_' + task.area_id,
+        'dem',
+        latitude=geographic_chunk['latitude'],
+        longitude=geographic_chunk['longitude'],
+        like=data,
+        kind='slope')
+    if slope is None:
         return None
 
     #target data is most recent, with the baseline being everything else.
@@ -292,7 +321,7 @@ def processing_task(self,
 
     if check_cancel_task(self, task): return
 
-    slip_data = compute_slip(combined_baseline, target_data, dem_data, no_data=task.satellite.no_data_value)
+    slip_data = compute_slip_from_slope(combined_baseline, target_data, slope, no_data=task.satellite.no_data_value)
     target_data['slip'] = slip_data
 
     metadata = task.metadata_from_dataset(
@@ -305,7 +334,7 @@ def processing_task(self,
 
     path = os.path.join(task.get_temp_path(), chunk_id + ".nc")
     clear_attrs(target_data)
-    export_xarray_to_netcdf(target_data, path)
+    store_chunk(task.apply_dtype_policy(target_data), path)
     dc.close()
     logger.info("Done with chunk: " + chunk_id)
     return path, metadata, {'geo_chunk_id': geo_chunk_id, 'time_chunk_id': time_chunk_id}
@@ -342,7 +371,7 @@ def recombine_time_chunks(self, chunks, task_id=None):
     combined_slip = None
     for index, chunk in enumerate(reversed(total_chunks)):
         metadata.update(chunk[1])
-        data = xr.open_dataset(chunk[0])
+        data = open_chunk(chunk[0])
         if combined_data is None:
             combined_data = data.drop('slip')
             # since this is going to interact with data/mosaicking, it needs a time dim
@@ -366,7 +395,7 @@ def recombine_time_chunks(self, chunks, task_id=None):
     # Since we added a time dim to combined_slip, we need to remove it here.
     combined_data['slip'] = combined_slip.isel(time=0, drop=True)
     path = os.path.join(task.get_temp_path(), "recombined_time_{}.nc".format(geo_chunk_id))
-    export_xarray_to_netcdf(combined_data, path)
+    store_chunk(combined_data, path)
     logger.info("Done combining time chunks for geo: " + str(geo_chunk_id))
     return path, metadata, {'geo_chunk_id': geo_chunk_id, 'time_chunk_id': time_chunk_id}
 
@@ -398,11 +427,11 @@ def recombine_geographic_chunks(self, chunks, task_id=None):
     chunk_data = []
     for index, chunk in enumerate(total_chunks):
         metadata = task.combine_metadata(metadata, chunk[1])
-        chunk_data.append(xr.open_dataset(chunk[0]))
+        chunk_data.append(open_chunk(chunk[0]))
     combined_data = combine_geographic_chunks(chunk_data)
 
     path = os.path.join(task.get_temp_path(), "recombined_geo_{}.nc".format(time_chunk_id))
-    export_xarray_to_netcdf(combined_data, path)
+    store_chunk(combined_data, path)
     logger.info("Done combining geographic chunks for time: " + str(time_chunk_id))
     return path, metadata, {'geo_chunk_id': geo_chunk_id, 'time_chunk_id': time_chunk_id}
 
@@ -422,7 +451,7 @@ def create_output_products(self, data, task_id=None):
     if check_cancel_task(self, task): return
 
     full_metadata = data[1]
-    dataset = xr.open_dataset(data[0])
+    dataset = open_chunk(data[0])
 
     task.result_path = os.path.join(task.get_result_path(), "slip_result.png")
     task.result_mosaic_path = os.path.join(task.get_result_path(), "mosaic.png")
@@ -431,7 +460,7 @@ def create_output_products(self, data, task_id=None):
     task.final_metadata_from_dataset(dataset)
     task.metadata_from_dict(full_metadata)
 
-    bands = task.satellite.get_measurements() + ['slip']
+    bands = task.get_measurements() + ['slip']
 
     export_xarray_to_netcdf(dataset, task.data_netcdf_path)
     write_geotiff_from_xr(task.data_path, dataset.astype('int32'), bands=bands, no_data=task.satellite.no_data_value)
@@ -26,9 +26,11 @@ from apps.dc_algorithm.models import Area, Compositor, Satellite
 from apps.dc_algorithm.models import (Query as BaseQuery, Metadata as BaseMetadata, Result as BaseResult, ResultType as
                                       BaseResultType, UserHistory as BaseUserHistory, AnimationType as
                                       BaseAnimationType, ToolInfo as BaseToolInfo)
+from apps.dc_algorithm.compositors import (create_mosaic_from_stack, create_max_ndvi_mosaic_from_stack,
+                                          create_min_ndvi_mosaic_from_stack)
+from apps.dc_algorithm.masking import count_clear
 
-from utils.data_cube_utilities.dc_mosaic import (create_mosaic, create_median_mosaic, create_max_ndvi_mosaic,
-                                                 create_min_ndvi_mosaic)
+from utils.data_cube_utilities.dc_mosaic import create_median_mosaic
 
 from datetime import datetime, timedelta
 import numpy as np
@@ -89,6 +91,15 @@ class Query(BaseQuery):
 
     base_result_dir = '/datacube/ui_results/spectral_anomaly'
 
+    # measurements required to compute each of the spectral indices.
+    spectral_index_measurements = {
+        'ndvi': ['nir', 'red'],
+        'ndwi': ['nir', 'swir1'],
+        'ndbi': ['swir1', 'nir'],
+        'evi': ['nir', 'red', 'blue'],
+        'fractional_cover': ['green', 'red', 'nir', 'swir1', 'swir2'],
+    }
+
     class Meta(BaseQuery.Meta):
         unique_together = (
             ('satellite', 'area_id', 'time_start', 'time_end', 'latitude_max', 'latitude_min',
@@ -136,14 +147,22 @@ class Query(BaseQuery):
 
         """
         processing_methods = {
-            'most_recent': create_mosaic,
-            'least_recent': create_mosaic,
-            'max_ndvi': create_max_ndvi_mosaic,
-            'min_ndvi': create_min_ndvi_mosaic,
+            'most_recent': create_mosaic_from_stack,
+            'least_recent': create_mosaic_from_stack,
+            'max_ndvi': create_max_ndvi_mosaic_from_stack,
+            'min_ndvi': create_min_ndvi_mosaic_from_stack,
             'median_pixel': create_median_mosaic
         }
 
-        return processing_methods.get(self.compositor.id, create_mosaic)
+        return processing_methods.get(self.compositor.id, create_mosaic_from_stack)
+
+    def get_required_measurements(self):
+        """implements get_required_measurements as required by the base class
+
+        See the base query class docstring for more information.
+        """
+        # the output image is colored by anomaly rather than true color so no png bands are required.
+        return self.spectral_index_measurements[self.query_type.result_id] + self.compositor.get_required_measurements()
 
     @classmethod
     def get_or_create_query_from_post(cls, form_data, pixel_drill=False):
@@ -168,13 +187,7 @@ class Query(BaseQuery):
         valid_query_fields = [field.name for field in cls._meta.get_fields()]
         query_data = {key: query_data[key] for key in valid_query_fields if key in query_data}
 
-        try:
-            query = cls.objects.get(pixel_drill_task=pixel_drill, **query_data)
-            return query, False
-        except cls.DoesNotExist:
-            query = cls(pixel_drill_task=pixel_drill, **query_data)
-            query.save()
-            return query, True
+        return cls.get_or_create_query(query_data, pixel_drill=pixel_drill)
 
 
 class Metadata(BaseMetadata):
@@ -200,7 +213,7 @@ class Metadata(BaseMetadata):
 
         """
         for metadata_index, time in enumerate(dataset.time.values.astype('M8[ms]').tolist()):
-            clean_pixels = np.sum(clear_mask[metadata_index, :, :] == True)
+            clean_pixels = count_clear(clear_mask, metadata_index)
             if time not in metadata:
                 metadata[time] = {}
                 metadata[time]['clean_pixels'] = 0
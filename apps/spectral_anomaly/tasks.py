@@ -6,7 +6,6 @@ from datetime import datetime, timedelta
 import shutil
 import xarray as xr
 import numpy as np
-from xarray.ufuncs import logical_or as xr_or
 from xarray.ufuncs import logical_and as xr_and
 from xarray.ufuncs import logical_not as xr_not
 import os
@@ -18,19 +17,25 @@ from utils.data_cube_utilities.dc_chunker import (create_geographic_chunks, crea
                                                   combine_geographic_chunks)
 from utils.data_cube_utilities.clean_mask import landsat_clean_mask_invalid
 from apps.dc_algorithm.utils import create_2d_plot
+from apps.dc_algorithm.colorize import ColorLookupTable, write_colorized_png
+from apps.dc_algorithm.data_access import (search_datasets, group_datasets_by_geographic_chunk, get_acquisition_dates,
+                                           load_datasets, create_storage_aligned_chunks)
+from apps.dc_algorithm.baseline import BASELINE_VERSION
+from apps.dc_algorithm.product_cache import load_cached_product, store_cached_product, get_dataset_ids
+from apps.dc_algorithm.unmixing import get_fractional_cover
 from utils.data_cube_utilities.import_export import export_xarray_to_netcdf
+from apps.dc_algorithm.chunk_transport import store_chunk, open_chunk
 
 from .models import SpectralAnomalyTask
 from apps.dc_algorithm.models import Satellite
 from apps.dc_algorithm.tasks import DCAlgorithmBase, check_cancel_task, task_clean_up
+from apps.dc_algorithm.pipelines import record_pipeline
 
 import matplotlib.pyplot as plt
-import matplotlib as mpl
 
 from utils.data_cube_utilities.dc_ndvi_anomaly import NDVI, EVI
 from utils.data_cube_utilities.dc_water_classifier import NDWI
 from utils.data_cube_utilities.urbanization import NDBI
-from utils.data_cube_utilities.dc_fractional_coverage_classifier import frac_coverage_classify
 
 logger = get_task_logger(__name__)
 
@@ -38,19 +43,29 @@ logger = get_task_logger(__name__)
 spectral_indices_function_map = {
     'ndvi': NDVI, 'ndwi': NDWI,
     'ndbi': NDBI, 'evi': EVI,
-    'fractional_cover': frac_coverage_classify
+    'fractional_cover': get_fractional_cover
 }
 spectral_indices_range_map = {
     'ndvi': (-1, 1), 'ndwi': (-1, 1),
     'ndbi': (-1, 1), 'evi': (-1, 1),
     'fractional_cover': (0, 100)
 }
+spectral_index_bands = {
+    'ndvi': ['ndvi'], 'ndwi': ['ndwi'],
+    'ndbi': ['ndbi'], 'evi': ['evi'],
+    'fractional_cover': ['bs', 'pv', 'npv']
+}
 spectral_indices_name_map = {
     'ndvi': 'NDVI', 'ndwi': 'NDWI',
     'ndbi': 'NDBI', 'evi': 'EVI',
     'fractional_cover': 'Fractional Cover'
 }
 
+# Flags packed into the status band of each processed chunk.
+STATUS_OUT_OF_RANGE = 1
+STATUS_NO_DATA = 2
+STATUS_CHANGE_OUT_OF_RANGE = 4
+
 
 class BaseTask(DCAlgorithmBase):
     app_name = 'spectral_anomaly'
@@ -92,7 +107,7 @@ def parse_parameters_from_task(self, task_id=None):
         'analysis_time': (task.analysis_time_start, task.analysis_time_end),
         'longitude': (task.longitude_min, task.longitude_max),
         'latitude': (task.latitude_min, task.latitude_max),
-        'measurements': task.satellite.get_measurements(),
+        'measurements': task.get_measurements(),
         'composite_range': (task.composite_threshold_min, task.composite_threshold_max),
         'change_range': (task.change_threshold_min, task.change_threshold_max),
     }
@@ -122,13 +137,13 @@ def validate_parameters(self, parameters, task_id=None):
 
     dc = DataAccessApi(config=task.config_path)
 
-    baseline_parameters = parameters.copy()
-    baseline_parameters['time'] = parameters['baseline_time']
-    baseline_acquisitions = dc.list_acquisition_dates(**baseline_parameters)
-
-    analysis_parameters = parameters.copy()
-    analysis_parameters['time'] = parameters['analysis_time']
-    analysis_acquisitions = dc.list_acquisition_dates(**analysis_parameters)
+    # the only index searches for this task - the datasets are passed down to the chunk processing tasks.
+    datasets = {
+        composite_name: search_datasets(dc, **{**parameters, 'time': parameters[composite_name + '_time']})
+        for composite_name in ['baseline', 'analysis']
+    }
+    baseline_acquisitions = get_acquisition_dates(datasets['baseline'])
+    analysis_acquisitions = get_acquisition_dates(datasets['analysis'])
 
     if len(baseline_acquisitions) < 1:
         task.complete = True
@@ -154,7 +169,7 @@ def validate_parameters(self, parameters, task_id=None):
         return None
 
     dc.close()
-    return parameters
+    return {**parameters, 'datasets': datasets}
 
 
 @task(name="spectral_anomaly.perform_task_chunking", base=BaseTask, bind=True)
@@ -168,7 +183,7 @@ def perform_task_chunking(self, parameters, task_id=None):
         parameters: parameter stream containing all kwargs to load data
 
     Returns:
-        parameters with a list of geographic and time ranges
+        parameters with a list of geographic ranges and the baseline and analysis datasets in each geographic chunk
     """
     if parameters is None:
         return None
@@ -176,21 +191,34 @@ def perform_task_chunking(self, parameters, task_id=None):
     task = SpectralAnomalyTask.objects.get(pk=task_id)
     if check_cancel_task(self, task): return
 
-    dc = DataAccessApi(config=task.config_path)
+    datasets = parameters.pop('datasets')
     task_chunk_sizing = task.get_chunk_size()
 
-    geographic_chunks = create_geographic_chunks(
+    geographic_chunks = create_storage_aligned_chunks(
+        datasets['baseline'] + datasets['analysis'],
         longitude=parameters['longitude'],
         latitude=parameters['latitude'],
         geographic_chunk_size=task_chunk_sizing['geographic'])
 
     # This app does not currently support time chunking.
 
-    dc.close()
+    grouped_datasets = {
+        composite_name: group_datasets_by_geographic_chunk(composite_datasets, geographic_chunks)
+        for composite_name, composite_datasets in datasets.items()
+    }
+    geographic_chunk_datasets = [{
+        composite_name: grouped_datasets[composite_name][geo_index]
+        for composite_name in grouped_datasets
+    } for geo_index in range(len(geographic_chunks))]
+
     if check_cancel_task(self, task): return
     task.update_status("WAIT", "Chunked parameter set.")
 
-    return {'parameters': parameters, 'geographic_chunks': geographic_chunks}
+    return {
+        'parameters': parameters,
+        'geographic_chunks': geographic_chunks,
+        'geographic_chunk_datasets': geographic_chunk_datasets
+    }
 
 
 @task(name="spectral_anomaly.start_chunk_processing", base=BaseTask, bind=True)
@@ -209,30 +237,18 @@ def start_chunk_processing(self, chunk_details, task_id=None):
 
     parameters = chunk_details.get('parameters')
     geographic_chunks = chunk_details.get('geographic_chunks')
+    geographic_chunk_datasets = chunk_details.get('geographic_chunk_datasets')
 
     task = SpectralAnomalyTask.objects.get(pk=task_id)
 
-    api = DataAccessApi(config=task.config_path)
-
     # Get an estimate of the amount of work to be done: the number of scenes
     # to process, also considering intermediate chunks to be combined.
-    # Determine the number of scenes for the baseline and analysis extents.
+    # Determine the number of scenes for the baseline and analysis extents
+    # from the datasets found for each geographic chunk.
     num_scenes = {}
-    params_temp = parameters.copy()
     for composite_name in ['baseline', 'analysis']:
-        num_scenes[composite_name] = 0
-        for geographic_chunk in geographic_chunks:
-            params_temp.update(geographic_chunk)
-            params_temp['measurements'] = []
-            # Use the corresponding time range for the baseline and analysis data.
-            params_temp['time'] = \
-                params_temp['baseline_time' if composite_name == 'baseline' else 'analysis_time']
-            params_temp_clean = params_temp.copy()
-            del params_temp_clean['baseline_time'], params_temp_clean['analysis_time'], \
-                params_temp_clean['composite_range'], params_temp_clean['change_range']
-            data = api.dc.load(**params_temp_clean)
-            if 'time' in data.coords:
-                num_scenes[composite_name] += len(data.time)
+        num_scenes[composite_name] = sum(
+            len(get_acquisition_dates(chunk_datasets[composite_name])) for chunk_datasets in geographic_chunk_datasets)
     # The number of scenes per geographic chunk for baseline and analysis extents.
     num_scn_per_chk_geo = {k: round(v/len(geographic_chunks)) for k, v in num_scenes.items()}
     # Scene processing progress is tracked in processing_task().
@@ -249,9 +265,11 @@ def start_chunk_processing(self, chunk_details, task_id=None):
                 geo_chunk_id=geo_index,
                 geographic_chunk=geographic_chunk,
                 num_scn_per_chk=num_scn_per_chk_geo,
+                datasets=geographic_chunk_datasets[geo_index],
                 **parameters) for geo_index, geographic_chunk in enumerate(geographic_chunks)
     ]) | recombine_geographic_chunks.s(task_id=task_id) | create_output_products.s(task_id=task_id) \
        | task_clean_up.si(task_id=task_id, task_model='SpectralAnomalyTask')).apply_async()
+    record_pipeline(task_id, processing_pipeline)
 
     return True
 
@@ -262,6 +280,7 @@ def processing_task(self,
                     geo_chunk_id=None,
                     geographic_chunk=None,
                     num_scn_per_chk=None,
+                    datasets=None,
                     **parameters):
     """Process a parameter set and save the results to disk.
 
@@ -275,6 +294,7 @@ def processing_task(self,
         geographic_chunk: range of latitude and longitude to load - dict with keys latitude, longitude
         num_scn_per_chk: A dictionary of the number of scenes per chunk for the baseline
                          and analysis extents. Used to determine task progress.
+        datasets: dict of the baseline and analysis datasets resolved by the planner that intersect this chunk
         parameters: all required kwargs to load data.
 
     Returns:
@@ -307,24 +327,49 @@ def processing_task(self,
         # Use the corresponding time range for the baseline and analysis data.
         updated_params['time'] = \
             updated_params['baseline_time' if composite_name == 'baseline' else 'analysis_time']
-        time_column_data = dc.get_dataset_by_extent(**updated_params)
-        # If this geographic chunk is outside the data extents, return None.
-        if len(time_column_data.dims) == 0: return None
+        measurements_list = parameters['measurements']
+
+        # Baseline composites only depend on the baseline scenes, so they are shared by every task over the same chunk.
+        cache_path = None
+        cached_composite = None
+        if composite_name == 'baseline':
+            cache_path = task.get_cache_path(
+                'baseline',
+                version=BASELINE_VERSION,
+                area_id=task.area_id,
+                product=parameters['product'],
+                measurements=measurements_list,
+                compositor=task.compositor.id,
+                geographic_chunk=geographic_chunk,
+                datasets=get_dataset_ids(datasets['baseline']))
+            cached_composite = load_cached_product(cache_path)
+
+        if cached_composite is not None:
+            composite, metadata = cached_composite
+        else:
+            time_column_data = load_datasets(dc, datasets[composite_name], **updated_params)
+            # If this geographic chunk is outside the data extents, return None.
+            if len(time_column_data.dims) == 0: return None
+
+            # Obtain the clean mask for the satellite.
+            time_column_clean_mask = task.satellite.get_clean_mask_func()(time_column_data)
+            # Obtain the mask for valid Landsat values.
+            time_column_invalid_mask = landsat_clean_mask_invalid(time_column_data).values
+            # Also exclude data points with the no_data value.
+            no_data_mask = time_column_data[measurements_list[0]].values != no_data_value
+            # Combine the clean masks.
+            time_column_clean_mask = time_column_clean_mask | time_column_invalid_mask | no_data_mask
+
+            # Obtain the composite.
+            composite = task.get_processing_method()(time_column_data,
+                                                     clean_mask=time_column_clean_mask,
+                                                     no_data=task.satellite.no_data_value)
+            # Update the metadata with the current data (baseline or analysis).
+            metadata = task.metadata_from_dataset(metadata, time_column_data,
+                                                  time_column_clean_mask, parameters)
+            if cache_path is not None:
+                store_cached_product(cache_path, composite, metadata)
 
-        # Obtain the clean mask for the satellite.
-        time_column_clean_mask = task.satellite.get_clean_mask_func()(time_column_data)
-        measurements_list = task.satellite.measurements.replace(" ", "").split(",")
-        # Obtain the mask for valid Landsat values.
-        time_column_invalid_mask = landsat_clean_mask_invalid(time_column_data).values
-        # Also exclude data points with the no_data value.
-        no_data_mask = time_column_data[measurements_list[0]].values != no_data_value
-        # Combine the clean masks.
-        time_column_clean_mask = time_column_clean_mask | time_column_invalid_mask | no_data_mask
-
-        # Obtain the composite.
-        composite = task.get_processing_method()(time_column_data,
-                                                 clean_mask=time_column_clean_mask,
-                                                 no_data=task.satellite.no_data_value)
         # Obtain the mask for valid Landsat values.
         composite_invalid_mask = landsat_clean_mask_invalid(composite).values
         # Also exclude data points with the no_data value via the compositing mask.
@@ -352,74 +397,69 @@ def processing_task(self,
 
         composites[composite_name] = composite
 
-        # Determine where the composite is out of range.
-        # We rename the resulting xarray.DataArray because calling to_netcdf()
-        # on it at the end of this function will save it as a Dataset
-        # with one data variable with the same name as the DataArray.
-        if spectral_index in ['ndvi', 'ndbi', 'ndwi', 'evi']:
-            composites_out_of_range[composite_name] = \
-                xr_or(composite[spectral_index] < task.composite_threshold_min,
-                      task.composite_threshold_max < composite[spectral_index]).rename(spectral_index)
-        else:  # Fractional Cover
-            # For fractional cover, a composite pixel is out of range if any of its
-            # fractional cover bands are out of range.
-            composites_out_of_range[composite_name] = xr_or(
-                xr_or(xr_or(composite['bs'] < task.composite_threshold_min,
-                            task.composite_threshold_max < composite['bs']),
-                      xr_or(composite['pv'] < task.composite_threshold_min,
-                            task.composite_threshold_max < composite['pv'])),
-                xr_or(composite['npv'] < task.composite_threshold_min,
-                      task.composite_threshold_max < composite['npv'])
-            ).rename(spectral_index)
-
-        # Update the metadata with the current data (baseline or analysis).
-        metadata = task.metadata_from_dataset(metadata, time_column_data,
-                                              time_column_clean_mask, parameters)
         # Record task progress (baseline or analysis composite data obtained).
         task.scenes_processed = F('scenes_processed') + num_scn_per_chk[composite_name]
         task.save(update_fields=['scenes_processed'])
     dc.close()
 
     if check_cancel_task(self, task): return
-    # Create a difference composite.
-    diff_composite = composites['analysis'] - composites['baseline']
-    # Find where either the baseline or analysis composite was out of range for a pixel.
-    composite_out_of_range = xr_or(*composites_out_of_range.values())
-    # Find where either the baseline or analysis composite was no_data.
-    if spectral_index in ['ndvi', 'ndbi', 'ndwi', 'evi']:
-        composite_no_data = xr_or(composites['baseline'][measurements_list[0]] == no_data_value,
-                                  composites['analysis'][measurements_list[0]] == no_data_value)
-        if spectral_index == 'evi':  # EVI returns no_data for values outside [-1,1].
-            composite_no_data = xr_or(
-                composite_no_data,
-                xr_or(composites['baseline'][spectral_index] == no_data_value,
-                      composites['analysis'][spectral_index] == no_data_value)
-            )
-    else:  # Fractional Cover
-        composite_no_data = xr_or(
-            xr_or(xr_or(composites['baseline']['bs'] == no_data_value,
-                        composites['baseline']['pv'] == no_data_value),
-                  composites['baseline']['npv'] == no_data_value),
-            xr_or(xr_or(composites['baseline']['bs'] == no_data_value,
-                        composites['baseline']['pv'] == no_data_value),
-                  composites['baseline']['npv'] == no_data_value)
-        )
-    composite_no_data = composite_no_data.rename(spectral_index)
-
-    # Drop unneeded data variables.
-    diff_composite = diff_composite.drop(measurements_list)
+    # Create the difference composite and its status band in a single pass.
+    diff_composite = _compute_anomaly(task, composites, measurements_list)
 
     if check_cancel_task(self, task): return
 
     composite_path = os.path.join(task.get_temp_path(), chunk_id + ".nc")
-    export_xarray_to_netcdf(diff_composite, composite_path)
-    composite_out_of_range_path = os.path.join(task.get_temp_path(), chunk_id + "_out_of_range.nc")
-    logger.info("composite_out_of_range:" + str(composite_out_of_range))
-    export_xarray_to_netcdf(composite_out_of_range, composite_out_of_range_path)
-    composite_no_data_path = os.path.join(task.get_temp_path(), chunk_id + "_no_data.nc")
-    export_xarray_to_netcdf(composite_no_data, composite_no_data_path)
-    return composite_path, composite_out_of_range_path, composite_no_data_path, \
-           metadata, {'geo_chunk_id': geo_chunk_id}
+    store_chunk(task.apply_dtype_policy(diff_composite), composite_path)
+    return composite_path, metadata, {'geo_chunk_id': geo_chunk_id}
+
+
+def _compute_anomaly(task, composites, measurements):
+    """Compute the difference composite and a status band for a chunk
+
+    The status band packs flags for where either composite was out of the user-specified composite range
+    (STATUS_OUT_OF_RANGE), either composite was the no_data value (STATUS_NO_DATA), and the change was out of
+    the optional user-specified change range (STATUS_CHANGE_OUT_OF_RANGE). Flags are accumulated into a single
+    uint8 array with one boolean scratch array rather than a full size mask per comparison.
+
+    Args:
+        task: SpectralAnomalyTask being processed
+        composites: dict of the 'baseline' and 'analysis' composites with the spectral index computed
+        measurements: list of measurements that were loaded - the first is used to find no_data pixels
+
+    Returns:
+        xarray dataset of the spectral index bands of analysis - baseline with a 'status' band.
+    """
+    spectral_index = task.query_type.result_id
+    no_data_value = task.satellite.no_data_value
+    bands = spectral_index_bands[spectral_index]
+    # EVI returns no_data for values outside [-1,1].
+    no_data_bands = {'evi': [measurements[0], 'evi'], 'fractional_cover': bands}.get(spectral_index, [measurements[0]])
+
+    template = composites['baseline'][bands[0]]
+    status = np.zeros(template.shape, dtype=np.uint8)
+    scratch = np.empty(template.shape, dtype=bool)
+
+    def flag(value, where):
+        np.bitwise_or(status, value, out=status, where=where)
+
+    for composite in composites.values():
+        for band in bands:
+            values = composite[band].values
+            flag(STATUS_OUT_OF_RANGE, np.less(values, task.composite_threshold_min, out=scratch))
+            flag(STATUS_OUT_OF_RANGE, np.greater(values, task.composite_threshold_max, out=scratch))
+        for band in no_data_bands:
+            flag(STATUS_NO_DATA, np.equal(composite[band].values, no_data_value, out=scratch))
+
+    diff_composite = xr.Dataset({band: composites['analysis'][band] - composites['baseline'][band] for band in bands})
+
+    cng_min, cng_max = task.change_threshold_min, task.change_threshold_max
+    if cng_min is not None and cng_max is not None:
+        change = diff_composite[bands[0] if spectral_index != 'fractional_cover' else 'pv'].values
+        flag(STATUS_CHANGE_OUT_OF_RANGE, np.less(change, cng_min, out=scratch))
+        flag(STATUS_CHANGE_OUT_OF_RANGE, np.greater(change, cng_max, out=scratch))
+
+    diff_composite['status'] = xr.DataArray(status, dims=template.dims, coords=template.coords)
+    return diff_composite
 
 
 @task(name="spectral_anomaly.recombine_geographic_chunks", base=BaseTask, bind=True)
@@ -443,26 +483,16 @@ def recombine_geographic_chunks(self, chunks, task_id=None):
     if check_cancel_task(self, task): return
 
     metadata = {}
-    composite_chunk_data = []
-    out_of_range_chunk_data = []
-    no_data_chunk_data = []
+    chunk_data = []
     for index, chunk in enumerate(total_chunks):
-        metadata = task.combine_metadata(metadata, chunk[3])
-        composite_chunk_data.append(xr.open_dataset(chunk[0]))
-        out_of_range_chunk_data.append(xr.open_dataset(chunk[1]))
-        no_data_chunk_data.append(xr.open_dataset(chunk[2]))
+        metadata = task.combine_metadata(metadata, chunk[1])
+        chunk_data.append(open_chunk(chunk[0]))
 
-    combined_composite_data = combine_geographic_chunks(composite_chunk_data)
-    combined_out_of_range_data = combine_geographic_chunks(out_of_range_chunk_data)
-    combined_no_data = combine_geographic_chunks(no_data_chunk_data)
+    combined_data = combine_geographic_chunks(chunk_data)
 
-    composite_path = os.path.join(task.get_temp_path(), "full_composite.nc")
-    export_xarray_to_netcdf(combined_composite_data, composite_path)
-    composite_out_of_range_path = os.path.join(task.get_temp_path(), "full_composite_out_of_range.nc")
-    export_xarray_to_netcdf(combined_out_of_range_data, composite_out_of_range_path)
-    no_data_path = os.path.join(task.get_temp_path(), "full_composite_no_data.nc")
-    export_xarray_to_netcdf(combined_no_data, no_data_path)
-    return composite_path, composite_out_of_range_path, no_data_path, metadata
+    path = os.path.join(task.get_temp_path(), "full_composite.nc")
+    store_chunk(combined_data, path)
+    return path, metadata
 
 
 @task(name="spectral_anomaly.create_output_products", base=BaseTask, bind=True)
@@ -484,17 +514,18 @@ def create_output_products(self, data, task_id=None):
 
     spectral_index = task.query_type.result_id
 
-    full_metadata = data[3]
+    full_metadata = data[1]
     # This is the difference (or "change") composite.
-    diff_composite = xr.open_dataset(data[0])
+    diff_composite = open_chunk(data[0])
+    # Areas without any chunk data are treated as no_data.
+    status = diff_composite['status'].fillna(STATUS_NO_DATA).values.astype(np.uint8)
+    diff_composite = diff_composite.drop('status')
     # This indicates where either the baseline or analysis composite
     # was outside the corresponding user-specified range.
-    orig_composite_out_of_range = xr.open_dataset(data[1]) \
-        [spectral_index].astype(np.bool).values
+    orig_composite_out_of_range = (status & STATUS_OUT_OF_RANGE) > 0
     # This indicates where either the baseline or analysis composite
     # was the no_data value.
-    composite_no_data = xr.open_dataset(data[2]) \
-        [spectral_index].astype(np.bool).values
+    composite_no_data = (status & STATUS_NO_DATA) > 0
 
     # Obtain a NumPy array of the data to create a plot later.
     if spectral_index in ['ndvi', 'ndbi', 'ndwi', 'evi']:
@@ -510,47 +541,38 @@ def create_output_products(self, data, task_id=None):
     task.metadata_from_dict(full_metadata)
 
     # 1. Prepare to save the spectral index net change as a GeoTIFF and NetCDF.
-    if spectral_index in ['ndvi', 'ndbi', 'ndwi', 'evi']:
-        bands = [spectral_index]
-    else:  # Fractional Coverage
-        bands = ['bs', 'pv', 'npv']
+    bands = spectral_index_bands[spectral_index]
     # 2. Prepare to create a PNG of the spectral index change composite.
     # 2.1. Find the min and max possible difference for the selected spectral index.
     spec_ind_min, spec_ind_max = spectral_indices_range_map[spectral_index]
     diff_min_possible, diff_max_possible = spec_ind_min - spec_ind_max, spec_ind_max - spec_ind_min
-    # 2.2. Scale the difference composite to the range [0, 1] for plotting.
-    image_data = np.interp(diff_comp_np_arr, (diff_min_possible, diff_max_possible), (0, 1))
-    # 2.3. Color by region.
-    # 2.3.1. First, color by change.
+    # 2.2. Color by region - values are quantized over the possible difference range and looked up
+    #      in a 256 color table, with each region's color applied over the last.
+    # 2.2.1. First, color by change.
     # If the user specified a change value range, the product is binary -
     # denoting which pixels fall within the net change threshold.
     cng_min, cng_max = task.change_threshold_min, task.change_threshold_max
     if cng_min is not None and cng_max is not None:
-        image_data = np.empty((*image_data.shape, 4), dtype=image_data.dtype)
-        image_data[:, :] = mpl.colors.to_rgba('red')
+        lookup_table = ColorLookupTable.from_color('red', (diff_min_possible, diff_max_possible))
     else:  # otherwise, use a red-green gradient.
-        cmap = plt.get_cmap('RdYlGn')
-        image_data = cmap(image_data)
-    # 2.3.2. Second, color regions in which the change was outside
+        lookup_table = ColorLookupTable.from_colormap(plt.get_cmap('RdYlGn'), (diff_min_possible, diff_max_possible))
+    color_overrides = []
+    # 2.2.2. Second, color regions in which the change was outside
     #        the optional user-specified change value range.
-    change_out_of_range_color = mpl.colors.to_rgba('black')
     if cng_min is not None and cng_max is not None:
-        diff_composite_out_of_range = (diff_comp_np_arr < cng_min) | (cng_max < diff_comp_np_arr)
-        image_data[diff_composite_out_of_range] = change_out_of_range_color
-    # 2.3.3. Third, color regions in which either the baseline or analysis
+        color_overrides.append(((status & STATUS_CHANGE_OUT_OF_RANGE) > 0, 'black'))
+    # 2.2.3. Third, color regions in which either the baseline or analysis
     #        composite was outside the user-specified composite value range.
-    composite_out_of_range_color = mpl.colors.to_rgba('white')
-    image_data[orig_composite_out_of_range] = composite_out_of_range_color
-    #  2.3.4. Fourth, color regions in which either the baseline or analysis
-    #         composite was the no_data value as transparent.
-    composite_no_data_color = np.array([0., 0., 0., 0.])
-    image_data[composite_no_data] = composite_no_data_color
+    color_overrides.append((orig_composite_out_of_range, 'white'))
+    # 2.2.4. Fourth, color regions in which either the baseline or analysis
+    #        composite was the no_data value as transparent.
+    color_overrides.append((composite_no_data, 'transparent'))
 
     # Create output products (NetCDF, GeoTIFF, PNG).
     export_xarray_to_netcdf(diff_composite, task.data_netcdf_path)
-    write_geotiff_from_xr(task.data_path, diff_composite.astype('float32'),
+    write_geotiff_from_xr(task.data_path, diff_composite.astype(task.processing_dtype),
                           bands=bands, no_data=task.satellite.no_data_value)
-    plt.imsave(task.result_path, image_data)
+    write_colorized_png(task.result_path, diff_comp_np_arr, lookup_table, overrides=color_overrides)
 
     # Plot metadata.
     dates = list(map(lambda x: datetime.strptime(x, "%m/%d/%Y"), task._get_field_as_list('acquisition_list')))
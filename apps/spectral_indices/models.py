@@ -26,9 +26,12 @@ from apps.dc_algorithm.models import Area, Compositor, Satellite
 from apps.dc_algorithm.models import (Query as BaseQuery, Metadata as BaseMetadata, Result as BaseResult, ResultType as
                                       BaseResultType, UserHistory as BaseUserHistory, AnimationType as
                                       BaseAnimationType, ToolInfo as BaseToolInfo)
-from utils.data_cube_utilities.dc_mosaic import (create_mosaic, create_median_mosaic, create_max_ndvi_mosaic,
-                                                 create_min_ndvi_mosaic)
+from apps.dc_algorithm.compositors import (create_mosaic_from_stack, create_max_ndvi_mosaic_from_stack,
+                                          create_min_ndvi_mosaic_from_stack, create_streaming_median_mosaic)
+from apps.dc_algorithm.band_math import compile_expression
+from apps.dc_algorithm.masking import count_clear
 
+from functools import partial
 import numpy as np
 
 
@@ -77,6 +80,20 @@ class Query(BaseQuery):
     }
 
     base_result_dir = '/datacube/ui_results/spectral_indices'
+    # indices are stored between tasks as int16 with four decimal places, like the surface reflectance they're computed
+    # from - values beyond +-3.2767 are clipped.
+    scaled_variables = {'band_math': 0.0001}
+
+    # band math expressions for each index - the measurements they require are inferred from the expression.
+    spectral_index_expressions = {
+        'ndvi': '(nir - red) / (nir + red)',
+        'evi': '2.5 * (nir - red) / (nir + 6 * red - 7.5 * blue + 1)',
+        'savi': '(nir - red) / (nir + red + 0.5) * 1.5',
+        'nbr': '(nir - swir2) / (nir + swir2)',
+        'nbr2': '(swir1 - swir2) / (swir1 + swir2)',
+        'ndwi': '(nir - swir1) / (nir + swir1)',
+        'ndbi': '(swir1 - nir) / (nir + swir1)',
+    }
 
     class Meta(BaseQuery.Meta):
         unique_together = (('satellite', 'area_id', 'time_start', 'time_end', 'latitude_max', 'latitude_min',
@@ -92,8 +109,10 @@ class Query(BaseQuery):
 
         See the base query class docstring for more information.
         """
-        if not self.compositor.is_iterative():
+        if not self.compositor.supports_time_chunking():
             return {'time': None, 'geographic': 0.05}
+        if not self.compositor.is_iterative():
+            return {'time': 25, 'geographic': 0.05}
         return {'time': 50, 'geographic': 0.1}
 
     def get_iterative(self):
@@ -116,14 +135,32 @@ class Query(BaseQuery):
         See the base query class docstring for more information.
         """
         processing_methods = {
-            'most_recent': create_mosaic,
-            'least_recent': create_mosaic,
-            'max_ndvi': create_max_ndvi_mosaic,
-            'min_ndvi': create_min_ndvi_mosaic,
-            'median_pixel': create_median_mosaic
+            'most_recent': create_mosaic_from_stack,
+            'least_recent': create_mosaic_from_stack,
+            'max_ndvi': create_max_ndvi_mosaic_from_stack,
+            'min_ndvi': create_min_ndvi_mosaic_from_stack,
+            'median_pixel': partial(create_streaming_median_mosaic,
+                                    data_range=(self.satellite.data_min, self.satellite.data_max),
+                                    mask_bands=self.satellite.get_mask_measurements())
         }
 
-        return processing_methods.get(self.compositor.id, create_mosaic)
+        return processing_methods.get(self.compositor.id, create_mosaic_from_stack)
+
+    def get_required_measurements(self):
+        """implements get_required_measurements as required by the base class
+
+        See the base query class docstring for more information.
+        """
+        if self.pixel_drill_task:
+            # pixel drills plot all of the indices.
+            return list(set(sum([self.get_spectral_index_expression(index).measurements
+                                 for index in self.spectral_index_expressions], [])))
+        return self.get_spectral_index_expression().measurements + self.compositor.get_required_measurements(
+        ) + self.get_png_measurements()
+
+    def get_spectral_index_expression(self, spectral_index=None):
+        """Get the compiled band math expression for a spectral index - the query's index by default"""
+        return compile_expression(self.spectral_index_expressions[spectral_index or self.query_type.result_id])
 
     @classmethod
     def get_or_create_query_from_post(cls, form_data, pixel_drill=False):
@@ -147,13 +184,7 @@ class Query(BaseQuery):
         valid_query_fields = [field.name for field in cls._meta.get_fields()]
         query_data = {key: query_data[key] for key in valid_query_fields if key in query_data}
 
-        try:
-            query = cls.objects.get(pixel_drill_task=pixel_drill, **query_data)
-            return query, False
-        except cls.DoesNotExist:
-            query = cls(pixel_drill_task=pixel_drill, **query_data)
-            query.save()
-            return query, True
+        return cls.get_or_create_query(query_data, pixel_drill=pixel_drill)
 
 
 class Metadata(BaseMetadata):
@@ -177,7 +208,7 @@ class Metadata(BaseMetadata):
         See the base metadata class docstring for more information.
         """
         for metadata_index, time in enumerate(dataset.time.values.astype('M8[ms]').tolist()):
-            clean_pixels = np.sum(clear_mask[metadata_index, :, :] == True)
+            clean_pixels = count_clear(clear_mask, metadata_index)
             if time not in metadata:
                 metadata[time] = {}
                 metadata[time]['clean_pixels'] = 0
@@ -10,18 +10,24 @@ import os
 import imageio
 
 from utils.data_cube_utilities.data_access_api import DataAccessApi
-from utils.data_cube_utilities.dc_utilities import (
-    create_cfmask_clean_mask, create_bit_mask, write_geotiff_from_xr, write_png_from_xr, write_single_band_png_from_xr,
-    add_timestamp_data_to_xr, clear_attrs, perform_timeseries_analysis, nan_to_num)
+from utils.data_cube_utilities.dc_utilities import (create_cfmask_clean_mask, create_bit_mask, write_geotiff_from_xr,
+                                                    write_png_from_xr, add_timestamp_data_to_xr, clear_attrs,
+                                                    perform_timeseries_analysis, nan_to_num)
 from utils.data_cube_utilities.dc_chunker import (create_geographic_chunks, create_time_chunks,
                                                   combine_geographic_chunks)
 from utils.data_cube_utilities.dc_water_quality import tsm, mask_water_quality
 from apps.dc_algorithm.utils import create_2d_plot
+from apps.dc_algorithm.colorize import write_single_band_png
+from apps.dc_algorithm.data_access import (search_datasets, select_datasets, group_datasets_by_geographic_chunk,
+                                           get_acquisition_dates, load_datasets, create_storage_aligned_chunks)
+from apps.dc_algorithm.derived_layers import get_derived_layer
 from utils.data_cube_utilities.import_export import export_xarray_to_netcdf
+from apps.dc_algorithm.chunk_transport import store_chunk, open_chunk
 
 from .models import TsmTask
 from apps.dc_algorithm.models import Satellite
 from apps.dc_algorithm.tasks import DCAlgorithmBase, check_cancel_task, task_clean_up
+from apps.dc_algorithm.pipelines import record_pipeline
 
 logger = get_task_logger(__name__)
 
@@ -51,7 +57,7 @@ def pixel_drill(task_id=None):
 
     wofs_data = task.get_processing_method()(single_pixel,
                                              clean_mask=clear_mask,
-                                             enforce_float64=True,
+                                             enforce_float64=task.processing_dtype == 'float64',
                                              no_data=task.satellite.no_data_value)
     wofs_data = wofs_data.where(wofs_data != task.satellite.no_data_value).isel(latitude=0, longitude=0)
     tsm_data = tsm(single_pixel, clean_mask=clear_mask, no_data=task.satellite.no_data_value)
@@ -110,7 +116,7 @@ def parse_parameters_from_task(self, task_id=None):
         'time': (task.time_start, task.time_end),
         'longitude': (task.longitude_min, task.longitude_max),
         'latitude': (task.latitude_min, task.latitude_max),
-        'measurements': task.satellite.get_measurements()
+        'measurements': task.get_measurements()
     }
 
     task.execution_start = datetime.now()
@@ -137,7 +143,9 @@ def validate_parameters(self, parameters, task_id=None):
 
     dc = DataAccessApi(config=task.config_path)
 
-    acquisitions = dc.list_combined_acquisition_dates(**parameters)
+    # the only index search for this task - the datasets are passed down to the chunk processing tasks.
+    datasets = search_datasets(dc, **parameters)
+    acquisitions = get_acquisition_dates(datasets)
 
     if len(acquisitions) < 1:
         task.complete = True
@@ -156,7 +164,7 @@ def validate_parameters(self, parameters, task_id=None):
         return None
 
     dc.close()
-    return parameters
+    return {**parameters, 'datasets': datasets}
 
 
 @task(name="tsm.perform_task_chunking", base=BaseTask, bind=True)
@@ -170,7 +178,7 @@ def perform_task_chunking(self, parameters, task_id=None):
         parameters: parameter stream containing all kwargs to load data
 
     Returns:
-        parameters with a list of geographic and time ranges
+        parameters with a list of geographic and time ranges and the datasets in each geographic chunk
     """
     if parameters is None:
         return None
@@ -178,11 +186,12 @@ def perform_task_chunking(self, parameters, task_id=None):
     task = TsmTask.objects.get(pk=task_id)
     if check_cancel_task(self, task): return
 
-    dc = DataAccessApi(config=task.config_path)
-    dates = dc.list_combined_acquisition_dates(**parameters)
+    datasets = parameters.pop('datasets')
+    dates = get_acquisition_dates(datasets)
     task_chunk_sizing = task.get_chunk_size()
 
-    geographic_chunks = create_geographic_chunks(
+    geographic_chunks = create_storage_aligned_chunks(
+        datasets,
         longitude=parameters['longitude'],
         latitude=parameters['latitude'],
         geographic_chunk_size=task_chunk_sizing['geographic'])
@@ -191,10 +200,14 @@ def perform_task_chunking(self, parameters, task_id=None):
         dates, _reversed=task.get_reverse_time(), time_chunk_size=task_chunk_sizing['time'])
     logger.info("Time chunks: {}, Geo chunks: {}".format(len(time_chunks), len(geographic_chunks)))
 
-    dc.close()
     if check_cancel_task(self, task): return
     task.update_status("WAIT", "Chunked parameter set.")
-    return {'parameters': parameters, 'geographic_chunks': geographic_chunks, 'time_chunks': time_chunks}
+    return {
+        'parameters': parameters,
+        'geographic_chunks': geographic_chunks,
+        'time_chunks': time_chunks,
+        'geographic_chunk_datasets': group_datasets_by_geographic_chunk(datasets, geographic_chunks)
+    }
 
 
 @task(name="tsm.start_chunk_processing", base=BaseTask, bind=True)
@@ -214,6 +227,7 @@ def start_chunk_processing(self, chunk_details, task_id=None):
     parameters = chunk_details.get('parameters')
     geographic_chunks = chunk_details.get('geographic_chunks')
     time_chunks = chunk_details.get('time_chunks')
+    geographic_chunk_datasets = chunk_details.get('geographic_chunk_datasets')
 
     task = TsmTask.objects.get(pk=task_id)
 
@@ -244,11 +258,13 @@ def start_chunk_processing(self, chunk_details, task_id=None):
                 time_chunk_id=time_index,
                 geographic_chunk=geographic_chunk,
                 time_chunk=time_chunk,
+                datasets=select_datasets(geographic_chunk_datasets[geo_index], time=time_chunk),
                 **parameters) for geo_index, geographic_chunk in enumerate(geographic_chunks)
         ]) | recombine_geographic_chunks.s(task_id=task_id, num_scn_per_chk=num_scn_per_chk)
         for time_index, time_chunk in enumerate(time_chunks)
     ]) | recombine_time_chunks.s(task_id=task_id) | create_output_products.s(task_id=task_id)\
        | task_clean_up.si(task_id=task_id, task_model='TsmTask')).apply_async()
+    record_pipeline(task_id, processing_pipeline)
 
     return True
 
@@ -260,6 +276,7 @@ def processing_task(self,
                     time_chunk_id=None,
                     geographic_chunk=None,
                     time_chunk=None,
+                    datasets=None,
                     **parameters):
     """Process a parameter set and save the results to disk.
 
@@ -272,6 +289,7 @@ def processing_task(self,
         task_id, geo_chunk_id, time_chunk_id: identification for the main task and what chunk this is processing
         geographic_chunk: range of latitude and longitude to load - dict with keys latitude, longitude
         time_chunk: list of acquisition dates
+        datasets: list of datasets resolved by the planner that intersect this chunk
         parameters: all required kwargs to load data.
 
     Returns:
@@ -303,7 +321,8 @@ def processing_task(self,
     base_index = (task.get_chunk_size()['time'] if task.get_chunk_size()['time'] is not None else 1) * time_chunk_id
     for time_index, time in enumerate(times):
         updated_params.update({'time': time})
-        data = dc.get_stacked_datasets_by_extent(**updated_params)
+        time_datasets = select_datasets(datasets, time=time)
+        data = load_datasets(dc, time_datasets, **updated_params)
 
         if check_cancel_task(self, task): return
 
@@ -313,10 +332,16 @@ def processing_task(self,
 
         clear_mask = task.satellite.get_clean_mask_func()(data)
 
-        wofs_data = task.get_processing_method()(data,
-                                                 clean_mask=clear_mask,
-                                                 enforce_float64=True,
-                                                 no_data=task.satellite.no_data_value)
+        # scenes that have already been classified, by any app, are read from the derived layer cache.
+        wofs_data = get_derived_layer('wofs',
+                                      task.get_processing_method(),
+                                      dc,
+                                      data,
+                                      time_datasets,
+                                      updated_params['measurements'],
+                                      task.satellite.get_clean_mask_func(),
+                                      enforce_float64=task.processing_dtype == 'float64',
+                                      no_data=task.satellite.no_data_value)
         water_analysis = perform_timeseries_analysis(
             wofs_data, 'wofs', intermediate_product=water_analysis, no_data=task.satellite.no_data_value)
 
@@ -337,14 +362,14 @@ def processing_task(self,
                                 "animation_{}_{}.nc".format(str(geo_chunk_id), str(base_index + time_index)))
             animated_data = tsm_data.isel(
                 time=0, drop=True) if task.animated_product.animation_id == "scene" else combined_data
-            export_xarray_to_netcdf(animated_data, path)
+            export_xarray_to_netcdf(task.apply_dtype_policy(animated_data), path)
 
         task.scenes_processed = F('scenes_processed') + 1
         task.save(update_fields=['scenes_processed'])
     if combined_data is None:
         return None
     path = os.path.join(task.get_temp_path(), chunk_id + ".nc")
-    export_xarray_to_netcdf(combined_data, path)
+    store_chunk(task.apply_dtype_policy(combined_data), path)
     dc.close()
     logger.info("Done with chunk: " + chunk_id)
     return path, metadata, {'geo_chunk_id': geo_chunk_id, 'time_chunk_id': time_chunk_id}
@@ -378,7 +403,7 @@ def recombine_geographic_chunks(self, chunks, task_id=None, num_scn_per_chk=None
     chunk_data = []
     for index, chunk in enumerate(total_chunks):
         metadata = task.combine_metadata(metadata, chunk[1])
-        chunk_data.append(xr.open_dataset(chunk[0]))
+        chunk_data.append(open_chunk(chunk[0]))
         task.scenes_processed = F('scenes_processed') + num_scn_per_chk
         task.save(update_fields=['scenes_processed'])
     combined_data = combine_geographic_chunks(chunk_data)
@@ -399,7 +424,7 @@ def recombine_geographic_chunks(self, chunks, task_id=None, num_scn_per_chk=None
                 export_xarray_to_netcdf(combine_geographic_chunks(animated_data), path)
 
     path = os.path.join(task.get_temp_path(), "recombined_geo_{}.nc".format(time_chunk_id))
-    export_xarray_to_netcdf(combined_data, path)
+    store_chunk(combined_data, path)
     logger.info("Done combining geographic chunks for time: " + str(time_chunk_id))
     return path, metadata, {'geo_chunk_id': geo_chunk_id, 'time_chunk_id': time_chunk_id}
 
@@ -465,7 +490,7 @@ def recombine_time_chunks(self, chunks, task_id=None):
     combined_data = None
     for index, chunk in enumerate(total_chunks):
         metadata.update(chunk[1])
-        data = xr.open_dataset(chunk[0])
+        data = open_chunk(chunk[0])
         if combined_data is None:
             if task.animated_product.animation_id != "none":
                 generate_animation(index, combined_data)
@@ -478,7 +503,7 @@ def recombine_time_chunks(self, chunks, task_id=None):
             generate_animation(index, combined_data)
 
     path = os.path.join(task.get_temp_path(), "recombined_time_{}.nc".format(geo_chunk_id))
-    export_xarray_to_netcdf(combined_data, path)
+    store_chunk(combined_data, path)
     logger.info("Done combining time chunks for geo: " + str(geo_chunk_id))
     return path, metadata, {'geo_chunk_id': geo_chunk_id, 'time_chunk_id': time_chunk_id}
 
@@ -498,7 +523,7 @@ def create_output_products(self, data, task_id=None):
     if check_cancel_task(self, task): return
 
     full_metadata = data[1]
-    dataset = xr.open_dataset(data[0]).astype('float64')
+    dataset = open_chunk(data[0]).astype(task.processing_dtype)
     dataset['variability'] = dataset['max'] - dataset['normalized_data']
     dataset['wofs'] = dataset.wofs / dataset.wofs_total_clean
     nan_to_num(dataset, 0)
@@ -522,7 +547,7 @@ def create_output_products(self, data, task_id=None):
     write_geotiff_from_xr(task.data_path, dataset_masked, bands=bands, no_data=task.satellite.no_data_value)
 
     for band, band_path in zip(bands, band_paths):
-        write_single_band_png_from_xr(
+        write_single_band_png(
             band_path,
             dataset_masked,
             band,
@@ -539,10 +564,10 @@ def create_output_products(self, data, task_id=None):
                 if os.path.exists(path):
                     png_path = os.path.join(task.get_temp_path(), "animation_{}.png".format(index))
                     animated_data = mask_water_quality(
-                        xr.open_dataset(path).astype('float64'),
+                        xr.open_dataset(path).astype(task.processing_dtype),
                         dataset.wofs) if task.animated_product.animation_id != "scene" else xr.open_dataset(
                             path)
-                    write_single_band_png_from_xr(
+                    write_single_band_png(
                         png_path,
                         animated_data,
                         task.animated_product.data_variable,
@@ -9,16 +9,21 @@ import os
 
 from utils.data_cube_utilities.data_access_api import DataAccessApi
 from utils.data_cube_utilities.dc_utilities import (create_cfmask_clean_mask, create_bit_mask, write_geotiff_from_xr,
-                                                    write_png_from_xr, write_single_band_png_from_xr,
-                                                    add_timestamp_data_to_xr, clear_attrs)
+                                                    write_png_from_xr, add_timestamp_data_to_xr, clear_attrs)
 from utils.data_cube_utilities.dc_chunker import (create_geographic_chunks, create_time_chunks,
                                                   combine_geographic_chunks)
 from apps.dc_algorithm.utils import create_2d_plot
+from apps.dc_algorithm.data_access import (search_datasets, select_datasets, group_datasets_by_geographic_chunk,
+                                           get_acquisition_dates, load_datasets, stack_fits_in_memory,
+                                           create_storage_aligned_chunks)
+from apps.dc_algorithm.compositors import finalize_median_sketch
 from utils.data_cube_utilities.import_export import export_xarray_to_netcdf
+from apps.dc_algorithm.chunk_transport import store_chunk, open_chunk
 
 from .models import UrbanizationTask
 from apps.dc_algorithm.models import Satellite
 from apps.dc_algorithm.tasks import DCAlgorithmBase, check_cancel_task, task_clean_up
+from apps.dc_algorithm.pipelines import record_pipeline
 
 logger = get_task_logger(__name__)
 
@@ -97,7 +102,7 @@ def parse_parameters_from_task(self, task_id=None):
         'time': (task.time_start, task.time_end),
         'longitude': (task.longitude_min, task.longitude_max),
         'latitude': (task.latitude_min, task.latitude_max),
-        'measurements': task.satellite.get_measurements()
+        'measurements': task.get_measurements()
     }
 
     task.execution_start = datetime.now()
@@ -124,16 +129,19 @@ def validate_parameters(self, parameters, task_id=None):
 
     dc = DataAccessApi(config=task.config_path)
 
+    # the only index search for this task - the datasets are passed down to the chunk processing tasks.
+    datasets = search_datasets(dc, **parameters)
+
     #validate for any number of criteria here - num acquisitions, etc.
-    acquisitions = dc.list_acquisition_dates(**parameters)
+    acquisitions = get_acquisition_dates(datasets)
     if len(acquisitions) < 1:
         task.complete = True
         task.update_status("ERROR", "There are no acquistions for this parameter set.")
         return None
 
-    if not task.compositor.is_iterative() and (task.time_end - task.time_start).days > 367:
+    if not task.compositor.supports_time_chunking() and (task.time_end - task.time_start).days > 367:
         task.complete = True
-        task.update_status("ERROR", "Median pixel operations are only supported for single year time periods.")
+        task.update_status("ERROR", "Geomedian and medoid operations are only supported for single year time periods.")
         return None
 
     if check_cancel_task(self, task): return
@@ -148,7 +156,7 @@ def validate_parameters(self, parameters, task_id=None):
         return None
 
     dc.close()
-    return parameters
+    return {**parameters, 'datasets': datasets}
 
 
 @task(name="urbanization.perform_task_chunking", base=BaseTask, bind=True)
@@ -162,7 +170,7 @@ def perform_task_chunking(self, parameters, task_id=None):
         parameters: parameter stream containing all kwargs to load data
 
     Returns:
-        parameters with a list of geographic and time ranges
+        parameters with a list of geographic and time ranges and the datasets in each geographic chunk
     """
     if parameters is None:
         return None
@@ -170,11 +178,12 @@ def perform_task_chunking(self, parameters, task_id=None):
     task = UrbanizationTask.objects.get(pk=task_id)
     if check_cancel_task(self, task): return
 
-    dc = DataAccessApi(config=task.config_path)
-    dates = dc.list_acquisition_dates(**parameters)
+    datasets = parameters.pop('datasets')
+    dates = get_acquisition_dates(datasets)
     task_chunk_sizing = task.get_chunk_size()
 
-    geographic_chunks = create_geographic_chunks(
+    geographic_chunks = create_storage_aligned_chunks(
+        datasets,
         longitude=parameters['longitude'],
         latitude=parameters['latitude'],
         geographic_chunk_size=task_chunk_sizing['geographic'])
@@ -183,10 +192,14 @@ def perform_task_chunking(self, parameters, task_id=None):
         dates, _reversed=task.get_reverse_time(), time_chunk_size=task_chunk_sizing['time'])
     logger.info("Time chunks: {}, Geo chunks: {}".format(len(time_chunks), len(geographic_chunks)))
 
-    dc.close()
     if check_cancel_task(self, task): return
     task.update_status("WAIT", "Chunked parameter set.")
-    return {'parameters': parameters, 'geographic_chunks': geographic_chunks, 'time_chunks': time_chunks}
+    return {
+        'parameters': parameters,
+        'geographic_chunks': geographic_chunks,
+        'time_chunks': time_chunks,
+        'geographic_chunk_datasets': group_datasets_by_geographic_chunk(datasets, geographic_chunks)
+    }
 
 
 @task(name="urbanization.start_chunk_processing", base=BaseTask, bind=True)
@@ -206,6 +219,7 @@ def start_chunk_processing(self, chunk_details, task_id=None):
     parameters = chunk_details.get('parameters')
     geographic_chunks = chunk_details.get('geographic_chunks')
     time_chunks = chunk_details.get('time_chunks')
+    geographic_chunk_datasets = chunk_details.get('geographic_chunk_datasets')
 
     task = UrbanizationTask.objects.get(pk=task_id)
 
@@ -229,12 +243,14 @@ def start_chunk_processing(self, chunk_details, task_id=None):
                 time_chunk_id=time_index,
                 geographic_chunk=geographic_chunk,
                 time_chunk=time_chunk,
+                datasets=select_datasets(geographic_chunk_datasets[geo_index], time=time_chunk),
                 **parameters) for time_index, time_chunk in enumerate(time_chunks)
-        ]) | recombine_time_chunks.s(task_id=task_id) | process_band_math.s(task_id=task_id)
+        ]) | recombine_time_chunks.s(task_id=task_id)
         for geo_index, geographic_chunk in enumerate(geographic_chunks)
     ]) | recombine_geographic_chunks.s(task_id=task_id)
        | create_output_products.s(task_id=task_id)
        | task_clean_up.si(task_id=task_id, task_model='UrbanizationTask')).apply_async()
+    record_pipeline(task_id, processing_pipeline)
 
     return True
 
@@ -246,6 +262,7 @@ def processing_task(self,
                     time_chunk_id=None,
                     geographic_chunk=None,
                     time_chunk=None,
+                    datasets=None,
                     **parameters):
     """Process a parameter set and save the results to disk.
 
@@ -258,6 +275,7 @@ def processing_task(self,
         task_id, geo_chunk_id, time_chunk_id: identification for the main task and what chunk this is processing
         geographic_chunk: range of latitude and longitude to load - dict with keys latitude, longitude
         time_chunk: list of acquisition dates
+        datasets: list of datasets resolved by the planner that intersect this chunk
         parameters: all required kwargs to load data.
 
     Returns:
@@ -276,16 +294,19 @@ def processing_task(self,
     def _get_datetime_range_containing(*time_ranges):
         return (min(time_ranges) - timedelta(microseconds=1), max(time_ranges) + timedelta(microseconds=1))
 
+    # iterative compositors are applied to the full time chunk at once if it fits in memory.
+    iterative = task.get_iterative() and not stack_fits_in_memory(
+        datasets, measurements=parameters['measurements'], **geographic_chunk)
     times = list(
         map(_get_datetime_range_containing, time_chunk)
-        if task.get_iterative() else [_get_datetime_range_containing(time_chunk[0], time_chunk[-1])])
+        if iterative else [_get_datetime_range_containing(time_chunk[0], time_chunk[-1])])
     dc = DataAccessApi(config=task.config_path)
     updated_params = parameters
     updated_params.update(geographic_chunk)
     iteration_data = None
     for time_index, time in enumerate(times):
         updated_params.update({'time': time})
-        data = dc.get_dataset_by_extent(**updated_params)
+        data = load_datasets(dc, select_datasets(datasets, time=time), **updated_params)
 
         if check_cancel_task(self, task): return
 
@@ -306,12 +327,12 @@ def processing_task(self,
 
         if check_cancel_task(self, task): return
 
-        task.scenes_processed = F('scenes_processed') + 1
+        task.scenes_processed = F('scenes_processed') + (1 if iterative else len(time_chunk))
         task.save(update_fields=['scenes_processed'])
     if iteration_data is None:
         return None
     path = os.path.join(task.get_temp_path(), chunk_id + ".nc")
-    export_xarray_to_netcdf(iteration_data, path)
+    store_chunk(task.apply_dtype_policy(iteration_data), path)
     dc.close()
     logger.info("Done with chunk: " + chunk_id)
     return path, metadata, {'geo_chunk_id': geo_chunk_id, 'time_chunk_id': time_chunk_id}
@@ -323,7 +344,7 @@ def recombine_time_chunks(self, chunks, task_id=None):
 
     Open time chunked processed datasets and recombine them using the same function
     that was used to process them. This assumes an iterative algorithm - if it is not, then it will
-    simply return the data again.
+    simply return the data again. Band math is applied to the recombined data before it is written.
 
     Args:
         chunks: list of the return from the processing_task function - path, metadata, and {chunk ids}
@@ -347,7 +368,7 @@ def recombine_time_chunks(self, chunks, task_id=None):
     combined_data = None
     for index, chunk in enumerate(total_chunks):
         metadata.update(chunk[1])
-        data = xr.open_dataset(chunk[0])
+        data = open_chunk(chunk[0])
         if combined_data is None:
             combined_data = data
             continue
@@ -363,37 +384,22 @@ def recombine_time_chunks(self, chunks, task_id=None):
     if combined_data is None:
         return None
 
+    # median sketches are only finalized once all of the time chunks have been merged.
+    combined_data = finalize_median_sketch(combined_data, no_data=task.satellite.no_data_value)
+    # band math is applied in memory so each chunk is only written once.
+    combined_data = _apply_band_math(task, combined_data)
     path = os.path.join(task.get_temp_path(), "recombined_time_{}.nc".format(geo_chunk_id))
-    export_xarray_to_netcdf(combined_data, path)
+    store_chunk(task.apply_dtype_policy(combined_data), path)
     logger.info("Done combining time chunks for geo: " + str(geo_chunk_id))
     return path, metadata, {'geo_chunk_id': geo_chunk_id, 'time_chunk_id': time_chunk_id}
 
 
-@task(name="urbanization.process_band_math", base=BaseTask, bind=True)
-def process_band_math(self, chunk, task_id=None):
-    """Apply some band math to a chunk and return the args
-
-    Opens the chunk dataset and applys some band math defined by _apply_band_math(dataset)
-    _apply_band_math creates some product using the bands already present in the dataset and
-    returns the dataarray. The data array is then appended under 'band_math', then saves the
-    result to disk in the same path as the nc file already exists.
-    """
-
-    def _apply_band_math(dataset):
-        ndvi = (dataset.nir - dataset.red) / (dataset.nir + dataset.red)
-        ndwi = (dataset.green - dataset.nir) / (dataset.green + dataset.nir)
-        ndbi = (dataset.swir2 - dataset.nir) / (dataset.swir2 + dataset.nir)
-        return ndvi, ndwi, ndbi
-
-    if chunk is None:
-        return None
-
-    dataset = xr.open_dataset(chunk[0]).load()
-    dataset['ndvi'], dataset['ndwi'], dataset['ndbi'] = _apply_band_math(dataset)
-    #remove previous nc and write band math to disk
-    os.remove(chunk[0])
-    export_xarray_to_netcdf(dataset, chunk[0])
-    return chunk
+def _apply_band_math(task, dataset):
+    """Add the ndvi, ndwi, and ndbi bands to a recombined chunk"""
+    dataset['ndvi'] = (dataset.nir - dataset.red) / (dataset.nir + dataset.red)
+    dataset['ndwi'] = (dataset.green - dataset.nir) / (dataset.green + dataset.nir)
+    dataset['ndbi'] = (dataset.swir2 - dataset.nir) / (dataset.swir2 + dataset.nir)
+    return dataset
 
 
 @task(name="urbanization.recombine_geographic_chunks", base=BaseTask, bind=True)
@@ -423,11 +429,11 @@ def recombine_geographic_chunks(self, chunks, task_id=None):
     chunk_data = []
     for index, chunk in enumerate(total_chunks):
         metadata = task.combine_metadata(metadata, chunk[1])
-        chunk_data.append(xr.open_dataset(chunk[0]))
+        chunk_data.append(open_chunk(chunk[0]))
     combined_data = combine_geographic_chunks(chunk_data)
 
     path = os.path.join(task.get_temp_path(), "recombined_geo_{}.nc".format(time_chunk_id))
-    export_xarray_to_netcdf(combined_data, path)
+    store_chunk(combined_data, path)
     logger.info("Done combining geographic chunks for time: " + str(time_chunk_id))
     return path, metadata, {'geo_chunk_id': geo_chunk_id, 'time_chunk_id': time_chunk_id}
 
@@ -447,7 +453,7 @@ def create_output_products(self, data, task_id=None):
     if check_cancel_task(self, task): return
 
     full_metadata = data[1]
-    dataset = xr.open_dataset(data[0])
+    dataset = open_chunk(data[0])
 
     task.result_path = os.path.join(task.get_result_path(), "urbanization.png")
     task.mosaic_path = os.path.join(task.get_result_path(), "png_mosaic.png")
@@ -456,10 +462,11 @@ def create_output_products(self, data, task_id=None):
     task.final_metadata_from_dataset(dataset)
     task.metadata_from_dict(full_metadata)
 
-    bands = task.satellite.get_measurements() + ['ndvi', 'ndwi', 'ndbi']
+    bands = task.get_measurements() + ['ndvi', 'ndwi', 'ndbi']
 
     export_xarray_to_netcdf(dataset, task.data_netcdf_path)
-    write_geotiff_from_xr(task.data_path, dataset.astype('float64'), bands=bands, no_data=task.satellite.no_data_value)
+    write_geotiff_from_xr(
+        task.data_path, dataset.astype(task.processing_dtype), bands=bands, no_data=task.satellite.no_data_value)
     write_png_from_xr(
         task.mosaic_path,
         dataset,
@@ -210,6 +210,15 @@ CELERY_TASK_SERIALIZER = 'pickle'
 CELERY_RESULT_SERIALIZER = 'pickle'
 CELERYD_PREFETCH_MULTIPLIER = 1
 CELERY_TASK_ACKS_LATE = True
+# running tasks are reported as STARTED so cancellation can wait for them to stop.
+CELERY_TRACK_STARTED = True
+# hand intermediate chunk products from processing to recombination tasks through shared memory - only enable this
+# where chunks are recombined on the node that processed them. Chunks are written as files instead if shared memory
+# is full, unless CHUNK_SHARED_MEMORY_FALLBACK is False.
+CHUNK_SHARED_MEMORY = False
+CHUNK_SHARED_MEMORY_FALLBACK = True
+# per-scene derived layers, e.g. WOFS classifications, are stored here by storage tile and shared by all apps.
+DERIVED_LAYER_DIR = '/datacube/ui_results/derived_layers'
 CELERY_TIMEZONE = 'UTC'
 # this is done to prevent weird mem issues as well as to force
 # close db connections for dc on demand.